@@ -1,13 +1,30 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import sqlite3
+import time
 from pathlib import Path
 
+from msx_basic_analyzer import cross_references
+from msx_basic_lexer import DEFAULT_DIALECT, split_line_number
+
+
+DEFAULT_DECODE_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 
 class AppDatabase:
-    def __init__(self, db_path: Path) -> None:
+    def __init__(self, db_path: Path, decode_cache_max_bytes: int | None = None) -> None:
         self.db_path = db_path
         self._ensure_schema()
+        if decode_cache_max_bytes is None:
+            saved = self.get_setting("decode_cache_max_bytes")
+            decode_cache_max_bytes = int(saved) if saved and saved.isdigit() else DEFAULT_DECODE_CACHE_BYTES
+        self.decode_cache_max_bytes = decode_cache_max_bytes
 
     def _connect(self) -> sqlite3.Connection:
         conn = sqlite3.connect(self.db_path)
@@ -40,6 +57,46 @@ class AppDatabase:
                 )
                 """
             )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS decode_cache (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    segments TEXT NOT NULL,
+                    byte_size INTEGER NOT NULL,
+                    last_used INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS decode_cache_last_used ON decode_cache (last_used)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS xref_lines (
+                    path TEXT NOT NULL,
+                    line_num INTEGER NOT NULL,
+                    line_hash TEXT NOT NULL,
+                    PRIMARY KEY (path, line_num)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS xref (
+                    path TEXT NOT NULL,
+                    line_num INTEGER NOT NULL,
+                    col INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    access TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS xref_name ON xref (kind, name, path)")
+            conn.execute("CREATE INDEX IF NOT EXISTS xref_line ON xref (path, line_num)")
 
     def get_setting(self, key: str, default: str | None = None) -> str | None:
         with self._connect() as conn:
@@ -72,3 +129,172 @@ class AppDatabase:
                 """,
                 (path, timestamp),
             )
+
+    def get_decoded_segments(
+        self, path: str, mtime_ns: int, size: int, digest: str
+    ) -> list[tuple[str, str]] | None:
+        """Return the cached segment list for this exact file version, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT segments FROM decode_cache
+                WHERE path = ? AND mtime_ns = ? AND size = ? AND content_hash = ?
+                """,
+                (path, mtime_ns, size, digest),
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE decode_cache SET last_used = ? WHERE path = ?",
+                (time.time_ns(), path),
+            )
+        return [(kind, text) for kind, text in json.loads(row["segments"])]
+
+    def put_decoded_segments(
+        self, path: str, mtime_ns: int, size: int, digest: str, segments: list[tuple[str, str]]
+    ) -> None:
+        payload = json.dumps(segments, ensure_ascii=False, separators=(",", ":"))
+        byte_size = len(payload.encode("utf-8"))
+        if byte_size > self.decode_cache_max_bytes:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO decode_cache (path, mtime_ns, size, content_hash, segments, byte_size, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    mtime_ns = excluded.mtime_ns,
+                    size = excluded.size,
+                    content_hash = excluded.content_hash,
+                    segments = excluded.segments,
+                    byte_size = excluded.byte_size,
+                    last_used = excluded.last_used
+                """,
+                (path, mtime_ns, size, digest, payload, byte_size, time.time_ns()),
+            )
+            self._evict_decode_cache(conn)
+
+    def _evict_decode_cache(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used entries until the cache fits its byte budget."""
+        total = 0
+        stale = []
+        for row in conn.execute("SELECT path, byte_size FROM decode_cache ORDER BY last_used DESC"):
+            total += row["byte_size"]
+            if total > self.decode_cache_max_bytes:
+                stale.append((row["path"],))
+        if stale:
+            conn.executemany("DELETE FROM decode_cache WHERE path = ?", stale)
+
+    def clear_decode_cache(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM decode_cache")
+
+    def save_renum_map(self, mapping: dict[int, int]) -> None:
+        """Replace the old -> new line numbers of the last RENUM, in one transaction."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM renum_map")
+            conn.executemany("INSERT INTO renum_map (old_ln, new_ln) VALUES (?, ?)", mapping.items())
+
+    def update_cross_reference(self, path: str, content: str, dialect: str | None = None) -> int:
+        """Bring the cross-reference of path up to date with content; returns how many lines were re-indexed.
+
+        Lines are compared by hash with the stored version, so only new or
+        edited lines are parsed again and removed lines are dropped. The
+        dialect is part of the hash: switching it re-indexes every line.
+        """
+        prefix = f"{dialect or DEFAULT_DIALECT}\n"
+        current: dict[int, tuple[str, str]] = {}
+        for line in content.splitlines():
+            line_num, _ = split_line_number(line)
+            if line_num is not None:
+                # A repeated line number replaces the earlier line, as on the MSX.
+                current[line_num] = (line, content_hash((prefix + line).encode("latin-1", errors="replace")))
+
+        with self._connect() as conn:
+            stored = {
+                row["line_num"]: row["line_hash"]
+                for row in conn.execute("SELECT line_num, line_hash FROM xref_lines WHERE path = ?", (path,))
+            }
+            changed = [line_num for line_num, (_, digest) in current.items() if stored.get(line_num) != digest]
+            stale = [(path, line_num) for line_num in stored if line_num not in current]
+            stale.extend((path, line_num) for line_num in changed if line_num in stored)
+            if stale:
+                conn.executemany("DELETE FROM xref WHERE path = ? AND line_num = ?", stale)
+                conn.executemany("DELETE FROM xref_lines WHERE path = ? AND line_num = ?", stale)
+
+            rows = []
+            for line_num in changed:
+                line, _ = current[line_num]
+                _, refs = cross_references(line, dialect)
+                rows.extend((path, line_num, ref.column, ref.kind, ref.name, ref.access) for ref in refs)
+            conn.executemany(
+                "INSERT INTO xref (path, line_num, col, kind, name, access) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.executemany(
+                "INSERT INTO xref_lines (path, line_num, line_hash) VALUES (?, ?, ?)",
+                [(path, line_num, current[line_num][1]) for line_num in changed],
+            )
+        return len(changed)
+
+    def remove_cross_reference(self, path: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM xref WHERE path = ?", (path,))
+            conn.execute("DELETE FROM xref_lines WHERE path = ?", (path,))
+
+    def find_variable(
+        self, name: str, access: str | None = None, path: str | None = None
+    ) -> list[tuple[str, int, int, str]]:
+        """(path, line, column, 'read'|'write') of each use of a variable; arrays are named 'A()'."""
+        query = "SELECT path, line_num, col, access FROM xref WHERE kind = 'variable' AND name = ?"
+        params: list = [name.upper()]
+        if path is not None:
+            query += " AND path = ?"
+            params.append(path)
+        if access is not None:
+            query += " AND access = ?"
+            params.append(access)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY path, line_num, col", params).fetchall()
+        return [(row["path"], row["line_num"], row["col"], row["access"]) for row in rows]
+
+    def references_to_line(self, path: str, line_num: int) -> list[tuple[int, int, str]]:
+        """(line, column, flow type) of every GOTO, GOSUB, THEN, RESTORE, ... that names line_num."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT line_num, col, access FROM xref
+                WHERE kind = 'line' AND name = ? AND path = ?
+                ORDER BY line_num, col
+                """,
+                (str(line_num), path),
+            ).fetchall()
+        return [(row["line_num"], row["col"], row["access"]) for row in rows]
+
+    def files_using_keyword(self, keyword: str) -> list[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT path FROM xref WHERE kind = 'keyword' AND name = ? ORDER BY path",
+                (keyword.upper(),),
+            ).fetchall()
+        return [row["path"] for row in rows]
+
+    def data_restore_pairs(self, path: str) -> list[tuple[int, int, int | None]]:
+        """(RESTORE line, column, DATA line it points at) for each RESTORE n of path.
+
+        RESTORE n moves the DATA pointer to the first DATA line at or after n;
+        None means no DATA line follows.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT r.line_num, r.col,
+                    (SELECT MIN(d.line_num) FROM xref d
+                     WHERE d.path = r.path AND d.kind = 'data' AND d.line_num >= CAST(r.name AS INTEGER)
+                    ) AS data_line
+                FROM xref r
+                WHERE r.path = ? AND r.kind = 'line' AND r.access = 'RESTORE'
+                ORDER BY r.line_num, r.col
+                """,
+                (path,),
+            ).fetchall()
+        return [(row["line_num"], row["col"], row["data_line"]) for row in rows]
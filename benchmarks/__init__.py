@@ -0,0 +1,5 @@
+"""Benchmarks for the MSX-BASIC decoder, tokenizer and analyzer.
+
+Run from the project root:
+    python -m benchmarks.run [--sizes 1000 10000] [--save-baseline]
+"""
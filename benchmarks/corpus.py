@@ -0,0 +1,125 @@
+"""Synthetic tokenized MSX-BASIC programs for benchmarking."""
+from __future__ import annotations
+
+import random
+from typing import NamedTuple
+
+from msx_basic_decoder import decode_msx_basic
+from msx_basic_encoder import BASIC_START_ADDRESS, encode_msx_basic_line
+
+
+class CorpusSpec(NamedTuple):
+    lines: int = 1000
+    # Relative weights of the statement kinds, see _Generator.statement.
+    token_mix: tuple[tuple[str, float], ...] = (
+        ("assign", 4.0),
+        ("print", 3.0),
+        ("if", 2.0),
+        ("jump", 1.5),
+        ("for", 1.0),
+        ("poke", 1.0),
+        ("function", 1.5),
+    )
+    rem_density: float = 0.1  # share of lines that end in a REM/' comment
+    data_density: float = 0.1  # share of lines that are DATA statements
+    # Relative weights of the numeric literal kinds.
+    number_mix: tuple[tuple[str, float], ...] = (
+        ("small", 4.0),
+        ("byte", 2.0),
+        ("int", 1.0),
+        ("single", 2.0),
+        ("double", 0.5),
+        ("hex", 0.5),
+    )
+    max_statements: int = 4
+    seed: int = 1
+
+
+class Corpus(NamedTuple):
+    spec: CorpusSpec
+    data: bytes
+    text: str
+
+
+_VARIABLES = ("A", "B", "C", "X", "Y", "I", "J", "N", "SC", "LV", "X1", "Y2")
+_STRINGS = ("A$", "B$", "N$", "T$")
+
+
+class _Generator:
+    def __init__(self, spec: CorpusSpec, step: int) -> None:
+        self.spec = spec
+        self.step = step
+        self.rng = random.Random(spec.seed)
+        self.statement_kinds = [kind for kind, _weight in spec.token_mix]
+        self.statement_weights = [weight for _kind, weight in spec.token_mix]
+        self.number_kinds = [kind for kind, _weight in spec.number_mix]
+        self.number_weights = [weight for _kind, weight in spec.number_mix]
+
+    def number(self) -> str:
+        rng = self.rng
+        kind = rng.choices(self.number_kinds, self.number_weights)[0]
+        if kind == "small":
+            return str(rng.randrange(10))
+        if kind == "byte":
+            return str(rng.randrange(10, 256))
+        if kind == "int":
+            return str(rng.randrange(256, 32768))
+        if kind == "single":
+            return f"{rng.randrange(1, 1000)}.{rng.randrange(1, 100)}"
+        if kind == "double":
+            return f"{rng.randrange(1, 10)}.{rng.randrange(10 ** 9, 10 ** 10)}"
+        return f"&H{rng.randrange(0x100, 0x10000):X}"
+
+    def line_ref(self) -> str:
+        return str(self.rng.randrange(1, self.spec.lines + 1) * self.step)
+
+    def statement(self) -> str:
+        rng = self.rng
+        kind = rng.choices(self.statement_kinds, self.statement_weights)[0]
+        var = rng.choice(_VARIABLES)
+        if kind == "assign":
+            return f"{var}={rng.choice(_VARIABLES)}+{self.number()}*{rng.choice(_VARIABLES)}"
+        if kind == "print":
+            return f'PRINT "SCORE {rng.randrange(1000)}";{rng.choice(_STRINGS)};{var}'
+        if kind == "if":
+            return f"IF {var}>{self.number()} THEN {self.line_ref()} ELSE {self.line_ref()}"
+        if kind == "jump":
+            return f"{rng.choice(('GOTO', 'GOSUB'))} {self.line_ref()}"
+        if kind == "for":
+            return f"FOR {var}=1 TO {self.number()} STEP 2:NEXT {var}"
+        if kind == "poke":
+            return f"{rng.choice(('POKE', 'VPOKE'))} {self.number()},{self.number()}"
+        return f"{var}=INT(RND(1)*{self.number()})+ASC(LEFT$({rng.choice(_STRINGS)},1))"
+
+    def line(self) -> str:
+        rng = self.rng
+        spec = self.spec
+        if rng.random() < spec.data_density:
+            return "DATA " + ",".join(self.number() for _ in range(rng.randrange(8, 24)))
+        code = ":".join(self.statement() for _ in range(rng.randint(1, spec.max_statements)))
+        if rng.random() < spec.rem_density:
+            code += rng.choice((":REM ", " '")) + "COMMENT " * rng.randint(1, 8)
+        return code
+
+
+def generate_corpus(spec: CorpusSpec = CorpusSpec()) -> Corpus:
+    """Build a tokenized program plus its decoded listing.
+
+    Line numbers run 10, 20, 30... (1, 2, 3... when that would pass 65529).
+    Programs larger than the MSX address space are still produced for
+    benchmarking: their next-line links wrap around, which only matters
+    to code that follows the links.
+    """
+    step = 10 if spec.lines * 10 <= 65529 else 1
+    generator = _Generator(spec, step)
+    out = bytearray(b"\xFF")
+    for index in range(1, spec.lines + 1):
+        line_number = index * step
+        body = encode_msx_basic_line(generator.line())
+        link = (BASIC_START_ADDRESS + len(out) - 1 + 4 + len(body) + 1) & 0xFFFF or 1
+        out += bytes([link & 0xFF, link >> 8, line_number & 0xFF, line_number >> 8])
+        out += body
+        out += b"\x00"
+    out += b"\x00\x00"
+    data = bytes(out)
+    return Corpus(spec, data, decode_msx_basic(data))
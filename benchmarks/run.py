@@ -0,0 +1,169 @@
+"""Time the decoder, encoder, lexer and analyzer hot paths and compare them with a saved baseline.
+
+    python -m benchmarks.run                   # run, fail if slower than the baseline
+    python -m benchmarks.run --save-baseline   # record this machine's numbers
+
+Baselines are machine-specific, so each machine keeps its own file
+(benchmarks/baseline.json by default, not versioned).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.corpus import Corpus, CorpusSpec, generate_corpus
+from msx_basic_analyzer import MSXBasicAnalyzer
+from msx_basic_decoder import decode_msx_basic, decode_msx_basic_segments, decode_msx_basic_spans
+from msx_basic_encoder import encode_msx_basic_line
+from msx_basic_highlighter import highlight_line
+from msx_basic_lexer import scan, split_line_number, tokenize
+from msx_basic_renum import renumber
+
+
+DEFAULT_SIZES = (1000, 10000, 64000)
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+MIN_SECONDS = 0.5
+MIN_REPEATS = 3
+
+
+def _analyze(text: str) -> None:
+    MSXBasicAnalyzer(text).analyze()
+
+
+def _highlight(text: str) -> None:
+    for line in text.splitlines():
+        highlight_line(line)
+
+
+def _renumber(text: str) -> None:
+    renumber(text.splitlines(), 1, None, 1)
+
+
+def _encode(text: str) -> None:
+    # The corpora are larger than the MSX address space, which encode_msx_basic refuses;
+    # this is all of its work except the link bytes.
+    for line in text.splitlines():
+        encode_msx_basic_line(line[split_line_number(line)[1]:])
+
+
+def _tokenize(text: str) -> None:
+    for line in text.splitlines():
+        code_start = split_line_number(line)[1]
+        tokenize(line[code_start:], code_start)
+
+
+def _scan(text: str) -> None:
+    for line in text.splitlines():
+        scan(line[split_line_number(line)[1]:])
+
+
+# name -> (function, takes tokenized bytes (True) or the decoded listing (False))
+BENCHMARKS: dict[str, tuple[Callable, bool]] = {
+    "decode_msx_basic": (decode_msx_basic, True),
+    "decode_msx_basic_segments": (decode_msx_basic_segments, True),
+    "decode_msx_basic_spans": (decode_msx_basic_spans, True),
+    "encode_msx_basic": (_encode, False),
+    "tokenize": (_tokenize, False),
+    "scan": (_scan, False),
+    "MSXBasicAnalyzer.analyze": (_analyze, False),
+    "highlight_line": (_highlight, False),
+    "renumber": (_renumber, False),
+}
+
+
+def measure(func: Callable, arg) -> dict[str, float]:
+    """ops/s from the median of repeated runs, plus peak traced memory of one run."""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < MIN_REPEATS or time.perf_counter() - started < MIN_SECONDS:
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(arg)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        "ops_per_sec": 1.0 / median if median > 0 else float("inf"),
+        "median_ms": median * 1000.0,
+        "peak_kib": peak / 1024.0,
+        "repeats": len(timings),
+    }
+
+
+def run(sizes: tuple[int, ...], names: list[str]) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    for size in sizes:
+        corpus: Corpus = generate_corpus(CorpusSpec(lines=size))
+        for name in names:
+            func, wants_bytes = BENCHMARKS[name]
+            key = f"{name}/{size}"
+            results[key] = measure(func, corpus.data if wants_bytes else corpus.text)
+            stats = results[key]
+            print(
+                f"{key:<38} {stats['ops_per_sec']:>10.2f} ops/s "
+                f"{stats['median_ms']:>10.2f} ms {stats['peak_kib']:>10.0f} KiB peak"
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Benchmarks whose ops/s dropped more than tolerance below the baseline."""
+    regressions = []
+    for key, stats in results.items():
+        expected = baseline.get(key)
+        if not expected:
+            continue
+        floor = expected["ops_per_sec"] * (1.0 - tolerance)
+        if stats["ops_per_sec"] < floor:
+            regressions.append(
+                f"{key}: {stats['ops_per_sec']:.2f} ops/s, baseline {expected['ops_per_sec']:.2f} ops/s"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks do decodificador e do analisador MSX-BASIC")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="linhas por programa")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="grava os resultados como nova referencia")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="queda maxima aceita de ops/s (0.25 = 25%%)")
+    parser.add_argument("--output", type=Path, help="grava os resultados desta execucao em JSON")
+    args = parser.parse_args(argv)
+
+    results = run(tuple(args.sizes), args.only)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True), encoding="utf-8")
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True), encoding="utf-8")
+        print(f"Referencia gravada em {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"Sem referencia em {args.baseline}; use --save-baseline para criar uma.")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSAO {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
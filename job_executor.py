@@ -0,0 +1,263 @@
+"""Background jobs for the Tk windows: worker threads/processes, results delivered on the Tk thread.
+
+Tk widgets may only be touched from the thread that runs mainloop, so a
+job never calls back into the UI itself. Workers put their outcome and
+progress on a queue, and the executor drains it from an ``after`` poll.
+"""
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+# How often (ms) the Tk thread looks for finished jobs while any are running.
+POLL_MS = 30
+THREAD_WORKERS = 4
+
+
+class JobCancelled(Exception):
+    """Raised by CancelToken.check inside a job that was cancelled."""
+
+
+class CancelToken:
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self) -> None:
+        """Stop the job here if it was cancelled; call it between units of work."""
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class Job:
+    """Handle of a submitted job; thread jobs receive it as their first argument."""
+
+    def __init__(self, job_id: int, key: str | None, events: queue.SimpleQueue) -> None:
+        self.id = job_id
+        self.key = key
+        self.token = CancelToken()
+        self.done = False
+        self._events = events
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+    def check(self) -> None:
+        self.token.check()
+
+    def cancel(self) -> None:
+        self.token.cancel()
+
+    def report_progress(self, done: int, total: int | None = None) -> None:
+        """Safe from any thread; the Tk side only sees the latest report of each poll."""
+        self._events.put((self.id, "progress", (done, total)))
+
+    def report_items(self, items: list) -> None:
+        """Hand a batch of partial results to on_items; every batch arrives, in order, before on_done."""
+        self._events.put((self.id, "items", items))
+
+
+def stream_items(job: Job, items: Iterable, batch_size: int = 200) -> int:
+    """Thread job that forwards an iterator (a streaming decoder, say) to on_items in batches.
+
+    Returns the number of items sent.
+    """
+    batch = []
+    count = 0
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            job.check()
+            count += len(batch)
+            job.report_items(batch)
+            job.report_progress(count)
+            batch = []
+    job.check()
+    if batch:
+        count += len(batch)
+        job.report_items(batch)
+    return count
+
+
+class _Callbacks:
+    __slots__ = ("job", "on_done", "on_error", "on_progress", "on_items")
+
+    def __init__(self, job: Job, on_done, on_error, on_progress, on_items) -> None:
+        self.job = job
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_items = on_items
+
+
+class JobExecutor:
+    """Runs functions off the Tk thread and calls their callbacks back on it.
+
+    Jobs submitted with a key replace the previous job with the same key:
+    the old one is cancelled and its result is dropped, so refreshing a view
+    twice in a row only ever shows the newest result.
+    """
+
+    def __init__(self, root, thread_workers: int = THREAD_WORKERS, poll_ms: int = POLL_MS) -> None:
+        self.root = root
+        self.poll_ms = poll_ms
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="msxwrite-job")
+        self._processes: ProcessPoolExecutor | None = None
+        self._events: queue.SimpleQueue = queue.SimpleQueue()
+        self._jobs: dict[int, _Callbacks] = {}
+        self._by_key: dict[str, Job] = {}
+        self._ids = itertools.count(1)
+        self._poll_job: str | None = None
+        self._closed = False
+
+    @classmethod
+    def for_widget(cls, widget) -> "JobExecutor":
+        """The executor shared by every window of the widget's Tk application."""
+        root = widget._root()
+        executor = getattr(root, "_job_executor", None)
+        if executor is None:
+            executor = root._job_executor = cls(root)
+            root.bind("<Destroy>", lambda event: executor.shutdown() if event.widget is root else None, add="+")
+        return executor
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        on_done: Callable[[Any], None] | None = None,
+        on_error: Callable[[BaseException], None] | None = None,
+        on_progress: Callable[[int, int | None], None] | None = None,
+        on_items: Callable[[list], None] | None = None,
+        key: str | None = None,
+        process: bool = False,
+    ) -> Job:
+        """Run fn in the background.
+
+        Thread jobs are called as fn(job, *args) and should call job.check()
+        now and then; job.report_items passes partial results to on_items
+        while it runs. With process=True fn(*args) runs in a worker process
+        (fn and args must be picklable); it cannot be interrupted, but
+        cancelling still drops its result.
+        """
+        if key is not None:
+            self.cancel(key)
+        job = Job(next(self._ids), key, self._events)
+        if self._closed:
+            job.cancel()
+            return job
+        self._jobs[job.id] = _Callbacks(job, on_done, on_error, on_progress, on_items)
+        if key is not None:
+            self._by_key[key] = job
+
+        if process:
+            if self._processes is None:
+                # spawn, not fork: the parent has a running Tk interpreter and worker threads
+                self._processes = ProcessPoolExecutor(
+                    max_workers=max(1, (os.cpu_count() or 2) - 1),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            future = self._processes.submit(fn, *args)
+        else:
+            future = self._threads.submit(fn, job, *args)
+        future.add_done_callback(lambda done: self._finished(job, done))
+        self._schedule_poll()
+        return job
+
+    def cancel(self, key: str) -> None:
+        job = self._by_key.pop(key, None)
+        if job is not None:
+            job.cancel()
+
+    def cancel_all(self) -> None:
+        for callbacks in self._jobs.values():
+            callbacks.job.cancel()
+        self._by_key.clear()
+
+    def shutdown(self) -> None:
+        self._closed = True
+        self.cancel_all()
+        self._jobs.clear()
+        if self._poll_job is not None:
+            try:
+                self.root.after_cancel(self._poll_job)
+            except Exception:
+                pass
+            self._poll_job = None
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, job: Job, future: Future) -> None:
+        # Runs in the worker (or the pool's management thread): only queue the outcome.
+        if future.cancelled():
+            self._events.put((job.id, "error", JobCancelled()))
+            return
+        error = future.exception()
+        if error is not None:
+            self._events.put((job.id, "error", error))
+        else:
+            self._events.put((job.id, "done", future.result()))
+
+    def _schedule_poll(self) -> None:
+        if self._poll_job is None and not self._closed:
+            self._poll_job = self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self) -> None:
+        self._poll_job = None
+        outcomes = []
+        batches = []
+        progress: dict[int, tuple[int, int | None]] = {}
+        while True:
+            try:
+                job_id, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress[job_id] = payload
+            elif kind == "items":
+                batches.append((job_id, payload))
+            else:
+                outcomes.append((job_id, kind, payload))
+                progress.pop(job_id, None)
+
+        for job_id, (done, total) in progress.items():
+            callbacks = self._jobs.get(job_id)
+            if callbacks and callbacks.on_progress and not callbacks.job.cancelled:
+                callbacks.on_progress(done, total)
+
+        # A job's batches were queued before its outcome, so they are delivered first
+        for job_id, items in batches:
+            callbacks = self._jobs.get(job_id)
+            if callbacks and callbacks.on_items and not callbacks.job.cancelled:
+                callbacks.on_items(items)
+
+        for job_id, kind, payload in outcomes:
+            callbacks = self._jobs.pop(job_id, None)
+            if callbacks is None:
+                continue
+            job = callbacks.job
+            job.done = True
+            if job.key is not None and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+            if job.cancelled or isinstance(payload, JobCancelled):
+                continue
+            if kind == "done":
+                if callbacks.on_done:
+                    callbacks.on_done(payload)
+            elif callbacks.on_error:
+                callbacks.on_error(payload)
+
+        if self._jobs:
+            self._schedule_poll()
@@ -7,6 +7,8 @@ from tkinter import messagebox, Canvas
 import customtkinter as ctk
 from PIL import Image, ImageTk
 
+from job_executor import JobExecutor
+
 
 class LayoutViewerFrame(ctk.CTkFrame):
     def __init__(self, parent: ctk.CTk, file_path: str | None = None) -> None:
@@ -45,15 +47,27 @@ class LayoutViewerFrame(ctk.CTkFrame):
             self.set_file(file_path)
 
     def set_file(self, path: str) -> None:
-        try:
-            buffer = self._decode_graphos_lay(path)
-            self.current_filename = os.path.basename(path)
-            self._render_buffer_to_screen(buffer)
-            self.lbl_info.configure(
-                text=f"Arquivo: {self.current_filename} | Tamanho Decodificado: {len(buffer)} bytes"
-            )
-        except Exception as exc:
-            messagebox.showerror("Erro de Leitura", f"Falha ao ler o arquivo .LAY:\n{exc}")
+        # Decoding and rendering run in a worker thread; the canvas is updated when they finish.
+        JobExecutor.for_widget(self).submit(
+            self._load_layout,
+            path,
+            key=f"layout-viewer-{id(self)}",
+            on_done=lambda result: self._show_layout(path, *result),
+            on_error=lambda exc: messagebox.showerror("Erro de Leitura", f"Falha ao ler o arquivo .LAY:\n{exc}"),
+        )
+
+    def _load_layout(self, job, path: str) -> tuple[bytearray, Image.Image]:
+        buffer = self._decode_graphos_lay(path)
+        job.check()
+        return buffer, self._render_buffer(buffer)
+
+    def _show_layout(self, path: str, buffer: bytearray, image: Image.Image) -> None:
+        self.current_filename = os.path.basename(path)
+        self.current_pil_image = image
+        self._update_canvas_image(2)
+        self.lbl_info.configure(
+            text=f"Arquivo: {self.current_filename} | Tamanho Decodificado: {len(buffer)} bytes"
+        )
 
     def _decode_graphos_lay(self, filepath: str) -> bytearray:
         decoded_buffer = bytearray()
@@ -101,7 +115,7 @@ class LayoutViewerFrame(ctk.CTkFrame):
 
         return decoded_buffer
 
-    def _render_buffer_to_screen(self, buffer: bytearray) -> None:
+    def _render_buffer(self, buffer: bytearray) -> Image.Image:
         width, height = 256, 192
         img = Image.new("RGB", (width, height), (0, 0, 0))
         pixels = img.load()
@@ -123,8 +137,7 @@ class LayoutViewerFrame(ctk.CTkFrame):
                             py = tile_y + d
                             pixels[px, py] = (255, 255, 255)
 
-        self.current_pil_image = img
-        self._update_canvas_image(2)
+        return img
 
     def _update_canvas_image(self, zoom_factor: int) -> None:
         if not self.current_pil_image:
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
+import logging
 import os
+import sqlite3
 import time
+from collections import deque
 from pathlib import Path
+from typing import Iterator
 import tkinter as tk
 from tkinter import colorchooser, filedialog, messagebox
 
 import customtkinter as ctk
 
-from app_db import AppDatabase
-from msx_basic_decoder import decode_msx_basic_segments
+from app_db import AppDatabase, content_hash
+from job_executor import JobExecutor, stream_items
+from msx_basic_decoder import SegmentSpans, iter_msx_basic_lines
 from alphabet_viewer import AlphabetViewerFrame
 from layout_viewer import LayoutViewerFrame
 from screen_viewer import ScreenViewerFrame
@@ -22,11 +27,16 @@ try:
 except ImportError:
     HELP_VIEWER_AVAILABLE = False
 
+log = logging.getLogger(__name__)
+
 
 APP_TITLE = "MSX-Write"
 DB_NAME = "msxread.db"
 TEXT_ENCODINGS = ("utf-8", "cp1252", "latin-1")
 HEX_PREVIEW_BYTES = 4096
+MSX_STREAM_BATCH_LINES = 200
+# Ranges per tag_add call; keeps each Tcl command a reasonable size.
+TAG_RANGES_PER_CALL = 2000
 
 
 class MSXViewer(ctk.CTkToplevel):
@@ -37,6 +47,7 @@ class MSXViewer(ctk.CTkToplevel):
             self.db = master.db
         else:
             self.db = AppDatabase(Path(DB_NAME))
+        self.jobs = JobExecutor.for_widget(self)
 
         self.appearance_mode = self.db.get_setting("appearance_mode", "System")
         self.color_theme = self.db.get_setting("color_theme", "blue")
@@ -51,7 +62,12 @@ class MSXViewer(ctk.CTkToplevel):
         self.base_dir = self.db.get_setting("last_dir", str(Path.cwd()))
         self.current_file: str | None = None
         self.current_file_kind: str | None = None
-        self.current_msx_segments: list[tuple[str, str]] | None = None
+        self.current_msx_spans: SegmentSpans | None = None
+        # Decoded lines received from the worker and not yet shown
+        self._msx_pending: deque[tuple[int, list[tuple[str, str]]]] = deque()
+        self._msx_decoding = False
+        self._msx_stream_job: str | None = None
+        self._msx_cache_key: tuple[str, int, int, str] | None = None
         self.shape_viewer: ShapeViewerFrame | None = None
         self.alphabet_viewer: AlphabetViewerFrame | None = None
         self.layout_viewer: LayoutViewerFrame | None = None
@@ -244,7 +260,9 @@ class MSXViewer(ctk.CTkToplevel):
         self._open_file(file_path)
 
     def _open_file(self, file_path: str) -> None:
-        segments: list[tuple[str, str]] | None = None
+        msx_lines: Iterator[tuple[int, list[tuple[str, str]]]] | None = None
+        spans: SegmentSpans | None = None
+        cache_key: tuple[str, int, int, str] | None = None
         try:
             data = Path(file_path).read_bytes()
             if Path(file_path).suffix.lower() == ".shp":
@@ -264,8 +282,14 @@ class MSXViewer(ctk.CTkToplevel):
                 decoded = "Arquivo SCR aberto no visualizador."
                 file_kind = "Graphos Screen 2"
             elif self._looks_like_msx_basic_data(data):
-                segments = decode_msx_basic_segments(data)
-                decoded = "".join(text for _kind, text in segments)
+                stat = Path(file_path).stat()
+                cache_key = (file_path, stat.st_mtime_ns, stat.st_size, content_hash(data))
+                segments = self.db.get_decoded_segments(*cache_key)
+                if segments is not None:
+                    spans = SegmentSpans.from_segments(segments)
+                else:
+                    msx_lines = iter_msx_basic_lines(memoryview(data))
+                decoded = ""
                 file_kind = "MSX BASIC"
                 self.right_tabs.set("Conteudo")
             else:
@@ -282,18 +306,79 @@ class MSXViewer(ctk.CTkToplevel):
             messagebox.showerror("Erro ao abrir", str(exc))
             return
 
+        self._cancel_msx_stream()
         self.current_file = file_path
         self.current_file_kind = file_kind
-        self.current_msx_segments = segments if file_kind == "MSX BASIC" else None
+        self.current_msx_spans = None
+        if file_kind == "MSX BASIC":
+            self.current_msx_spans = spans if spans is not None else SegmentSpans()
+        self._msx_cache_key = cache_key
         self.db.set_setting("last_file", file_path)
         self.db.touch_recent_file(file_path, int(time.time()))
 
         self.file_label.configure(text=f"{Path(file_path).name} ({file_kind})")
-        if file_kind == "MSX BASIC" and self.current_msx_segments:
-            self._set_msx_text(self.current_msx_segments)
+        if spans is not None:
+            self._set_msx_text(spans)
+        elif msx_lines is not None:
+            self._set_msx_text(self.current_msx_spans)
+            # The decoder runs in a worker thread; its lines are shown batch by batch as they arrive
+            self._msx_decoding = True
+            self.jobs.submit(
+                stream_items,
+                msx_lines,
+                MSX_STREAM_BATCH_LINES,
+                key="msx-open",
+                on_items=self._queue_msx_lines,
+                on_done=self._finish_msx_decode,
+                on_error=lambda exc: messagebox.showerror("Erro ao abrir", str(exc)),
+            )
         else:
             self._set_text(decoded)
 
+    def _queue_msx_lines(self, lines: list[tuple[int, list[tuple[str, str]]]]) -> None:
+        self._msx_pending.extend(lines)
+        if self._msx_stream_job is None:
+            self._continue_msx_stream()
+
+    def _finish_msx_decode(self, _count: int) -> None:
+        self._msx_decoding = False
+        if self._msx_stream_job is None:
+            self._continue_msx_stream()
+
+    def _continue_msx_stream(self) -> None:
+        """Show the next batch of decoded lines and schedule the rest for later."""
+        self._msx_stream_job = None
+        if self.current_msx_spans is None:
+            return
+        batch = SegmentSpans()
+        for _ in range(min(MSX_STREAM_BATCH_LINES, len(self._msx_pending))):
+            batch.extend(self._msx_pending.popleft()[1])
+        if batch:
+            self.current_msx_spans.extend(batch)
+            self._append_msx_spans(batch)
+        if self._msx_pending:
+            self._msx_stream_job = self.after(1, self._continue_msx_stream)
+        elif not self._msx_decoding:
+            self._store_decoded_segments()
+
+    def _store_decoded_segments(self) -> None:
+        """Keep the fully decoded listing so reopening this file version skips the decoder."""
+        if self._msx_cache_key is None or self.current_msx_spans is None:
+            return
+        try:
+            self.db.put_decoded_segments(*self._msx_cache_key, self.current_msx_spans.segments())
+        except sqlite3.Error:
+            # Only a shortcut for the next open: the listing on screen is unaffected
+            log.warning("Could not store the decode cache for %s", self._msx_cache_key[0], exc_info=True)
+
+    def _cancel_msx_stream(self) -> None:
+        self.jobs.cancel("msx-open")
+        if self._msx_stream_job is not None:
+            self.after_cancel(self._msx_stream_job)
+            self._msx_stream_job = None
+        self._msx_pending.clear()
+        self._msx_decoding = False
+
     def _open_shape_viewer(self, file_path: str) -> None:
         if self.shape_viewer:
             self.shape_viewer.set_file(file_path)
@@ -333,18 +418,29 @@ class MSXViewer(ctk.CTkToplevel):
             self._open_file(str(path))
 
     def _on_close(self) -> None:
+        self._cancel_msx_stream()
         self.db.set_setting("window_geometry", self.geometry())
         self.destroy()
 
-    def _set_msx_text(self, segments: list[tuple[str, str]]) -> None:
+    def _set_msx_text(self, spans: SegmentSpans) -> None:
         self.textbox.configure(state="normal")
         self.textbox.delete("1.0", tk.END)
-        for kind, text in segments:
+        self.textbox.configure(state="disabled")
+        self._append_msx_spans(spans)
+
+    def _append_msx_spans(self, spans: SegmentSpans) -> None:
+        """Insert the text in one call, then tag each kind with one tag_add per chunk of ranges."""
+        if not spans:
+            return
+        self.textbox.configure(state="normal")
+        line, col = (int(part) for part in self.text_widget.index("end-1c").split("."))
+        self.text_widget.insert("end-1c", spans.text)
+        for kind, indexes in spans.text_indexes(line, col).items():
             tag = self._map_kind_to_tag(kind)
-            if tag:
-                self.text_widget.insert(tk.END, text, (tag,))
-            else:
-                self.text_widget.insert(tk.END, text)
+            if not tag:
+                continue
+            for pos in range(0, len(indexes), TAG_RANGES_PER_CALL * 2):
+                self.text_widget.tag_add(tag, *indexes[pos:pos + TAG_RANGES_PER_CALL * 2])
         self.textbox.configure(state="disabled")
 
     def _map_kind_to_tag(self, kind: str) -> str | None:
@@ -536,8 +632,8 @@ class MSXViewer(ctk.CTkToplevel):
         self._apply_viewer_colors()
         self._configure_syntax_tags()
         if self.current_file_kind == "MSX BASIC":
-            if self.current_msx_segments:
-                self._set_msx_text(self.current_msx_segments)
+            if self.current_msx_spans:
+                self._set_msx_text(self.current_msx_spans)
 
         dialog.destroy()
 
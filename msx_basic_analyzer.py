@@ -1,130 +1,399 @@
 from __future__ import annotations
+
 import re
+from typing import NamedTuple
+
+from msx_basic_cfg import ControlFlowGraph
+from msx_basic_encoder import LINE_RANGE_KEYWORDS, LINE_REF_KEYWORDS
+from msx_basic_lexer import scan, split_line_number, tokenize
+from msx_basic_memory import LineMemory, MemoryReport, memory_facts, program_report
+
+# Type suffix -> (type name, bytes per simple variable)
+VARIABLE_TYPES = {
+    "$": ("STR", 3),
+    "%": ("INT", 2),
+    "!": ("SNG", 4),
+    "#": ("DBL", 8),
+    "": ("SNG", 4),
+}
+
+# Statements after which the next line is not executed, unless they sit behind an IF.
+TERMINATING_KEYWORDS = frozenset({"END", "STOP", "RETURN", "RUN", "RESUME"})
+# ON <event> GOSUB; STRIG is a function token and INTERVAL has none (see _event_name).
+EVENT_KEYWORDS = frozenset({"ERROR", "KEY", "SPRITE", "STOP", "STRIG"})
+# Flow types whose target is entered as a subroutine.
+SUBROUTINE_FLOW = frozenset({"GOSUB", "ON GOSUB", "ON KEY", "ON SPRITE", "ON STOP", "ON STRIG", "ON INTERVAL"})
+
+
+class LineAnalysis(NamedTuple):
+    """What one numbered line contributes to the summary."""
+
+    line_num: int
+    variables: tuple[tuple[str, int], ...]  # (name, uses in the line)
+    flow: tuple[tuple[int, str], ...]  # (target line, 'GOTO'|'GOSUB'|'THEN'|'ON GOTO'|...)
+    falls_through: bool = True  # execution may continue on the next line
+    loop_marks: tuple[tuple[str, str], ...] = ()  # ('FOR', var) / ('NEXT', var or '') in order
+    is_data: bool = False  # DATA line: read by READ, never executed
+    memory: LineMemory | None = None  # size in the program and variable use, from the same scan
+
+
+def _event_name(words, i: int) -> str | None:
+    """Event of an ON <event> GOSUB statement starting after words[i] (the ON)."""
+    if i + 1 >= len(words):
+        return None
+    name = words[i + 1][1]
+    if name in EVENT_KEYWORDS:
+        return name
+    # INTERVAL has no token of its own; the lexer sees INT followed by ERVAL.
+    if name == "INT" and i + 2 < len(words) and words[i + 2][1].startswith("ERVAL"):
+        return "INTERVAL"
+    return None
+
+
+def _line_numbers_after(words, i: int, separators: str = ",") -> tuple[list[tuple[int, int]], int]:
+    """(line number, index) of a "n[,n...]" list starting at words[i], and the index after it.
+
+    separators="-" reads a "n-n" range instead.
+    """
+    targets: list[tuple[int, int]] = []
+    count = len(words)
+    while i < count and words[i][0] == "number" and words[i][1].isdigit():
+        targets.append((int(words[i][1]), i))
+        i += 1
+        if i + 1 < count and words[i][1] in separators and words[i + 1][0] == "number":
+            i += 1
+        else:
+            break
+    return targets, i
+
+
+def _line_flow(words) -> tuple[list[tuple[int, str, int]], bool, list[tuple[str, str]]]:
+    """Line references (target, type, index), whether the line falls through, and its FOR/NEXT marks.
+
+    words are the (kind, upper-cased text) pairs of Lexer.scan. Anything
+    after an IF is treated as conditional, so a line with an IF always
+    falls through; this over-approximates reachability and keeps
+    dead-code reports free of false positives.
+    """
+    flow: list[tuple[int, str, int]] = []
+    marks: list[tuple[str, str]] = []
+    falls_through = True
+    conditional = False
+    on_statement: str | None = None  # "ON" or "ON <event>" until the end of the statement
+    statement_start = True
+    count = len(words)
+    i = 0
+    while i < count:
+        kind, name = words[i]
+        if kind != "command" and kind != "function":
+            if kind == "plain" and name == ":":
+                on_statement = None
+                statement_start = True
+            elif kind != "label":  # a Dignified {label} does not start the statement
+                statement_start = False
+            i += 1
+            continue
+        at_start = statement_start
+        statement_start = False
+
+        if name == "IF":
+            conditional = True
+        elif name == "ON":
+            event = _event_name(words, i)
+            on_statement = f"ON {event}" if event else "ON"
+        elif name in ("GOTO", "GOSUB"):
+            targets, i = _line_numbers_after(words, i + 1)
+            if on_statement == "ON":
+                ftype = f"ON {name}"
+            elif on_statement:
+                ftype = on_statement
+                if ftype == "ON ERROR":
+                    targets = [ref for ref in targets if ref[0] != 0]  # ON ERROR GOTO 0 turns it off
+            else:
+                ftype = name
+                if name == "GOTO" and targets and not conditional:
+                    falls_through = False
+            flow.extend((target, ftype, index) for target, index in targets)
+            continue
+        elif name in LINE_REF_KEYWORDS:  # GOTO/GOSUB are handled above; RESUME NEXT and RUN "FILE" have no target
+            if name in LINE_RANGE_KEYWORDS:
+                start = i + 2 if i + 1 < count and words[i + 1][1] == "-" else i + 1  # LIST -20
+                targets, after = _line_numbers_after(words, start, "-")
+            else:
+                targets, after = _line_numbers_after(words, i + 1)
+                targets = targets[:1]
+            flow.extend((target, name, index) for target, index in targets)
+            if at_start and name in TERMINATING_KEYWORDS and not conditional:
+                falls_through = False
+            if name in ("THEN", "ELSE"):
+                statement_start = True
+            if targets:
+                i = after
+            elif name == "RESUME" and i + 1 < count and words[i + 1][1] == "NEXT":
+                i += 2  # RESUME NEXT, not a loop NEXT
+            else:
+                i += 1
+            continue
+        elif name in TERMINATING_KEYWORDS:
+            if at_start and not conditional and on_statement is None:
+                falls_through = False
+        elif name == "FOR":
+            if i + 1 < count and words[i + 1][0] == "identifier":
+                marks.append(("FOR", words[i + 1][1]))
+        elif name == "NEXT":
+            names = []
+            j = i + 1
+            while j < count and words[j][0] == "identifier":
+                names.append(words[j][1])
+                if j + 1 < count and words[j + 1][1] == ",":
+                    j += 2
+                else:
+                    break
+            marks.extend(("NEXT", var) for var in names or [""])
+        i += 1
+    return flow, falls_through, marks
+
+
+# Cheap pre-check: lines without any of these (spelled in any case) have no line references.
+_MAY_REFER_TO_LINES = re.compile(r"GOTO|GOSUB|THEN|ELSE|RESTORE|RESUME|RETURN|RUN|LIST|DELETE", re.IGNORECASE)
+
+
+def line_references(code: str, offset: int = 0, dialect: str | None = None) -> list[tuple[int, int, int]]:
+    """(target line, start column, end column) of every line number the statements jump to.
+
+    Same rules as the flow analysis, so RENUM rewrites exactly the
+    references the Program Map shows.
+    """
+    if not _MAY_REFER_TO_LINES.search(code):
+        return []
+    tokens = tokenize(code, offset, dialect)
+    flow, _falls_through, _marks = _line_flow([(token.kind, token.text.upper()) for token in tokens])
+    return [
+        (target, tokens[index].start, tokens[index].start + len(tokens[index].text))
+        for target, _ftype, index in flow
+    ]
+
+
+def analyze_line(line: str, dialect: str | None = None) -> LineAnalysis | None:
+    """Variables and jumps of one program line; None for unnumbered lines."""
+    line_num, code_start = split_line_number(line)
+    if line_num is None:
+        return None
+
+    # One scan of the line: strings, comments and DATA lists never come
+    # out as names or numbers, so nothing inside them is mistaken for a
+    # variable or a jump.
+    code = line[code_start:]
+    words = scan(code, dialect)
+    variables: dict[str, int] = {}
+    count = len(words)
+    for i, (kind, name) in enumerate(words):
+        if kind != "identifier":
+            continue
+
+        # Arrays (A(...)) and user functions (FN A) are not simple variables.
+        if i + 1 < count and words[i + 1][1] == "(":
+            continue
+        if i > 0 and words[i - 1] == ("command", "FN"):
+            continue
+
+        variables[name] = variables.get(name, 0) + 1
+
+    flow, falls_through, marks = _line_flow(words)
+    is_data = bool(words) and words[0][1] == "DATA"
+    return LineAnalysis(
+        line_num,
+        tuple(variables.items()),
+        tuple((target, ftype) for target, ftype, _index in flow),
+        falls_through,
+        tuple(marks),
+        is_data,
+        memory_facts(line_num, code, words),
+    )
+
+
+class CrossReference(NamedTuple):
+    """One occurrence in a line, as stored by AppDatabase.update_cross_reference."""
+
+    kind: str  # 'variable', 'line', 'keyword' or 'data'
+    name: str  # variable (arrays as 'A()'), target line number, keyword; '' for 'data'
+    column: int  # 0-based column in the line text
+    access: str = ""  # variable: 'read'|'write'; line: flow type ('GOTO', 'RESTORE', ...)
+
+
+# Statements whose variable list is assigned to.
+ASSIGNING_STATEMENTS = frozenset({"READ", "INPUT", "SWAP"})
+
+
+def _closing_paren(tokens, i: int) -> int:
+    """Index of the ')' matching the '(' at tokens[i], or len(tokens)."""
+    depth = 0
+    for j in range(i, len(tokens)):
+        text = tokens[j].text
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    return len(tokens)
+
+
+def cross_references(line: str, dialect: str | None = None) -> tuple[int | None, list[CrossReference]]:
+    """Line number and every variable, line-number reference and keyword of one line, with columns."""
+    line_num, code_start = split_line_number(line)
+    if line_num is None:
+        return None, []
+
+    tokens = tokenize(line[code_start:], code_start, dialect)
+    refs: list[CrossReference] = []
+    count = len(tokens)
+    statement: str | None = None  # first keyword of the current statement
+    at_start = True
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.kind == "label":  # a Dignified {label} does not start the statement
+            continue
+        text = token.text.upper()
+        if token.kind == "plain":
+            if text == ":":
+                statement, at_start = None, True
+                continue
+            depth += (text == "(") - (text == ")")
+        elif token.kind in ("command", "function"):
+            if text[0].isalpha():  # operators like '=' are tokens too, but not worth indexing
+                refs.append(CrossReference("keyword", text, token.start))
+            if text == "DATA":
+                refs.append(CrossReference("data", "", token.start))
+            if text in ("THEN", "ELSE"):
+                statement, at_start = None, True
+                continue
+            if text == "LET":
+                continue  # the assignment itself still starts the statement
+            if at_start:
+                statement = "INPUT" if text == "LINE" and i + 1 < count and tokens[i + 1].text.upper() == "INPUT" else text
+        elif token.kind == "identifier":
+            if i > 0 and tokens[i - 1].kind == "command" and tokens[i - 1].text.upper() == "FN":
+                continue
+            is_array = i + 1 < count and tokens[i + 1].text == "("
+            after = _closing_paren(tokens, i + 1) + 1 if is_array else i + 1
+            assigned = at_start and after < count and tokens[after].text == "="
+            if statement == "FOR" and tokens[i - 1].text.upper() == "FOR":
+                assigned = True
+            elif statement in ASSIGNING_STATEMENTS and depth == 0:
+                assigned = True
+            name = text + "()" if is_array else text
+            refs.append(CrossReference("variable", name, token.start, "write" if assigned else "read"))
+        at_start = False
+
+    flow, _falls_through, _marks = _line_flow([(token.kind, token.text.upper()) for token in tokens])
+    refs.extend(CrossReference("line", str(target), tokens[index].start, ftype) for target, ftype, index in flow)
+    refs.sort(key=lambda ref: ref.column)
+    return line_num, refs
+
 
 class MSXBasicAnalyzer:
-    def __init__(self, content: str):
+    def __init__(self, content: str, dialect: str | None = None):
         self.content = content
+        self.dialect = dialect  # lexer dialect, as in the editor settings
         self.lines = content.splitlines()
         self.variables = {} # name: {type: str, lines: set, count: int}
-        self.flow = []      # list of {from: int, to: int, type: 'GOTO'|'GOSUB'}
-        self.subroutines = set() # target line numbers of GOSUB
-        
+        self.flow = []      # list of {from: int, to: int, type: 'GOTO'|'GOSUB'|'THEN'|'ON GOTO'|...}
+        self.subroutines = set() # target line numbers of GOSUB, ON GOSUB and ON <event> GOSUB
+        # Line text -> its analysis; kept between runs so only edited lines are lexed again
+        self._line_cache: dict[str, LineAnalysis | None] = {}
+        self.reanalyzed_lines = 0
+        self.line_results: list[LineAnalysis] = []
+        self.memory: MemoryReport = program_report([])
+
+    def set_dialect(self, dialect: str | None) -> None:
+        """Keywords differ between dialects: the next analyze() lexes every line again."""
+        if dialect != self.dialect:
+            self.dialect = dialect
+            self._line_cache.clear()
+
+    def set_content(self, content: str) -> None:
+        """Replace the program text; the next analyze() reuses results of unchanged lines."""
+        self.content = content
+        self.lines = content.splitlines()
+
+    def set_lines(self, lines: list[str]) -> None:
+        """Like set_content, for a program already split into lines (the editor's document model).
+
+        The joined text is not rebuilt: content is None until the next set_content.
+        """
+        self.lines = lines
+        self.content = None
+
     def analyze(self):
-        # Regex for line numbers: ^\s*(\d+)
-        # Regex for GOTO/GOSUB: \b(GOTO|GOSUB)\b\s*(\d+)
-        # Regex for variables: 
-        #   MSX BASIC variables: [A-Z][A-Z0-9]?[$%!#]?
-        #   Must avoid keywords.
-        
-        from msx_basic_decoder import TOKEN_MAP, TOKEN_MAP_FF
-        keywords = set(TOKEN_MAP) | set(TOKEN_MAP_FF)
-        
-        # Simple parser to skip strings and comments
+        cache = self._line_cache
+        current: dict[str, LineAnalysis | None] = {}
+        results: list[LineAnalysis] = []
+        reanalyzed = 0
         for line in self.lines:
-            line_match = re.match(r"^\s*(\d+)", line)
-            if not line_match:
-                continue
-            
-            line_num = int(line_match.group(1))
-            code_part = line[line_match.end():]
-            
-            # Remove strings
-            code_part = re.sub(r'"[^"]*"', '""', code_part)
-            
-            # Remove comments (REM or ')
-            code_part = re.split(r"REM|'", code_part, flags=re.IGNORECASE)[0]
-            
-            # Extract GOTO / GOSUB
-            # Note: MSX BASIC allows GOTO 100,200 but that's ON GOTO. 
-            # Simple GOTO/GOSUB:
-            flow_matches = re.finditer(r"\b(GOTO|GOSUB)\b\s*(\d+)", code_part, re.IGNORECASE)
-            for m in flow_matches:
-                ftype = m.group(1).upper()
-                target = int(m.group(2))
-                self.flow.append({"from": line_num, "to": target, "type": ftype})
-                if ftype == "GOSUB":
-                    self.subroutines.add(target)
-
-            # Extract variables
-            # [A-Z][A-Z0-9]*[$%!#]?
-            # We capture the full word first, then check if it's a variable.
-            # MSX BASIC only uses the first two characters for variable names, 
-            # but in modern dialects or even for readability we might have longer names.
-            # However, the classic MSX BASIC tokens often start with these.
-            
-            # Using a more greedy match for characters and then filtering.
-            words = re.finditer(r"\b([A-Z][A-Z0-9]*)([$%!#]?)(?!\()", code_part, re.IGNORECASE)
-            for m in words:
-                full_word = m.group(1).upper()
-                suffix = m.group(2)
-                
-                # If the word itself is a keyword, skip it.
-                if full_word in keywords:
-                    continue
-                
-                # If it's a long word, MSX BASIC (classic) would only see the first 2 chars.
-                # But if it's a keyword like PRINT, the regex [A-Z][A-Z0-9]* matches "PRINT".
-                # If it was [A-Z][A-Z0-9]?, it would match "PR" and "INT" would be left over? 
-                # No, \bPR would match PR and then INT would be another word.
-                
-                # Let's truncate to 2 chars for the variable name identification if we want to be classic,
-                # but let's keep what the user wrote for the map.
-                var_name = full_word
-                if len(var_name) > 2:
-                    # If the first 2 chars or the whole word is a keyword, it's likely not a variable
-                    # unless it's a dialect that allows it.
-                    # But the issue is specifically about "pedacos (2 letras) de palavras chave".
-                    # Note: MSX BASIC keywords can be used if they have a suffix like % or $ in some cases,
-                    # but usually they are reserved. If len > 2 and it starts with a keyword, skip.
-                    is_kw_start = False
-                    for kw in keywords:
-                        if len(kw) >= 2 and var_name.startswith(kw):
-                            is_kw_start = True
-                            break
-                    if is_kw_start:
-                        continue
-                
-                full_name = var_name + suffix
-                if full_name in keywords:
-                    continue
-
-                vsize = 4
-                vtype = "SNG"
-                if suffix == "$":
-                    vtype = "STR"
-                    vsize = 3
-                elif suffix == "%":
-                    vtype = "INT"
-                    vsize = 2
-                elif suffix == "!":
-                    vtype = "SNG"
-                    vsize = 4
-                elif suffix == "#":
-                    vtype = "DBL"
-                    vsize = 8
-                
-                if full_name not in self.variables:
-                    self.variables[full_name] = {
+            if line in current:
+                result = current[line]
+            elif line in cache:
+                result = current[line] = cache[line]
+            else:
+                result = current[line] = analyze_line(line, self.dialect)
+                reanalyzed += 1
+            if result is not None:
+                results.append(result)
+        # Only the current lines are kept, so the cache never outgrows the program.
+        self._line_cache = current
+        self.reanalyzed_lines = reanalyzed
+        self.line_results = results
+        self._merge(results)
+        self.memory = program_report(result.memory for result in results)
+
+    def _merge(self, results: list[LineAnalysis]) -> None:
+        variables: dict[str, dict] = {}
+        flow: list[dict] = []
+        subroutines: set[int] = set()
+        for line_num, line_vars, line_flow, *_rest in results:
+            for name, uses in line_vars:
+                info = variables.get(name)
+                if info is None:
+                    suffix = name[-1] if name[-1] in "$%!#" else ""
+                    vtype, vsize = VARIABLE_TYPES[suffix]
+                    variables[name] = {
                         "type": vtype,
                         "lines": {line_num},
-                        "count": 1,
+                        "count": uses,
                         "size": vsize
                     }
                 else:
-                    self.variables[full_name]["lines"].add(line_num)
-                    self.variables[full_name]["count"] += 1
+                    info["lines"].add(line_num)
+                    info["count"] += uses
+            for target, ftype in line_flow:
+                flow.append({"from": line_num, "to": target, "type": ftype})
+                if ftype in SUBROUTINE_FLOW:
+                    subroutines.add(target)
+        self.variables = variables
+        self.flow = flow
+        self.subroutines = subroutines
+
+    def control_flow_graph(self) -> ControlFlowGraph:
+        """CFG of the last analyze() run."""
+        return ControlFlowGraph(self.line_results)
 
     def get_summary(self):
-        sorted_vars = dict(sorted(self.variables.items()))
-        total_memory = 0
+        sorted_vars = {}
         # Convert lines set to sorted list for display
-        for v in sorted_vars.values():
-            v["lines"] = sorted(list(v["lines"]))
-            total_memory += v["size"]
-        
+        for name, v in sorted(self.variables.items()):
+            sorted_vars[name] = dict(v, lines=sorted(v["lines"]))
+        memory = self.memory
+
+        cfg = self.control_flow_graph()
         return {
             "variables": sorted_vars,
             "flow": self.flow,
             "subroutines": sorted(list(self.subroutines)),
-            "total_memory_est": total_memory
+            "total_memory_est": memory.variable_bytes + memory.array_bytes,
+            "memory": memory,
+            "unreachable": cfg.unreachable_lines(),
+            "subroutine_extents": cfg.subroutine_extents(),
+            "loops": cfg.loops(),
+            "missing_targets": cfg.missing_targets,
         }
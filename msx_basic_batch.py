@@ -0,0 +1,132 @@
+"""Conversao em lote de programas MSX-BASIC tokenizados para ASCII (.asc).
+
+Uso:
+    python msx_basic_batch.py DIRETORIO [-o SAIDA] [-j PROCESSOS] [--crlf]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from msx_basic_decoder import decode_msx_basic
+
+
+class BatchResult(NamedTuple):
+    source: str
+    target: str
+    in_bytes: int
+    out_bytes: int
+    error: str | None
+
+
+def looks_like_msx_basic(path: Path) -> bool:
+    """Same test as MSXViewer: tokenized programs start with 0xFF."""
+    try:
+        with path.open("rb") as handle:
+            return handle.read(1) == b"\xFF"
+    except OSError:
+        return False
+
+
+def find_tokenized_files(root: Path) -> Iterator[Path]:
+    """Tokenized files under root, in a stable (sorted) order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort(key=str.lower)
+        for name in sorted(filenames, key=str.lower):
+            path = Path(dirpath) / name
+            if looks_like_msx_basic(path):
+                yield path
+
+
+def target_path(source: Path, root: Path, output_dir: Path | None) -> Path:
+    if output_dir is None:
+        return source.with_suffix(".asc")
+    return (output_dir / source.relative_to(root)).with_suffix(".asc")
+
+
+def convert_file(job: tuple[str, str, str]) -> BatchResult:
+    """Decode one file; runs in a worker process, so errors are returned, not raised."""
+    source, target, newline = job
+    in_bytes = 0
+    try:
+        # A tokenized file already named .asc would be replaced by its own listing.
+        if Path(target).exists() and os.path.samefile(source, target):
+            error = "o destino e o proprio arquivo; use -o para gravar em outro diretorio"
+            return BatchResult(source, target, 0, 0, error)
+        data = Path(source).read_bytes()
+        in_bytes = len(data)
+        text = decode_msx_basic(data)
+        if newline != "\n":
+            text = text.replace("\n", newline)
+        encoded = text.encode("latin-1", errors="replace")
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        Path(target).write_bytes(encoded)
+        return BatchResult(source, target, in_bytes, len(encoded), None)
+    except Exception as exc:
+        return BatchResult(source, target, in_bytes, 0, f"{type(exc).__name__}: {exc}")
+
+
+def convert_tree(
+    root: Path,
+    output_dir: Path | None = None,
+    jobs: int | None = None,
+    newline: str = "\n",
+) -> Iterator[BatchResult]:
+    """Convert every tokenized file under root, yielding results in path order."""
+    work = [
+        (str(path), str(target_path(path, root, output_dir)), newline)
+        for path in find_tokenized_files(root)
+    ]
+    if not work:
+        return
+    if jobs == 1:
+        yield from map(convert_file, work)
+        return
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(work) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(convert_file, work, chunksize=chunksize)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Converte programas MSX-BASIC tokenizados em arquivos .asc")
+    parser.add_argument("root", type=Path, help="diretorio a ser percorrido")
+    parser.add_argument("-o", "--output-dir", type=Path, help="grava os .asc aqui, espelhando a arvore de origem")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="numero de processos (padrao: CPUs)")
+    parser.add_argument("--crlf", action="store_true", help="grava fim de linha CR+LF (padrao do MSX-DOS)")
+    args = parser.parse_args(argv)
+
+    if not args.root.is_dir():
+        print(f"Diretorio nao encontrado: {args.root}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    converted = failed = 0
+    total_in = 0
+    for result in convert_tree(args.root, args.output_dir, args.jobs, "\r\n" if args.crlf else "\n"):
+        total_in += result.in_bytes
+        if result.error is None:
+            converted += 1
+            print(f"OK    {result.source} -> {result.target}")
+        else:
+            failed += 1
+            print(f"ERRO  {result.source}: {result.error}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    files = converted + failed
+    rate = files / elapsed if elapsed > 0 else 0.0
+    mb_rate = total_in / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"{converted} convertidos, {failed} com erro em {elapsed:.2f}s "
+        f"({rate:.1f} arquivos/s, {mb_rate:.2f} MB/s)"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
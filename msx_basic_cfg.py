@@ -0,0 +1,301 @@
+"""Control-flow graph of an MSX-BASIC program, at line granularity."""
+from __future__ import annotations
+
+import re
+from array import array
+from typing import Iterable, NamedTuple
+
+# Edge types. FALL is the implicit edge to the next line, NEXT goes back
+# from a NEXT to the line of its FOR; the rest are the flow types of
+# msx_basic_analyzer.analyze_line.
+EDGE_KINDS = (
+    "FALL", "NEXT", "GOTO", "THEN", "ELSE", "ON GOTO", "RUN", "RETURN", "RESUME",
+    "GOSUB", "ON GOSUB", "ON ERROR", "ON INTERVAL", "ON KEY", "ON SPRITE", "ON STOP", "ON STRIG",
+    "RESTORE", "LIST", "LLIST", "DELETE",
+)
+EDGE_KIND_CODES = {kind: code for code, kind in enumerate(EDGE_KINDS)}
+# Entering a subroutine or an event/error handler: the caller's own flow continues by FALL.
+CALL_KINDS = frozenset({"GOSUB", "ON GOSUB", "ON ERROR", "ON INTERVAL", "ON KEY", "ON SPRITE", "ON STOP", "ON STRIG"})
+# References that do not run the target: RESTORE moves the DATA pointer, LIST/LLIST/DELETE act on the listing.
+NON_FLOW_KINDS = frozenset({"RESTORE", "LIST", "LLIST", "DELETE"})
+
+_CALL_CODES = frozenset(EDGE_KIND_CODES[kind] for kind in CALL_KINDS)
+_NON_FLOW_CODES = frozenset(EDGE_KIND_CODES[kind] for kind in NON_FLOW_KINDS)
+_RUN_OF_ONES = re.compile("1+")
+
+
+class MissingTarget(NamedTuple):
+    source: int
+    target: int
+    kind: str
+
+
+def _csr(count: int, edges: list[tuple[int, int, int]]) -> tuple[array, array, array]:
+    """Compressed adjacency: the edges of node n are targets[starts[n]:starts[n + 1]]."""
+    starts = array("I", bytes(4 * (count + 1)))
+    for source, _target, _code in edges:
+        starts[source + 1] += 1
+    for node in range(count):
+        starts[node + 1] += starts[node]
+    fill = array("I", starts)
+    targets = array("I", bytes(4 * len(edges)))
+    codes = array("B", bytes(len(edges)))
+    for source, target, code in edges:
+        slot = fill[source]
+        targets[slot] = target
+        codes[slot] = code
+        fill[source] = slot + 1
+    return starts, targets, codes
+
+
+class ControlFlowGraph:
+    """Lines as nodes, with successor and predecessor indexes in compressed form.
+
+    Built from the per-line results of MSXBasicAnalyzer (LineAnalysis).
+    Every query is linear in the size of the graph.
+    """
+
+    def __init__(self, lines: Iterable) -> None:
+        # A repeated line number replaces the earlier line, as when typing it again on the MSX.
+        by_number = {}
+        for line in lines:
+            by_number[line.line_num] = line
+        ordered = [by_number[number] for number in sorted(by_number)]
+
+        self.lines = array("I", (line.line_num for line in ordered))
+        self.data_lines = frozenset(line.line_num for line in ordered if line.is_data)
+        self._index = {number: node for node, number in enumerate(self.lines)}
+        self.missing_targets: list[MissingTarget] = []
+
+        edges: list[tuple[int, int, int]] = []
+        fall = EDGE_KIND_CODES["FALL"]
+        next_code = EDGE_KIND_CODES["NEXT"]
+        open_loops: list[tuple[str, int]] = []  # (FOR variable, node), innermost last
+        last = len(ordered) - 1
+        for node, line in enumerate(ordered):
+            for target, kind in line.flow:
+                target_node = self._index.get(target)
+                if target_node is None:
+                    self.missing_targets.append(MissingTarget(line.line_num, target, kind))
+                else:
+                    edges.append((node, target_node, EDGE_KIND_CODES[kind]))
+            for mark, var in line.loop_marks:
+                if mark == "FOR":
+                    open_loops.append((var, node))
+                    continue
+                # NEXT closes the innermost loop, or the loop of its variable and everything inside it.
+                while open_loops:
+                    loop_var, loop_node = open_loops.pop()
+                    if not var or loop_var == var:
+                        edges.append((node, loop_node, next_code))
+                        break
+            if line.falls_through and node < last:
+                edges.append((node, node + 1, fall))
+
+        count = len(ordered)
+        self._succ_starts, self._succ_targets, self._succ_codes = _csr(count, edges)
+        self._pred_starts, self._pred_sources, self._pred_codes = _csr(
+            count, [(target, source, code) for source, target, code in edges]
+        )
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __contains__(self, line_number: int) -> bool:
+        return line_number in self._index
+
+    @property
+    def entry(self) -> int | None:
+        return self.lines[0] if self.lines else None
+
+    def successors(self, line_number: int) -> list[tuple[int, str]]:
+        """(line, edge kind) of every edge leaving line_number."""
+        node = self._index[line_number]
+        start, end = self._succ_starts[node], self._succ_starts[node + 1]
+        return [
+            (self.lines[self._succ_targets[slot]], EDGE_KINDS[self._succ_codes[slot]])
+            for slot in range(start, end)
+        ]
+
+    def predecessors(self, line_number: int) -> list[tuple[int, str]]:
+        """(line, edge kind) of every edge arriving at line_number."""
+        node = self._index[line_number]
+        start, end = self._pred_starts[node], self._pred_starts[node + 1]
+        return [
+            (self.lines[self._pred_sources[slot]], EDGE_KINDS[self._pred_codes[slot]])
+            for slot in range(start, end)
+        ]
+
+    def _walk(self, roots: list[int], skip_codes: frozenset[int]) -> bytearray:
+        """Nodes reachable from roots without following edges of skip_codes, as a 0/1 map."""
+        seen = bytearray(len(self.lines))
+        starts, targets, codes = self._succ_starts, self._succ_targets, self._succ_codes
+        stack = []
+        for root in roots:
+            if not seen[root]:
+                seen[root] = 1
+                stack.append(root)
+        while stack:
+            node = stack.pop()
+            for slot in range(starts[node], starts[node + 1]):
+                target = targets[slot]
+                if not seen[target] and codes[slot] not in skip_codes:
+                    seen[target] = 1
+                    stack.append(target)
+        return seen
+
+    def reachable(self, entry: int | None = None) -> set[int]:
+        """Lines that can run when the program starts at entry (default: the first line)."""
+        if entry is None:
+            entry = self.entry
+        if entry is None:
+            return set()
+        seen = self._walk([self._index[entry]], _NON_FLOW_CODES)
+        return {self.lines[node] for node, flag in enumerate(seen) if flag}
+
+    def unreachable_lines(self, entry: int | None = None) -> list[int]:
+        """Dead code: lines no path reaches. DATA lines are left out, READ uses them anyway."""
+        reachable = self.reachable(entry)
+        return [line for line in self.lines if line not in reachable and line not in self.data_lines]
+
+    def subroutine_entries(self) -> list[int]:
+        """Lines entered by GOSUB, ON ... GOSUB or as an event/error handler."""
+        entries = {
+            self.lines[self._succ_targets[slot]]
+            for slot in range(len(self._succ_targets))
+            if self._succ_codes[slot] in _CALL_CODES
+        }
+        return sorted(entries)
+
+    def subroutine_extent(self, entry: int) -> list[int]:
+        """Lines a subroutine can run before its RETURN, not counting the subroutines it calls."""
+        seen = self._walk([self._index[entry]], _CALL_CODES | _NON_FLOW_CODES)
+        return [self.lines[node] for node, flag in enumerate(seen) if flag]
+
+    def subroutine_extents(self) -> dict[int, list[tuple[int, int]]]:
+        """Extent of every subroutine, as runs (first line, last line) of consecutive program lines.
+
+        All extents come from one pass: the call-free graph is condensed
+        into strongly connected components, and the set of lines each
+        component reaches (a bitset over program positions) is built from
+        its successors' sets in reverse topological order. Subroutines
+        often share most of their code, so runs keep the result small.
+        """
+        entries = [self._index[entry] for entry in self.subroutine_entries()]
+        if not entries:
+            return {}
+        starts, targets, codes = self._succ_starts, self._succ_targets, self._succ_codes
+        skip = _CALL_CODES | _NON_FLOW_CODES
+        components, component_of = self._components(entries, skip)
+
+        # Successor components, and how many components still need each one's bitset.
+        successors: list[set[int]] = []
+        waiting = [0] * len(components)
+        for number, component in enumerate(components):
+            following = {
+                component_of[targets[slot]]
+                for node in component
+                for slot in range(starts[node], starts[node + 1])
+                if codes[slot] not in skip
+            }
+            following.discard(number)
+            successors.append(following)
+            for other in following:
+                waiting[other] += 1
+
+        entry_components = {component_of[node] for node in entries}
+        reach: dict[int, int] = {}
+        runs: dict[int, list[tuple[int, int]]] = {}
+        lines = self.lines
+        # Tarjan completes a component after every component it reaches: one forward pass suffices.
+        for number, component in enumerate(components):
+            bits = 0
+            for node in component:
+                bits |= 1 << node
+            for other in successors[number]:
+                bits |= reach[other]
+                waiting[other] -= 1
+                if not waiting[other]:
+                    del reach[other]
+            if waiting[number]:
+                reach[number] = bits
+            if number in entry_components:
+                flags = format(bits, "b")[::-1]  # flags[node] == "1" when node is reached
+                runs[number] = [
+                    (lines[match.start()], lines[match.end() - 1]) for match in _RUN_OF_ONES.finditer(flags)
+                ]
+        return {lines[node]: runs[component_of[node]] for node in sorted(entries)}
+
+    def _components(self, roots: list[int], skip: frozenset[int]) -> tuple[list[list[int]], dict[int, int]]:
+        """Strongly connected components reachable from roots, and the component of each node.
+
+        Iterative Tarjan, linear in lines + edges. Components come out in
+        reverse topological order: each one after every component it reaches.
+        """
+        starts, targets, codes = self._succ_starts, self._succ_targets, self._succ_codes
+        index: dict[int, int] = {}
+        low: dict[int, int] = {}
+        on_stack: set[int] = set()
+        stack: list[int] = []
+        components: list[list[int]] = []
+        component_of: dict[int, int] = {}
+
+        for root in roots:
+            if root in index:
+                continue
+            work = [(root, starts[root])]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, slot = work[-1]
+                if slot < starts[node + 1]:
+                    work[-1] = (node, slot + 1)
+                    if codes[slot] in skip:
+                        continue
+                    target = targets[slot]
+                    if target not in index:
+                        index[target] = low[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, starts[target]))
+                    elif target in on_stack:
+                        low[node] = min(low[node], index[target])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component_of[member] = len(components)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components, component_of
+
+    def loops(self) -> list[list[int]]:
+        """Groups of lines that can repeat (strongly connected components), in program order.
+
+        Calls are not followed, so a loop is a GOTO/NEXT cycle within one
+        routine. Linear in lines + edges.
+        """
+        skip = _CALL_CODES | _NON_FLOW_CODES
+        components, _component_of = self._components(range(len(self.lines)), skip)
+        loops = [
+            sorted(self.lines[member] for member in component)
+            for component in components
+            if len(component) > 1 or self._has_self_edge(component[0], skip)
+        ]
+        loops.sort()
+        return loops
+
+    def _has_self_edge(self, node: int, skip: frozenset[int]) -> bool:
+        return any(
+            self._succ_targets[slot] == node and self._succ_codes[slot] not in skip
+            for slot in range(self._succ_starts[node], self._succ_starts[node + 1])
+        )
@@ -1,5 +1,12 @@
 from __future__ import annotations
 
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO, Iterator
+
+from msx_basic_numbers import double_to_string, single_to_string
+
 
 TOKEN_MAP = [
     "END", "FOR", "NEXT", "DATA", "INPUT", "DIM", "READ", "LET", "GOTO", "RUN",
@@ -32,25 +39,313 @@ def decode_msx_basic(data: bytes) -> str:
     return "".join(text for _kind, text in segments)
 
 
-def decode_msx_basic_segments(data: bytes) -> list[tuple[str, str]]:
+# Opcodes of the byte dispatch table used by the decoder engine.
+_OP_IGNORE = 0
+_OP_PLAIN = 1
+_OP_DIGIT = 2
+_OP_OCTAL = 3
+_OP_HEX = 4
+_OP_LINE_REF = 5
+_OP_BYTE = 6
+_OP_SINGLE = 7
+_OP_COLON = 8
+_OP_EXTENDED = 9
+_OP_TOKEN = 10
+_OP_STRING = 11
+_OP_DOUBLE = 12
+
+
+def _build_dispatch_table() -> list[int]:
+    table = [_OP_IGNORE] * 256
+    for byte in range(32, 256):
+        table[byte] = _OP_PLAIN
+    for byte in range(17, 27):
+        table[byte] = _OP_DIGIT
+    table[0x0B] = _OP_OCTAL
+    table[0x0C] = _OP_HEX
+    table[0x0E] = _OP_LINE_REF
+    table[0x1C] = _OP_LINE_REF
+    table[0x0F] = _OP_BYTE
+    table[0x1D] = _OP_SINGLE
+    table[0x1F] = _OP_DOUBLE
+    table[0x22] = _OP_STRING
+    table[0x3A] = _OP_COLON
+    for byte in range(0x80, 0xFF):
+        table[byte] = _OP_TOKEN
+    table[0xFF] = _OP_EXTENDED
+    return table
+
+
+def _build_token_table() -> list[tuple[str, str, bool]]:
+    """(kind, text, starts_comment) for every single-byte token value."""
+    table = []
+    for byte in range(256):
+        index = byte - 0x81
+        if 0 <= index < len(TOKEN_MAP):
+            keyword = TOKEN_MAP[index]
+            if keyword == "REM":
+                table.append(("command", keyword, True))
+            elif keyword == "'":
+                table.append(("comment", keyword, True))
+            else:
+                table.append(("command", keyword, False))
+        else:
+            table.append(("plain", f"-{byte}-", False))
+    return table
+
+
+_DISPATCH = _build_dispatch_table()
+_TOKEN_SEGMENTS = _build_token_table()
+_FUNCTION_SEGMENTS = [
+    ("function", TOKEN_MAP_FF[byte - 0x81]) if 0 <= byte - 0x81 < len(TOKEN_MAP_FF) else ("plain", f"-{byte}-")
+    for byte in range(256)
+]
+
+# Runs of printable ASCII that decode to themselves ('"' and ':' need special handling).
+_PLAIN_RUN = re.compile(rb"[\x20\x21\x23-\x39\x3B-\x7F]+")
+
+# Inside REM/' comments: control bytes are dropped, except 0x11-0x1A which are digits.
+_COMMENT_TRANSLATE = bytes(range(256)).replace(bytes(range(17, 27)), b"0123456789")
+_COMMENT_DELETE = bytes(byte for byte in range(32) if not 17 <= byte <= 26)
+
+
+def _decode_line_body(data: bytes, offset: int, add_segment) -> int:
+    """Decode the tokens of one line starting at offset; return the offset of its 0x00 terminator."""
+    size = len(data)
+    dispatch = _DISPATCH
+    plain_run = _PLAIN_RUN.match
+
+    while offset < size:
+        token = data[offset]
+        if token == 0x00:
+            break
+        op = dispatch[token]
+
+        if op == _OP_PLAIN:
+            match = plain_run(data, offset)
+            add_segment("plain", match.group().decode("latin-1"))
+            offset = match.end()
+            continue
+        elif op == _OP_TOKEN:
+            kind, text, starts_comment = _TOKEN_SEGMENTS[token]
+            add_segment(kind, text)
+            if starts_comment:
+                end = data.find(b"\x00", offset + 1)
+                if end == -1:
+                    end = size
+                comment = data[offset + 1:end].translate(_COMMENT_TRANSLATE, _COMMENT_DELETE)
+                add_segment("comment", comment.decode("latin-1"))
+                return end
+        elif op == _OP_STRING:
+            start = offset + 1
+            end = data.find(b'"', start)
+            terminator = data.find(b"\x00", start + 1)
+            if terminator != -1 and (end == -1 or terminator - 1 < end):
+                end = terminator - 1
+            if end == -1:
+                add_segment("string", '"' + data[start:].decode("latin-1"))
+                offset = size
+            else:
+                add_segment("string", '"' + data[start:end + 1].decode("latin-1"))
+                offset = end
+        elif op == _OP_EXTENDED:
+            offset += 1
+            if offset < size:
+                add_segment(*_FUNCTION_SEGMENTS[data[offset]])
+        elif op == _OP_COLON:
+            # "'" is stored as ":REM'" (3A 8F E6) and ELSE as ":ELSE" (3A A1)
+            next_token = data[offset + 1] if offset + 1 < size else None
+            if next_token == 0x8F and offset + 2 < size and data[offset + 2] == 0xE6:
+                offset += 1
+            elif next_token != 0xA1:
+                add_segment("plain", ":")
+        elif op == _OP_DIGIT:
+            add_segment("number", str(token - 17))
+        elif op == _OP_BYTE:
+            if offset + 1 >= size:
+                break
+            add_segment("number", str(data[offset + 1]))
+            offset += 1
+        elif op == _OP_OCTAL or op == _OP_HEX or op == _OP_LINE_REF:
+            if offset + 2 >= size:
+                break
+            value = data[offset + 1] | (data[offset + 2] << 8)
+            if op == _OP_LINE_REF:
+                add_segment("number", str(value))
+            elif op == _OP_HEX:
+                add_segment("number", f"&H{value:X}")
+            else:
+                add_segment("number", f"&O{value:o}")
+            offset += 2
+        elif op == _OP_SINGLE:
+            if offset + 4 >= size:
+                break
+            add_segment("number", single_to_string(data[offset + 1:offset + 5]))
+            offset += 4
+        elif op == _OP_DOUBLE:
+            if offset + 8 >= size:
+                break
+            add_segment("number", double_to_string(data[offset + 1:offset + 9]))
+            offset += 8
+
+        offset += 1
+
+    return offset
+
+
+class _SegmentBuilder:
+    """Collects runs of same-kind text and joins each run only once."""
+
+    __slots__ = ("segments", "_kind", "_parts")
+
+    def __init__(self) -> None:
+        self.segments: list[tuple[str, str]] = []
+        self._kind: str | None = None
+        self._parts: list[str] = []
+
+    def add(self, kind: str, text: str) -> None:
+        if not text:
+            return
+        if kind != self._kind:
+            if self._parts:
+                self.segments.append((self._kind, "".join(self._parts)))
+                self._parts.clear()
+            self._kind = kind
+        self._parts.append(text)
+
+    def finish(self) -> list[tuple[str, str]]:
+        if self._parts:
+            self.segments.append((self._kind, "".join(self._parts)))
+            self._parts.clear()
+        self._kind = None
+        return self.segments
+
+
+# Segment kinds as small integers, for SegmentSpans.kinds.
+SEGMENT_KINDS = ("plain", "line_number", "command", "function", "string", "number", "comment")
+SEGMENT_KIND_CODES = {kind: code for code, kind in enumerate(SEGMENT_KINDS)}
+
+
+class SegmentSpans:
+    """Decoded listing as one string plus a table of typed spans.
+
+    Equivalent to a segment list, without a string and a tuple per
+    segment: span i covers text[starts[i]:ends[i]] and has kind
+    SEGMENT_KINDS[kinds[i]]. Adjacent text of the same kind shares a span.
+    """
+
+    __slots__ = ("starts", "ends", "kinds", "length", "_parts", "_text", "_line_starts")
+
+    def __init__(self) -> None:
+        self.starts = array("I")
+        self.ends = array("I")
+        self.kinds = array("B")
+        self.length = 0
+        self._parts: list[str] = []
+        self._text: str | None = ""
+        self._line_starts: array | None = None
+
+    @classmethod
+    def from_segments(cls, segments) -> SegmentSpans:
+        spans = cls()
+        spans.extend(segments)
+        return spans
+
+    def add(self, kind: str, text: str) -> None:
+        if not text:
+            return
+        code = SEGMENT_KIND_CODES[kind]
+        end = self.length + len(text)
+        if self.kinds and self.kinds[-1] == code:
+            self.ends[-1] = end
+        else:
+            self.starts.append(self.length)
+            self.ends.append(end)
+            self.kinds.append(code)
+        self._parts.append(text)
+        self.length = end
+        self._text = None
+        self._line_starts = None
+
+    def extend(self, segments) -> None:
+        add = self.add
+        for kind, text in segments:
+            add(kind, text)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(self._parts)
+            self._parts = [self._text] if self._text else []
+        return self._text
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        """(kind, text) pairs, as decode_msx_basic_segments returns them."""
+        text = self.text
+        for start, end, code in zip(self.starts, self.ends, self.kinds):
+            yield SEGMENT_KINDS[code], text[start:end]
+
+    def segments(self) -> list[tuple[str, str]]:
+        return list(self)
+
+    def _line_start_table(self) -> array:
+        if self._line_starts is None:
+            text = self.text
+            line_starts = array("I", [0])
+            pos = text.find("\n")
+            while pos != -1:
+                line_starts.append(pos + 1)
+                pos = text.find("\n", pos + 1)
+            self._line_starts = line_starts
+        return self._line_starts
+
+    def line_col(self, offset: int) -> tuple[int, int]:
+        """1-based line and 0-based column of a text offset (Tk "line.col")."""
+        line_starts = self._line_start_table()
+        line = bisect_right(line_starts, offset)
+        return line, offset - line_starts[line - 1]
+
+    def text_indexes(self, first_line: int = 1, first_col: int = 0) -> dict[str, list[str]]:
+        """Kind -> flat [start, end, start, end, ...] Tk indexes of its spans.
+
+        Plain text is left out. first_line/first_col give where text[0]
+        sits in the widget, so a batch appended to existing content can be
+        tagged in place.
+        """
+        line_starts = self._line_start_table()
+        line_count = len(line_starts)
+        by_code: list[list[str]] = [[] for _ in SEGMENT_KINDS]
+        line = 0  # index into line_starts; spans come in text order
+        for start, end, code in zip(self.starts, self.ends, self.kinds):
+            if code == 0:
+                continue
+            indexes = by_code[code]
+            for offset in (start, end):
+                while line + 1 < line_count and line_starts[line + 1] <= offset:
+                    line += 1
+                col = offset - line_starts[line]
+                if line == 0:
+                    col += first_col
+                indexes.append(f"{first_line + line}.{col}")
+        return {SEGMENT_KINDS[code]: indexes for code, indexes in enumerate(by_code) if indexes}
+
+
+def _check_header(data: bytes) -> None:
     if not data:
         raise ValueError("invalid MSX Basic file: file is empty")
     if data[0] != 0xFF:
         raise ValueError(f"invalid MSX Basic file: expected 0xFF, got 0x{data[0]:02X}")
 
-    result: list[tuple[str, str]] = []
-    offset = 1
 
-    def add_segment(kind: str, text: str) -> None:
-        if not text:
-            return
-        if result and result[-1][0] == kind:
-            result[-1] = (kind, result[-1][1] + text)
-        else:
-            result.append((kind, text))
+def _decode_program(data: bytes, add_segment) -> None:
+    size = len(data)
+    offset = 1
 
     while True:
-        if offset + 4 > len(data):
+        if offset + 4 > size:
             break
 
         offset += 2  # next line address
@@ -59,137 +354,220 @@ def decode_msx_basic_segments(data: bytes) -> list[tuple[str, str]]:
         offset += 2
         add_segment("line_number", str(line_number))
         add_segment("plain", " ")
-        comment_mode = False
 
-        while offset < len(data) and data[offset] != 0x00:
-            token = data[offset]
+        offset = _decode_line_body(data, offset, add_segment)
 
-            if comment_mode:
-                if token >= 32:
-                    add_segment("comment", chr(token))
-                elif 17 <= token <= 26:
-                    add_segment("comment", str(token - 17))
-                offset += 1
-                continue
+        if offset < size and data[offset] == 0x00:
+            add_segment("plain", "\n")
+            offset += 1
 
-            if token == 0x0B:
-                if offset + 2 >= len(data):
-                    break
-                value = data[offset + 1] | (data[offset + 2] << 8)
-                add_segment("number", f"&O{value:o}")
-                offset += 2
-            elif token == 0x0C:
-                if offset + 2 >= len(data):
-                    break
-                value = data[offset + 1] | (data[offset + 2] << 8)
-                add_segment("number", f"&H{value:X}")
-                offset += 2
-            elif token == 0x0E or token == 0x1C:
-                if offset + 2 >= len(data):
-                    break
-                line = data[offset + 1] | (data[offset + 2] << 8)
-                add_segment("number", str(line))
-                offset += 2
-            elif token == 0x0F:
-                if offset + 1 >= len(data):
-                    break
-                value = data[offset + 1]
-                add_segment("number", str(value))
-                offset += 1
-            elif token == 0x1D:
-                if offset + 4 >= len(data):
-                    break
-                add_segment("number", custom_bcd_to_string(data[offset + 1:offset + 5]))
-                offset += 4
-            elif token == 0x3A:
-                if offset + 1 < len(data):
-                    next_token = data[offset + 1]
-                    if next_token == 0x8F:
-                        offset += 1
-                    elif next_token == 0xA1:
-                        pass
-                    else:
-                        add_segment("plain", chr(token))
-                else:
-                    add_segment("plain", chr(token))
-            elif token == 0xFF:
-                offset += 1
-                if offset < len(data):
-                    next_token = data[offset]
-                    index = next_token - 0x81
-                    if 0 <= index < len(TOKEN_MAP_FF):
-                        add_segment("function", TOKEN_MAP_FF[index])
-                    else:
-                        add_segment("plain", f"-{next_token}-")
-            elif token >= 0x80:
-                index = token - 0x81
-                if 0 <= index < len(TOKEN_MAP):
-                    keyword = TOKEN_MAP[index]
-                    if keyword == "REM":
-                        add_segment("command", keyword)
-                        comment_mode = True
-                    elif keyword == "'":
-                        add_segment("comment", keyword)
-                        comment_mode = True
-                    else:
-                        add_segment("command", keyword)
-                else:
-                    add_segment("plain", f"-{token}-")
-            elif token == 34:
-                string_value = '"'
-                offset += 1
-                while offset < len(data):
-                    token = data[offset]
-                    string_value += chr(token)
-                    if token == 34:
-                        break
-                    if offset + 1 < len(data) and data[offset + 1] == 0:
-                        break
-                    offset += 1
-                add_segment("string", string_value)
-            elif token >= 32:
-                add_segment("plain", chr(token))
-            elif 17 <= token <= 26:
-                add_segment("number", str(token - 17))
+        if offset + 1 < size and data[offset] == 0x00 and data[offset + 1] == 0x00:
+            break
 
-            offset += 1
 
-        if offset < len(data) and data[offset] == 0x00:
-            add_segment("plain", "\n")
-            offset += 1
+def decode_msx_basic_segments(data: bytes) -> list[tuple[str, str]]:
+    _check_header(data)
+    builder = _SegmentBuilder()
+    _decode_program(bytes(data), builder.add)
+    return builder.finish()
+
+
+def decode_msx_basic_spans(data: bytes) -> SegmentSpans:
+    """Same content as decode_msx_basic_segments, as a SegmentSpans table."""
+    _check_header(data)
+    spans = SegmentSpans()
+    _decode_program(bytes(data), spans.add)
+    return spans
+
+
+STREAM_CHUNK_SIZE = 65536
+_LINE_SCAN_WINDOW = 512
+
+
+class _StreamBuffer:
+    """Sliding byte window over a binary file object or an in-memory buffer."""
+
+    def __init__(self, source: BinaryIO | bytes | bytearray | memoryview, chunk_size: int) -> None:
+        self.base = 0  # file offset of data[0]
+        self.chunk_size = chunk_size
+        if hasattr(source, "read"):
+            self._read = source.read
+            self.data: bytearray | memoryview = bytearray()
+            self.eof = False
+        else:
+            self._read = None
+            self.data = memoryview(source).cast("B")
+            self.eof = True
+
+    def fill(self, size: int) -> bool:
+        """Make sure at least size bytes are buffered; False if the source is shorter."""
+        while len(self.data) < size and not self.eof:
+            chunk = self._read(self.chunk_size)
+            if chunk:
+                self.data += chunk
+            else:
+                self.eof = True
+        return len(self.data) >= size
+
+    def discard(self, pos: int) -> int:
+        """Drop the bytes before pos once they are no longer needed; return the new pos."""
+        if self._read is None or pos < self.chunk_size:
+            return pos
+        del self.data[:pos]
+        self.base += pos
+        return 0
+
 
-        if offset + 1 < len(data) and data[offset] == 0x00 and data[offset + 1] == 0x00:
+def _ignore_segment(_kind: str, _text: str) -> None:
+    pass
+
+
+def _scan_line_end(stream: _StreamBuffer, pos: int) -> int:
+    """Find the 0x00 that ends the line at pos by decoding its tokens."""
+    window = _LINE_SCAN_WINDOW
+    while True:
+        available = stream.fill(pos + 4 + window)
+        body = bytes(stream.data[pos + 4:pos + 4 + window])
+        end = _decode_line_body(body, 0, _ignore_segment)
+        if end < len(body) and body[end] == 0x00:
+            return pos + 4 + end
+        if not available:
+            return len(stream.data)
+        window *= 2
+
+
+def _iter_line_spans(stream: _StreamBuffer) -> Iterator[tuple[int, int, int]]:
+    """Yield (line_number, pos, end) for each line, following the next-line links.
+
+    pos is the line's link field and end its 0x00 terminator, both indexes into
+    stream.data that stay valid until the generator is resumed.
+    """
+    pos = 1
+    link_base: int | None = None  # link value minus file offset, learned from the first line
+    while stream.fill(pos + 4):
+        data = stream.data
+        link = data[pos] | (data[pos + 1] << 8)
+        if link == 0:
             break
+        line_number = data[pos + 2] | (data[pos + 3] << 8)
+
+        end = -1
+        if link_base is not None:
+            next_line = link - link_base - stream.base
+            if next_line > pos + 4 and stream.fill(next_line) and stream.data[next_line - 1] == 0x00:
+                end = next_line - 1
+        if end < 0:
+            end = _scan_line_end(stream, pos)
+            if link_base is None:
+                link_base = link - (stream.base + end + 1)
+
+        yield line_number, pos, end
+
+        pos = stream.discard(end + 1)
+
+
+def _decode_line(line_number: int, line: bytes) -> list[tuple[str, str]]:
+    """Segments of one program line; line holds its tokens and the 0x00 terminator."""
+    builder = _SegmentBuilder()
+    builder.add("line_number", str(line_number))
+    builder.add("plain", " ")
+    _decode_line_body(line, 0, builder.add)
+    builder.add("plain", "\n")
+    return builder.finish()
+
+
+def _iter_msx_basic_lines(stream: _StreamBuffer) -> Iterator[tuple[int, list[tuple[str, str]]]]:
+    for line_number, pos, end in _iter_line_spans(stream):
+        yield line_number, _decode_line(line_number, bytes(stream.data[pos + 4:end + 1]))
+
+
+def iter_msx_basic_lines(
+    source: BinaryIO | bytes | bytearray | memoryview,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[tuple[int, list[tuple[str, str]]]]:
+    """Decode a tokenized program one line at a time, yielding (line_number, segments).
+
+    Lines are found by following the next-line links (their base address is taken
+    from the first line), so only the current line is held in memory. The header
+    is checked immediately, before the first line is read.
+    """
+    stream = _StreamBuffer(source, chunk_size)
+    stream.fill(1)
+    _check_header(stream.data[:1])
+    return _iter_msx_basic_lines(stream)
+
+
+class MSXBasicLineIndex:
+    """Line number -> byte offset/length index over a tokenized program.
+
+    Built in one pass over the next-line links without decoding any tokens, so
+    single lines or ranges can be decoded on demand. Offsets point at each
+    line's link field; lengths include the link, line number and terminator.
+    """
+
+    def __init__(self, data: bytes | bytearray | memoryview) -> None:
+        self.data = memoryview(data).cast("B")
+        _check_header(self.data[:1])
+        self.line_numbers = array("I")
+        self.offsets = array("I")
+        self.lengths = array("I")
+
+        stream = _StreamBuffer(self.data, STREAM_CHUNK_SIZE)
+        for line_number, pos, end in _iter_line_spans(stream):
+            self.line_numbers.append(line_number)
+            self.offsets.append(pos)
+            self.lengths.append(end + 1 - pos)
+
+        self._sorted = all(a < b for a, b in zip(self.line_numbers, self.line_numbers[1:]))
+        self._positions = {number: position for position, number in enumerate(self.line_numbers)}
+
+    def __len__(self) -> int:
+        return len(self.line_numbers)
+
+    def __contains__(self, line_number: int) -> bool:
+        return line_number in self._positions
+
+    def position(self, line_number: int) -> int | None:
+        """Index of the line in file order, or None if the program has no such line."""
+        return self._positions.get(line_number)
+
+    def span(self, line_number: int) -> tuple[int, int]:
+        """(offset, length) of the line in the tokenized data."""
+        position = self._positions[line_number]
+        return self.offsets[position], self.lengths[position]
+
+    def _decode_at(self, position: int) -> list[tuple[str, str]]:
+        offset = self.offsets[position]
+        line = bytes(self.data[offset + 4:offset + self.lengths[position]])
+        return _decode_line(self.line_numbers[position], line)
+
+    def decode_line(self, line_number: int) -> list[tuple[str, str]]:
+        """Segments of a single line; raises KeyError if the line does not exist."""
+        return self._decode_at(self._positions[line_number])
+
+    def decode_slice(self, start: int, stop: int) -> list[tuple[str, str]]:
+        """Segments of the lines at positions start..stop-1 (e.g. the visible viewport)."""
+        segments: list[tuple[str, str]] = []
+        for position in range(max(start, 0), min(stop, len(self.line_numbers))):
+            segments.extend(self._decode_at(position))
+        return segments
 
-    return result
+    def decode_range(self, first_line: int, last_line: int) -> list[tuple[str, str]]:
+        """Segments of every line numbered first_line..last_line (inclusive)."""
+        if self._sorted:
+            start = bisect_left(self.line_numbers, first_line)
+            stop = bisect_right(self.line_numbers, last_line)
+            return self.decode_slice(start, stop)
+        segments: list[tuple[str, str]] = []
+        for position, number in enumerate(self.line_numbers):
+            if first_line <= number <= last_line:
+                segments.extend(self._decode_at(position))
+        return segments
 
 
 def custom_bcd_to_string(b: bytes) -> str:
-    if len(b) != 4:
-        return ""
-
-    sign = "-" if b[0] & 0x80 != 0 else ""
-    exponent = (b[0] & 0x7F) - 64
-    mantissa = f"{b[1]:02X}{b[2]:02X}{b[3]:02X}"
-
-    mantissa_string = insert_decimal_point(mantissa, 1)
-    mantissa_string = remove_trailing_zeros(mantissa_string)
-
-    if exponent == -64:
-        return "0!"
-    if -63 <= exponent < -1:
-        return f"{sign}{mantissa_string}E{exponent - 1:03d}"
-    if exponent == -1:
-        mantissa_string = ".0" + mantissa
-        mantissa_string = remove_trailing_zeros(mantissa_string)
-        return f"{sign}{mantissa_string}"
-    if 0 <= exponent < 15:
-        mantissa_string = shift_point_right(mantissa, exponent)
-        mantissa_string = remove_trailing_zeros(mantissa_string)
-        return f"{sign}{mantissa_string}"
-    if 15 <= exponent <= 63:
-        return f"{sign}{mantissa_string}E+{exponent - 1:02d}"
-    return "XXX"
+    """Text of a single-precision (0x1D) constant; see msx_basic_numbers."""
+    return single_to_string(bytes(b))
 
 
 def insert_decimal_point(mantissa: str, pos: int) -> str:
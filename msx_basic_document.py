@@ -0,0 +1,116 @@
+"""Line-keyed model of the program in the editor, kept in step with the text widget."""
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+
+from msx_basic_lexer import Token, split_line_number, tokenize
+
+
+class ProgramDocument:
+    """Text lines of the editor with their BASIC line numbers, tokens and a sorted line-number index.
+
+    The editor feeds it every edit as "text lines first..first+removed are
+    now these lines" (replace_lines), so features read lines, numbers and
+    tokens from here instead of pulling and splitting the whole buffer out
+    of Tk. Text line numbers are 1-based, as in Tk indexes.
+    """
+
+    def __init__(self, text: str = "", dialect: str | None = None) -> None:
+        self.dialect = dialect
+        self.version = 0  # bumped on every change
+        self._tokens: dict[str, list[Token]] = {}  # line text -> tokens of its statements
+        self.set_text(text)
+
+    def set_text(self, text: str) -> None:
+        self.lines: list[str] = text.split("\n")
+        self.numbers: list[int | None] = [split_line_number(line)[0] for line in self.lines]
+        self._index: tuple[list[int], list[int]] | None = None  # built on first use
+        self._changed()
+
+    def set_dialect(self, dialect: str | None) -> None:
+        if dialect != self.dialect:
+            self.dialect = dialect
+            self._tokens.clear()
+
+    def replace_lines(self, first: int, last: int, new_lines: list[str]) -> None:
+        """Text lines first..last (inclusive) become new_lines."""
+        new_numbers = [split_line_number(line)[0] for line in new_lines]
+        if self._index is not None:
+            self._update_index(first, last, new_numbers)
+        self.lines[first - 1:last] = new_lines
+        self.numbers[first - 1:last] = new_numbers
+        self._changed()
+
+    def _update_index(self, first: int, last: int, new_numbers: list[int | None]) -> None:
+        """Move the line-number index over an edit of text lines first..last, before self.numbers is."""
+        numbers, lines = self._index
+        for line, number in enumerate(self.numbers[first - 1:last], first):
+            if number is not None:
+                position = self._index_position(number, line)
+                del numbers[position], lines[position]
+        # Text lines below the edit move up or down by the change in line count.
+        shift = len(new_numbers) - (last - first + 1)
+        if shift:
+            lines[:] = [line + shift if line > last else line for line in lines]
+        for line, number in enumerate(new_numbers, first):
+            if number is not None:
+                position = self._index_position(number, line)
+                numbers.insert(position, number)
+                lines.insert(position, line)
+
+    def _index_position(self, number: int, line: int) -> int:
+        """Where (number, line) is, or goes, in the index: by number, then by text line."""
+        numbers, lines = self._index
+        return bisect_left(lines, line, bisect_left(numbers, number), bisect_right(numbers, number))
+
+    def _changed(self) -> None:
+        self.version += 1
+        # Tokens of lines that no longer exist are dropped once the cache outgrows the program.
+        if len(self._tokens) > 2 * len(self.lines) + 64:
+            current = set(self.lines)
+            self._tokens = {line: tokens for line, tokens in self._tokens.items() if line in current}
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def line(self, line: int) -> str:
+        return self.lines[line - 1]
+
+    def line_number(self, line: int) -> int | None:
+        """BASIC line number of text line `line`, or None if it is not numbered."""
+        return self.numbers[line - 1]
+
+    def tokens(self, line: int) -> list[Token]:
+        """Tokens of the statements of text line `line` (columns in the full line), cached by line text."""
+        text = self.lines[line - 1]
+        tokens = self._tokens.get(text)
+        if tokens is None:
+            _number, code_start = split_line_number(text)
+            tokens = self._tokens[text] = tokenize(text[code_start:], code_start, self.dialect)
+        return tokens
+
+    def _number_index(self) -> tuple[list[int], list[int]]:
+        if self._index is None:
+            pairs = sorted((number, line) for line, number in enumerate(self.numbers, 1) if number is not None)
+            self._index = ([number for number, _line in pairs], [line for _number, line in pairs])
+        return self._index
+
+    def find_line(self, number: int) -> int | None:
+        """Text line holding BASIC line `number` (the last one if it is repeated), or None."""
+        numbers, lines = self._number_index()
+        position = bisect_right(numbers, number) - 1
+        if position >= 0 and numbers[position] == number:
+            return lines[position]
+        return None
+
+    def lines_between(self, first_number: int, last_number: int) -> list[int]:
+        """Text lines whose BASIC line number is in first_number..last_number, in number order."""
+        numbers, lines = self._number_index()
+        return lines[bisect_left(numbers, first_number):bisect_right(numbers, last_number)]
+
+    def unnumbered_lines(self) -> list[int]:
+        """Text lines with statements but no line number."""
+        return [line for line, (text, number) in enumerate(zip(self.lines, self.numbers), 1) if number is None and text.strip()]
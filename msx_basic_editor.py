@@ -3,13 +3,23 @@ from __future__ import annotations
 import tkinter as tk
 import tkinter.font as tkfont
 import re
+import sqlite3
+import threading
+from collections import deque
 from pathlib import Path
 from tkinter import filedialog, messagebox
 
 import customtkinter as ctk
 
-from msx_basic_decoder import decode_msx_basic_segments
+from msx_basic_decoder import SegmentSpans, iter_msx_basic_lines
+from msx_basic_document import ProgramDocument
+from msx_basic_encoder import encode_msx_basic
+from msx_basic_highlighter import IncrementalHighlighter
+from msx_basic_lexer import split_line_number, tokenize
+from msx_basic_search import SearchIndex
+from msx_basic_renum import MAX_LINE_NUMBER, RenumConflict, RenumResult, renumber
 from help_viewer import HelpViewer
+from job_executor import JobExecutor, stream_items
 from msx_encoding_viewer import MSXEncodingViewer
 from syntax_themes import SYNTAX_THEMES, DEFAULT_SYNTAX_THEME, get_syntax_colors, save_syntax_colors
 
@@ -35,6 +45,30 @@ MSX1_PALETTE: list[tuple[int, str, str]] = [
     (15, "white",        "#FFFFFF"),
 ]
 
+# Linhas decodificadas inseridas por vez ao abrir arquivos tokenizados
+LOAD_STREAM_BATCH_LINES = 300
+# Intervalos por chamada de tag_add ao carregar arquivos tokenizados
+TAG_RANGES_PER_CALL = 2000
+# Tipo de segmento do decodificador -> tag de realce do editor
+DECODED_KIND_TAGS = {
+    "command": "keyword",
+    "function": "function",
+    "string": "string",
+    "number": "number",
+    "comment": "comment",
+    "line_number": "linenumber",
+}
+# Intervalo (ms) em que os redesenhos da régua e dos números de linha são agrupados (~1 quadro)
+REDRAW_FRAME_MS = 16
+# Espera (ms) após a última edição antes de atualizar o Mapa do Programa aberto
+PROGRAM_MAP_REFRESH_MS = 400
+# Linhas processadas por um job entre verificações de cancelamento/progresso
+JOB_CHECK_LINES = 200
+# Localizar: espera (ms) após a digitação antes de buscar e linhas marcadas além das visíveis
+FIND_DELAY_MS = 120
+FIND_TAG_MARGIN_LINES = 100
+
+
 
 class LineNumbers(tk.Canvas):
     def __init__(self, master, font, editor, **kwargs):
@@ -42,131 +76,175 @@ class LineNumbers(tk.Canvas):
         self.font = font
         self.editor = editor
         self.textbox = None
+        # Itens de texto reaproveitados entre redesenhos e o que cada um mostra agora: (y, texto, cor)
+        self._items: list[int] = []
+        self._shown: list[tuple[int, str, str] | None] = []
+        self._bg: str | None = None
+        self._redraw_job: str | None = None
 
     def set_textbox(self, textbox):
         self.textbox = textbox
 
     def redraw(self):
-        self.delete("all")
+        # Vários eventos no mesmo quadro viram um único redesenho
+        if self._redraw_job is None:
+            self._redraw_job = self.after(REDRAW_FRAME_MS, self._draw)
+
+    def _draw(self):
+        self._redraw_job = None
         if not self.textbox:
             return
 
         # Update background color from settings
         bg_color = self.editor.settings.get("color_bg", "#2b2b2b")
-        self.configure(bg=bg_color)
+        if bg_color != self._bg:
+            self.configure(bg=bg_color)
+            self._bg = bg_color
+
+        text = self.textbox._textbox
+        current_linenum = self.textbox.index(tk.INSERT).split(".")[0]
+        fg_normal = self.editor.settings.get("color_line_number", "#858585")
+        fg_current = self.editor.settings.get("color_fg", "#ffffff")
 
-        i = self.textbox.index("@0,0")
+        slot = 0
+        i = text.index("@0,0")
         while True:
-            dline = self.textbox._textbox.dlineinfo(i)
+            dline = text.dlineinfo(i)
             if dline is None:
                 break
-            y = dline[1]
-            linenum = str(i).split(".")[0]
-            
-            # Highlight current line
-            cursor_pos = self.textbox.index(tk.INSERT)
-            current_linenum = cursor_pos.split(".")[0]
-            
-            fg = self.editor.settings.get("color_line_number", "#858585")
-            if linenum == current_linenum:
-                fg = self.editor.settings.get("color_fg", "#ffffff")
-                
-            self.create_text(45, y, anchor="ne", text=linenum, font=self.font, fill=fg)
-            i = self.textbox.index(f"{i} + 1line")
+            linenum = i.split(".")[0]
+            wanted = (dline[1], linenum, fg_current if linenum == current_linenum else fg_normal)
+            if slot == len(self._items):
+                self._items.append(self.create_text(45, wanted[0], anchor="ne", text=linenum, font=self.font, fill=wanted[2]))
+                self._shown.append(wanted)
+            elif self._shown[slot] != wanted:
+                shown = self._shown[slot]
+                item = self._items[slot]
+                if shown is None or shown[0] != wanted[0]:
+                    self.coords(item, 45, wanted[0])
+                if shown is None or shown[1:] != wanted[1:]:
+                    self.itemconfigure(item, text=linenum, fill=wanted[2], state="normal")
+                self._shown[slot] = wanted
+            slot += 1
+            i = text.index(f"{i} + 1line")
+            if i.split(".")[0] == linenum:  # última linha
+                break
+
+        # Sobrou item de um redesenho com mais linhas visíveis: só esconde
+        for extra in range(slot, len(self._items)):
+            if self._shown[extra] is not None:
+                self.itemconfigure(self._items[extra], state="hidden")
+                self._shown[extra] = None
 
 
 class Ruler(tk.Canvas):
+    COLUMNS = 120
+    # Colunas destacadas: 0 e as larguras de tela do MSX (32, 40, 80)
+    HIGHLIGHTS = frozenset({0, 32, 40, 80})
+
     def __init__(self, master, font, editor, **kwargs):
         super().__init__(master, height=25, highlightthickness=0, bg="#2b2b2b", **kwargs)
         self.font = font
         self.editor = editor
         self.textbox = None
+        self._font_spec = None
+        self._char_width = 0
+        # Escala desenhada (tag "scale") para estas cores/largura, na posição x de _start_x
+        self._scale_key: tuple | None = None
+        self._start_x: float | None = None
+        self._cursor_item: int | None = None
+        self._cursor_state: tuple[float, str] | None = None
+        self._redraw_job: str | None = None
 
     def set_textbox(self, textbox):
         self.textbox = textbox
 
     def redraw(self):
-        self.delete("all")
-        if not self.textbox:
-            return
+        # Vários eventos no mesmo quadro viram um único redesenho
+        if self._redraw_job is None:
+            self._redraw_job = self.after(REDRAW_FRAME_MS, self._draw)
 
-        # Update background color from settings
-        bg_color = self.editor.settings.get("color_bg", "#2b2b2b")
-        self.configure(bg=bg_color)
-
-        # Get character width from internal textbox font
+    def _measure_char(self) -> int:
+        # A fonte só é medida de novo quando muda
         font_val = self.textbox._textbox.cget("font")
-        f = tkfont.Font(font=font_val)
-        char_width = f.measure("0")
-        
-        # Current cursor column for highlighting
-        cursor_pos = self.textbox.index(tk.INSERT)
-        _, current_col = map(int, cursor_pos.split("."))
-        
-        # Numbers to highlight: 0, 32, 40, 80
-        highlights = {0, 32, 40, 80}
-        
-        # Horizontal scroll position
+        if font_val != self._font_spec:
+            self._font_spec = font_val
+            self._char_width = tkfont.Font(font=font_val).measure("0")
+        return self._char_width
+
+    def _column_zero_x(self) -> float:
         x_offset = self.textbox._textbox.xview()[0]
-        # We need the total width of the text area to convert x_offset to pixels
-        # But bbox is easier if we have text.
-        
+
         # Use bbox to find the x position of column 0
         bbox = self.textbox._textbox.bbox("1.0")
         if bbox:
-            start_x = bbox[0]
-        else:
-            # Fallback if text is empty or bbox fails
-            # If bbox is None, it might be because the text is scrolled out of view
-            # or the textbox is empty.
-            # If it's scrolled out of view, we can't easily use bbox.
-            # But we can try bbox for a visible line.
-            
-            # Get the first visible index
-            first_visible = self.textbox.index("@0,0")
-            line_start = first_visible.split(".")[0] + ".0"
-            bbox = self.textbox._textbox.bbox(line_start)
-            if bbox:
-                start_x = bbox[0]
+            return bbox[0]
+        # Se a linha 1 saiu da tela, usa a primeira linha visível
+        first_visible = self.textbox.index("@0,0")
+        line_start = first_visible.split(".")[0] + ".0"
+        bbox = self.textbox._textbox.bbox(line_start)
+        if bbox:
+            return bbox[0]
+        # Absolute fallback - usually CTkTextbox has 2px padding
+        if x_offset == 0:
+            return 2
+        # Estimativa quando não há texto visível para medir
+        return 2 - (x_offset * self.textbox._textbox.winfo_width())
+
+    def _draw(self):
+        self._redraw_job = None
+        if not self.textbox:
+            return
+
+        settings = self.editor.settings
+        bg_color = settings.get("color_bg", "#2b2b2b")
+        highlight_fg = settings.get("color_command", "#569CD6")
+        cursor_fg = settings.get("color_string", "#CE9178")
+        char_width = self._measure_char()
+        start_x = self._column_zero_x()
+
+        scale_key = (bg_color, highlight_fg, char_width)
+        if scale_key != self._scale_key:
+            self._build_scale(scale_key, start_x)
+            self._scale_key = scale_key
+        elif start_x != self._start_x:
+            # Rolagem horizontal: desloca a escala inteira, sem recriar nada
+            self.move("scale", start_x - self._start_x, 0)
+            self._start_x = start_x
+
+        # Cursor highlight on ruler: um único item, movido só quando a posição ou a cor mudam
+        current_col = int(self.textbox.index(tk.INSERT).split(".")[1])
+        x = start_x + current_col * char_width
+        cursor_state = (x, cursor_fg) if current_col < self.COLUMNS else None
+        if self._cursor_item is None:
+            self._cursor_item = self.create_line(x, 0, x, 25, fill=cursor_fg, width=1, dash=(2, 2))
+            self._cursor_state = (x, cursor_fg)
+        if cursor_state != self._cursor_state:
+            if cursor_state is None:
+                self.itemconfigure(self._cursor_item, state="hidden")
             else:
-                # Absolute fallback - usually CTkTextbox has 2px padding
-                # But it's better to be dynamic. 
-                # If we are at scroll 0, it's likely 2.
-                if x_offset == 0:
-                    start_x = 2
-                else:
-                    # If we are scrolled, we have to estimate or use a different method.
-                    # Since we want it to align with the text, if we can't find the text,
-                    # we might as well not draw or draw at a best guess.
-                    start_x = 2 - (x_offset * self.textbox._textbox.winfo_width()) # This is often not accurate
-        
-        # Adjust start_x for the fact that Ruler is grid-aligned with Textbox
-        # Both are in column 1 of editor_frame.
-        
-        # Draw marks and numbers
-        for col in range(120): # Draw up to 120 columns
+                self.coords(self._cursor_item, x, 0, x, 25)
+                self.itemconfigure(self._cursor_item, fill=cursor_fg, state="normal")
+            self._cursor_state = cursor_state
+
+    def _build_scale(self, scale_key: tuple, start_x: float) -> None:
+        bg_color, highlight_fg, char_width = scale_key
+        self.configure(bg=bg_color)
+        self.delete("scale")
+        for col in range(self.COLUMNS):
             x = start_x + (col * char_width)
-            
-            if col in highlights:
-                fg = self.editor.settings.get("color_command", "#569CD6") # Highlight color
-                weight = "bold"
-                # Small line mark
-                self.create_line(x, 15, x, 25, fill=fg, width=2)
-                # Number
-                # For fixed-width fonts, we want the number to be centered or aligned exactly.
-                # anchor="n" centers the text horizontally at x.
-                self.create_text(x, 5, text=str(col), font=(self.font[0], 10, weight), fill=fg, anchor="n")
+            if col in self.HIGHLIGHTS:
+                # Small line mark + number centered on the column
+                self.create_line(x, 15, x, 25, fill=highlight_fg, width=2, tags="scale")
+                self.create_text(x, 5, text=str(col), font=(self.font[0], 10, "bold"), fill=highlight_fg, anchor="n", tags="scale")
             elif col % 10 == 0:
-                self.create_line(x, 20, x, 25, fill="#555555")
-                if col not in highlights:
-                    self.create_text(x, 8, text=str(col), font=(self.font[0], 8), fill="#858585", anchor="n")
+                self.create_line(x, 20, x, 25, fill="#555555", tags="scale")
+                self.create_text(x, 8, text=str(col), font=(self.font[0], 8), fill="#858585", anchor="n", tags="scale")
             elif col % 5 == 0:
-                self.create_line(x, 22, x, 25, fill="#555555")
-
-            # Cursor highlight on ruler
-            if col == current_col:
-                cursor_fg = self.editor.settings.get("color_string", "#CE9178")
-                self.create_line(x, 0, x, 25, fill=cursor_fg, width=1, dash=(2, 2))
+                self.create_line(x, 22, x, 25, fill="#555555", tags="scale")
+        self._start_x = start_x
+        if self._cursor_item is not None:
+            self.tag_raise(self._cursor_item)
 
 
 class MSXBasicEditor(ctk.CTk):
@@ -175,6 +253,8 @@ class MSXBasicEditor(ctk.CTk):
 
         from app_db import AppDatabase
         self.db = AppDatabase(Path("msxread.db"))
+        # Trabalho pesado (decodificar, analisar, formatar, renumerar) roda fora da thread do Tk
+        self.jobs = JobExecutor.for_widget(self)
 
         # Default settings
         self.settings = {
@@ -199,7 +279,33 @@ class MSXBasicEditor(ctk.CTk):
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(1, weight=1)
 
+        # Linhas já decodificadas pela thread e ainda não inseridas no editor
+        self._load_pending: deque[tuple[int, list[tuple[str, str]]]] = deque()
+        self._load_decoding = False
+        self._load_stream_job: str | None = None
+        # Arquivo aberto/salvo por último: é ele que a referência cruzada no banco acompanha
+        self._current_path: str | None = None
+
+        # Mapa do Programa: o analisador guarda o resultado por linha entre atualizações
+        self._map_analyzer = None
+        self._map_lock = threading.Lock()
+        self._program_map_window: ctk.CTkToplevel | None = None
+        self._program_map_job: str | None = None
+
+        # Localizar: índice das ocorrências sobre uma cópia do texto; só as perto da tela são marcadas
+        self.search_index = SearchIndex()
+        self._find_dialog: ctk.CTkToplevel | None = None
+        self._find_stale = True
+        self._find_job: str | None = None
+        self._find_tagged: tuple[int, int] | None = None
+        self._find_current: int | None = None
+
         self._build_ui()
+        # Realce incremental: só as linhas alteradas desde a última passada são re-marcadas
+        self.highlighter = IncrementalHighlighter(self.textbox._textbox, self.settings.get("dialect"))
+        # Modelo do programa por linha: acompanha cada edição do texto, e os comandos leem dele
+        self.document = ProgramDocument(self.textbox.get("1.0", "end - 1c"), self.settings.get("dialect"))
+        self.highlighter.add_listener(self._on_buffer_change)
         self._setup_syntax_highlighting()
 
     def _build_ui(self) -> None:
@@ -214,6 +320,7 @@ class MSXBasicEditor(ctk.CTk):
         self.file_menu.add_command(label="Novo", command=self._clear_editor)
         self.file_menu.add_command(label="Abrir...", command=self._open_file)
         self.file_menu.add_command(label="Salvar", command=self._save_file)
+        self.file_menu.add_command(label="Salvar Tokenizado (.bas)...", command=lambda: self._save_file(tokenized=True))
         self.file_menu.add_separator()
         self.file_menu.add_command(label="Sair", command=self.destroy)
 
@@ -361,6 +468,8 @@ class MSXBasicEditor(ctk.CTk):
         # Standard yscrollcommand handling
         self.textbox._y_scrollbar.set(*args)
         self.line_numbers.redraw()
+        if self._find_dialog is not None:
+            self._tag_visible_matches()
 
     def _on_textbox_scroll_x(self, *args) -> None:
         self.textbox._x_scrollbar.set(*args)
@@ -554,222 +663,418 @@ class MSXBasicEditor(ctk.CTk):
         fg = self.settings.get("color_fg", "#ffffff")
         self.textbox.configure(fg_color=bg, text_color=fg)
 
+    def _on_buffer_change(self, first: int, removed: int | None, added: int | None) -> None:
+        """Leva ao modelo do programa só as linhas que a edição tocou."""
+        document = self.document
+        if removed is not None:
+            first = min(first, len(document))
+            new_lines = str(self.textbox._textbox.get(f"{first}.0", f"{first + added}.end")).split("\n")
+            document.replace_lines(first, first + removed, new_lines)
+            if len(document) == self.highlighter.line_count():
+                return
+        # Desfazer/refazer (ou uma edição que não bateu): relê tudo
+        document.set_text(self.textbox.get("1.0", "end - 1c"))
+
     def _on_text_modified(self, event=None) -> None:
         if self.textbox.edit_modified():
-            self._apply_syntax_highlighting()
+            self.highlighter.highlight_dirty()
+            if hasattr(self, "line_numbers"):
+                self.line_numbers.redraw()
             self.textbox.edit_modified(False)
+            self._schedule_program_map_refresh()
+            if self._find_dialog is not None:
+                self._find_stale = True
+                self._schedule_find()
 
-    def _apply_syntax_highlighting(self) -> None:
+    def _apply_syntax_highlighting(self, first_line: int = 1, last_line: int | None = None) -> None:
         if hasattr(self, "line_numbers"):
             self.line_numbers.redraw()
-        content = self.textbox.get("1.0", tk.END)
-        # Clear existing tags
-        for tag in ["keyword", "comment", "string", "number", "linenumber", "function"]:
-            self.textbox.tag_remove(tag, "1.0", tk.END)
-
-        from msx_basic_decoder import TOKEN_MAP, TOKEN_MAP_FF
-
-        keywords = set(TOKEN_MAP)
-        functions = set(TOKEN_MAP_FF)
-        
-        lines = content.split("\n")
-        for i, line in enumerate(lines):
-            line_idx = i + 1
-            
-            # Line numbers
-            match_ln = re.match(r"^\s*(\d+)", line)
-            if match_ln:
-                start = f"{line_idx}.{line.find(match_ln.group(1))}"
-                end = f"{line_idx}.{len(match_ln.group(1)) + line.find(match_ln.group(1))}"
-                self.textbox.tag_add("linenumber", start, end)
-
-            # Comments (REM and ')
-            for match in re.finditer(r"(REM.*|'.*)", line, re.IGNORECASE):
-                self.textbox.tag_add("comment", f"{line_idx}.{match.start()}", f"{line_idx}.{match.end()}")
-            
-            # Strings
-            for match in re.finditer(r'("[^"]*")', line):
-                self.textbox.tag_add("string", f"{line_idx}.{match.start()}", f"{line_idx}.{match.end()}")
-
-            # Keywords and Functions
-            for word_match in re.finditer(r"\b[A-Z$]+\b", line, re.IGNORECASE):
-                word = word_match.group(0).upper()
-                if word in keywords:
-                    self.textbox.tag_add("keyword", f"{line_idx}.{word_match.start()}", f"{line_idx}.{word_match.end()}")
-                elif word in functions:
-                    self.textbox.tag_add("function", f"{line_idx}.{word_match.start()}", f"{line_idx}.{word_match.end()}")
-
-            # Numbers
-            for num_match in re.finditer(r"\b\d+\b", line):
-                # Avoid tagging if it's already a line number (at start of line)
-                if not (match_ln and num_match.start() == line.find(match_ln.group(1))):
-                    self.textbox.tag_add("number", f"{line_idx}.{num_match.start()}", f"{line_idx}.{num_match.end()}")
+        # As linhas visíveis são marcadas já; o resto em fatias entre os eventos do Tk
+        self.highlighter.invalidate(first_line, last_line)
+        self.highlighter.highlight_dirty()
 
     def _on_find(self) -> None:
-        dialog = ctk.CTkToplevel(self)
+        if self._find_dialog is not None:
+            self._find_dialog.lift()
+            self._find_entry.focus_set()
+            return
+        dialog = self._find_dialog = ctk.CTkToplevel(self)
         dialog.title("Localizar")
-        dialog.geometry("300x150")
+        dialog.geometry("320x230")
         dialog.attributes("-topmost", True)
-        
+
         ctk.CTkLabel(dialog, text="Localizar:").pack(pady=5)
-        entry = ctk.CTkEntry(dialog, width=200)
+        entry = self._find_entry = ctk.CTkEntry(dialog, width=220)
         entry.pack(pady=5)
         entry.focus_set()
-
-        def do_find():
-            search_text = entry.get()
-            self.textbox.tag_remove("search", "1.0", tk.END)
-            if search_text:
-                idx = "1.0"
-                while True:
-                    idx = self.textbox.search(search_text, idx, nocase=True, stopindex=tk.END)
-                    if not idx:
-                        break
-                    lastidx = f"{idx}+{len(search_text)}c"
-                    self.textbox.tag_add("search", idx, lastidx)
-                    idx = lastidx
-                self.textbox.tag_config("search", background="yellow", foreground="black")
-
-        ctk.CTkButton(dialog, text="Localizar Todos", command=do_find).pack(pady=5)
+        self._find_regex = tk.BooleanVar(value=False)
+        self._find_case = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(dialog, text="Expressão regular", variable=self._find_regex, command=self._schedule_find).pack()
+        ctk.CTkCheckBox(dialog, text="Diferenciar maiúsculas", variable=self._find_case, command=self._schedule_find).pack()
+        self._find_count = ctk.CTkLabel(dialog, text="")
+        self._find_count.pack(pady=2)
+
+        buttons = ctk.CTkFrame(dialog, fg_color="transparent")
+        buttons.pack(pady=5)
+        ctk.CTkButton(buttons, text="Anterior", width=100, command=lambda: self._goto_match(backwards=True)).pack(side="left", padx=2)
+        ctk.CTkButton(buttons, text="Próximo", width=100, command=self._goto_match).pack(side="left", padx=2)
+
+        self.textbox.tag_config("search", background="yellow", foreground="black")
+        self.textbox.tag_config("search_current", background="orange", foreground="black")
+        entry.bind("<KeyRelease>", lambda event: self._schedule_find() if event.keysym != "Return" else None)
+        entry.bind("<Return>", lambda event: self._goto_match())
+        entry.bind("<Shift-Return>", lambda event: self._goto_match(backwards=True))
+        dialog.protocol("WM_DELETE_WINDOW", self._close_find)
+
+    def _close_find(self) -> None:
+        if self._find_job is not None:
+            self.after_cancel(self._find_job)
+            self._find_job = None
+        if self._find_dialog is not None:
+            self._find_dialog.destroy()
+            self._find_dialog = None
+        self.textbox.tag_remove("search", "1.0", tk.END)
+        self.textbox.tag_remove("search_current", "1.0", tk.END)
+        self.search_index.set_text("")
+        self._find_stale = True
+
+    def _schedule_find(self) -> None:
+        # Busca só quando a digitação (ou a edição do texto) dá uma pausa
+        if self._find_job is not None:
+            self.after_cancel(self._find_job)
+        self._find_job = self.after(FIND_DELAY_MS, self._run_find)
+
+    def _run_find(self) -> None:
+        self._find_job = None
+        if self._find_dialog is None:
+            return
+        index = self.search_index
+        if self._find_stale:
+            index.set_text(self.document.text())
+            self._find_stale = False
+        count = index.search(self._find_entry.get(), self._find_regex.get(), self._find_case.get())
+        self._find_current = None
+        if index.error:
+            self._find_count.configure(text=f"Expressão inválida: {index.error}")
+        elif index.query:
+            self._find_count.configure(text=f"{count} ocorrência(s)")
+        else:
+            self._find_count.configure(text="")
+        self._find_tagged = None
+        self.textbox.tag_remove("search_current", "1.0", tk.END)
+        self._tag_visible_matches()
+
+    def _tag_visible_matches(self) -> None:
+        """Marca só as ocorrências na tela e em volta; rolar para além delas marca as próximas."""
+        text = self.textbox._textbox
+        first = int(text.index("@0,0").split(".")[0])
+        last = int(text.index(f"@0,{text.winfo_height()}").split(".")[0])
+        if self._find_tagged is not None and self._find_tagged[0] <= first and last <= self._find_tagged[1]:
+            return
+        first, last = max(1, first - FIND_TAG_MARGIN_LINES), last + FIND_TAG_MARGIN_LINES
+        self._find_tagged = (first, last)
+        text.tag_remove("search", "1.0", tk.END)
+        indexes = []
+        position = self.search_index.position
+        for start, end in self.search_index.matches_between(first, last):
+            line, col = position(start)
+            end_line, end_col = position(end)
+            indexes += [f"{line}.{col}", f"{end_line}.{end_col}"]
+        if indexes:
+            text.tag_add("search", *indexes)
+
+    def _goto_match(self, backwards: bool = False) -> None:
+        # Busca pendente (digitação ou texto editado): roda já, antes de pular
+        if self._find_job is not None:
+            self.after_cancel(self._find_job)
+            self._run_find()
+        elif self._find_stale:
+            self._run_find()
+        index = self.search_index
+        if not len(index):
+            return
+        if self._find_current is None:
+            line, col = (int(part) for part in self.textbox.index(tk.INSERT).split("."))
+            number = index.next_match(index.offset(line, col), backwards)
+        else:
+            number = (self._find_current + (-1 if backwards else 1)) % len(index)
+        self._find_current = number
+        start = "%d.%d" % index.position(index.starts[number])
+        end = "%d.%d" % index.position(index.ends[number])
+        self.textbox.tag_remove("search_current", "1.0", tk.END)
+        self.textbox.tag_add("search_current", start, end)
+        self.textbox.mark_set(tk.INSERT, end)
+        self.textbox.see(start)
+        self._find_count.configure(text=f"{number + 1} de {len(index)}")
 
     def _on_replace(self) -> None:
         dialog = ctk.CTkToplevel(self)
         dialog.title("Substituir")
-        dialog.geometry("300x200")
+        dialog.geometry("340x380")
         dialog.attributes("-topmost", True)
-        
+
         ctk.CTkLabel(dialog, text="Localizar:").pack(pady=2)
-        find_entry = ctk.CTkEntry(dialog, width=200)
+        find_entry = ctk.CTkEntry(dialog, width=220)
         find_entry.pack(pady=2)
-        
+        find_entry.focus_set()
+
         ctk.CTkLabel(dialog, text="Substituir por:").pack(pady=2)
-        replace_entry = ctk.CTkEntry(dialog, width=200)
+        replace_entry = ctk.CTkEntry(dialog, width=220)
         replace_entry.pack(pady=2)
 
+        regex_var = tk.BooleanVar(value=False)
+        case_var = tk.BooleanVar(value=True)
+        code_only_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(dialog, text="Expressão regular", variable=regex_var).pack(pady=1)
+        ctk.CTkCheckBox(dialog, text="Diferenciar maiúsculas", variable=case_var).pack(pady=1)
+        ctk.CTkCheckBox(dialog, text="Ignorar strings, comentários e DATA", variable=code_only_var).pack(pady=1)
+
+        scopes = ["Documento inteiro", "Seleção", "Linhas BASIC"]
+        scope_var = tk.StringVar(value=scopes[1] if self.textbox.tag_ranges("sel") else scopes[0])
+        ctk.CTkOptionMenu(dialog, values=scopes, variable=scope_var).pack(pady=4)
+        range_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+        range_frame.pack(pady=2)
+        ctk.CTkLabel(range_frame, text="De:").pack(side="left")
+        first_entry = ctk.CTkEntry(range_frame, width=70)
+        first_entry.pack(side="left", padx=4)
+        ctk.CTkLabel(range_frame, text="Até:").pack(side="left")
+        last_entry = ctk.CTkEntry(range_frame, width=70)
+        last_entry.pack(side="left", padx=4)
+
+        result_label = ctk.CTkLabel(dialog, text="")
+        result_label.pack(pady=2)
+
         def do_replace():
-            search_text = find_entry.get()
-            replace_text = replace_entry.get()
-            if search_text:
-                content = self.textbox.get("1.0", tk.END)
-                new_content = content.replace(search_text, replace_text)
-                self.textbox.delete("1.0", tk.END)
-                self.textbox.insert("1.0", new_content)
-                self._apply_syntax_highlighting()
+            scope = scope_var.get()
+            line_range = None
+            if scope == "Linhas BASIC":
+                try:
+                    line_range = (
+                        int(first_entry.get()) if first_entry.get().strip() else 0,
+                        int(last_entry.get()) if last_entry.get().strip() else MAX_LINE_NUMBER,
+                    )
+                except ValueError:
+                    result_label.configure(text="Informe números de linha BASIC.")
+                    return
+            try:
+                count = self._replace_all(
+                    find_entry.get(),
+                    replace_entry.get(),
+                    regex=regex_var.get(),
+                    case_sensitive=case_var.get(),
+                    selection_only=scope == "Seleção",
+                    line_range=line_range,
+                    code_only=code_only_var.get(),
+                )
+            except re.error as exc:
+                result_label.configure(text=f"Expressão inválida: {exc}")
+                return
+            result_label.configure(text=f"{count} substituição(ões)")
 
         ctk.CTkButton(dialog, text="Substituir Tudo", command=do_replace).pack(pady=10)
 
-    def _on_renum(self) -> None:
-        content = self.textbox.get("1.0", tk.END).strip()
-        if not content:
-            return
-        
-        lines = content.split("\n")
-        
-        # 1. Mapear linhas antigas para novas
-        mapping = []
+    def _replace_all(
+        self,
+        query: str,
+        replacement: str,
+        regex: bool = False,
+        case_sensitive: bool = True,
+        selection_only: bool = False,
+        line_range: tuple[int, int] | None = None,
+        code_only: bool = False,
+    ) -> int:
+        """Substitui as ocorrências no escopo pedido, editando só os trechos alterados.
+
+        Escopos: a seleção, as linhas BASIC de line_range[0] a line_range[1]
+        e/ou, com code_only, só o código (fora de strings, comentários e
+        DATA, segundo o lexer). Ocorrências que atravessam linhas são
+        ignoradas. Devolve quantas ocorrências foram substituídas.
+        """
+        if not query:
+            return 0
+        index = SearchIndex(self.document.text())
+        index.search(query, regex, case_sensitive)
+        if index.error:
+            raise re.error(index.error)
+        texts = index.replacements(replacement)
+
+        low, high = 0, len(index.text)
+        if selection_only:
+            ranges = self.textbox.tag_ranges("sel")
+            if not ranges:
+                return 0
+            low = index.offset(*(int(part) for part in str(ranges[0]).split(".")))
+            high = index.offset(*(int(part) for part in str(ranges[1]).split(".")))
+
+        document = self.document
+        by_line: dict[int, list[tuple[int, int, str]]] = {}
+        allowed: dict[int, bool] = {}  # linha -> está nas linhas BASIC pedidas
+        protected: dict[int, list[tuple[int, int]]] = {}  # linha -> colunas de strings/comentários/DATA
+        last_end = -1
+        for start, end, text in zip(index.starts, index.ends, texts):
+            if start < last_end or start < low or end > high:
+                continue  # sobreposta a uma ocorrência já substituída, ou fora da seleção
+            line, col = index.position(start)
+            end_line, end_col = index.position(end)
+            if end_line != line:
+                continue
+            if line_range is not None or code_only:
+                if line not in allowed:
+                    line_num = document.line_number(line)
+                    allowed[line] = line_range is None or (
+                        line_num is not None and line_range[0] <= line_num <= line_range[1]
+                    )
+                    if code_only:
+                        protected[line] = self._protected_spans(document.tokens(line))
+                if not allowed[line]:
+                    continue
+                if any(
+                    col < span_end and span_start < end_col and (whole or not (col <= span_start and span_end <= end_col))
+                    for span_start, span_end, whole in protected.get(line, ())
+                ):
+                    continue
+            by_line.setdefault(line, []).append((col, end_col, text))
+            last_end = end
+
+        changes = []
+        count = 0
+        for line, spans in by_line.items():
+            old = index.line_text(line)
+            new = old
+            for col, end_col, text in reversed(spans):
+                new = new[:col] + text + new[end_col:]
+            count += len(spans)
+            if new != old:
+                changes.append((line, old, new))
+        self._apply_line_changes(changes)
+        return count
+
+    @staticmethod
+    def _protected_spans(tokens) -> list[tuple[int, int, bool]]:
+        """Trechos que a substituição "só no código" não toca: (início, fim, inteiro).
+
+        Strings, comentários e DATA não podem ser tocados em parte alguma
+        (inteiro=True); palavras-chave só podem ser trocadas por completo,
+        para que trocar a variável A não estrague o DATA.
+        """
+        spans = []
+        for kind, text, start in tokens:
+            if kind in ("string", "comment", "data"):
+                spans.append((start, start + len(text), True))
+            elif kind in ("command", "function") and text[0].isalpha():
+                spans.append((start, start + len(text), False))
+        return spans
+
+    def _renum_defaults(self) -> tuple[int, int]:
         try:
-            start_line = int(self.settings.get("start_line", 10))
-            increment = int(self.settings.get("increment", 10))
+            return int(self.settings.get("start_line", 10)), int(self.settings.get("increment", 10))
         except ValueError:
-            start_line = 10
-            increment = 10
-            
-        new_ln = start_line
-        import re
-        
-        pattern_ln = re.compile(r"^\s*(\d+)")
-        
-        valid_lines = []
-        for line in lines:
-            if not line.strip():
-                continue
-            match = pattern_ln.match(line)
-            if match:
-                old_ln = int(match.group(1))
-                pure_content = line[match.end():].strip()
-                mapping.append((old_ln, new_ln, pure_content))
-                new_ln += increment
-                valid_lines.append(line)
-            else:
-                # Se não tem número de linha, vamos atribuir um
-                mapping.append((None, new_ln, line.strip()))
-                new_ln += increment
-                valid_lines.append(line)
-
-        # 2. Salvar no SQLite se disponível
-        if self.db:
-            with self.db._connect() as conn:
-                conn.execute("DELETE FROM renum_map")
-                for old, new, _ in mapping:
-                    if old is not None:
-                        conn.execute("INSERT INTO renum_map (old_ln, new_ln) VALUES (?, ?)", (old, new))
-                conn.commit()
-
-        # 3. Atualizar referências (GOTO, GOSUB, etc)
-        # Comandos que podem ter números de linha: GOTO, GOSUB, THEN, ELSE, RESTORE, RUN, ON...GOTO/GOSUB
-        # Regex simplificada para capturar números após esses comandos
-        ref_keywords = ["GOTO", "GOSUB", "THEN", "ELSE", "RESTORE", "RUN"]
-        
-        def update_refs(text: str) -> str:
-            # Regex para encontrar números de linha que não estão dentro de aspas ou comentários
-            # Esta é uma aproximação. Para ser perfeito precisaria de um parser real.
-            # Vamos focar nos padrões comuns: KEYWORD <número>
-            for kw in ref_keywords:
-                # Procura KEYWORD seguido de espaços e um ou mais números separados por vírgula (para ON GOTO)
-                pattern = re.compile(rf"({kw}\s+)(\d+(?:\s*,\s*\d+)*)", re.IGNORECASE)
-                
-                def replace_func(match):
-                    prefix = match.group(1)
-                    nums_str = match.group(2)
-                    nums = [n.strip() for n in nums_str.split(",")]
-                    new_nums = []
-                    for n in nums:
-                        if self.db:
-                            with self.db._connect() as conn:
-                                row = conn.execute("SELECT new_ln FROM renum_map WHERE old_ln = ?", (n,)).fetchone()
-                                if row:
-                                    new_nums.append(str(row["new_ln"]))
-                                else:
-                                    new_nums.append(n) # Mantém se não encontrar
-                        else:
-                            # Fallback se não tiver DB (mesmo que a task peça DB)
-                            # Poderia usar um dict aqui
-                            found = False
-                            for m_old, m_new, _ in mapping:
-                                if m_old == int(n):
-                                    new_nums.append(str(m_new))
-                                    found = True
-                                    break
-                            if not found:
-                                new_nums.append(n)
-                    return prefix + ", ".join(new_nums)
-                
-                text = pattern.sub(replace_func, text)
-            return text
-
-        new_lines = []
-        for old, new, pure in mapping:
-            updated_pure = update_refs(pure)
-            new_lines.append(f"{new} {updated_pure}")
-        
-        self.textbox.delete("1.0", tk.END)
-        self.textbox.insert("1.0", "\n".join(new_lines))
-        self._apply_syntax_highlighting()
+            return 10, 10
 
-    def _remove_line_numbers(self) -> None:
-        content = self.textbox.get("1.0", tk.END).strip()
-        if not content:
+    def _on_renum(self) -> None:
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Renumerar")
+        dialog.geometry("300x200")
+        dialog.attributes("-topmost", True)
+
+        start_line, increment = self._renum_defaults()
+        ctk.CTkLabel(dialog, text="RENUM nova,antiga,passo:").pack(pady=2)
+        args_entry = ctk.CTkEntry(dialog, width=200)
+        args_entry.insert(0, f"{start_line},,{increment}")
+        args_entry.pack(pady=2)
+        args_entry.focus_set()
+
+        ctk.CTkLabel(dialog, text="Até a linha (vazio = fim):").pack(pady=2)
+        end_entry = ctk.CTkEntry(dialog, width=200)
+        end_entry.pack(pady=2)
+
+        def do_renum():
+            # Mesma sintaxe do comando do MSX: parâmetros omitidos ficam no padrão
+            fields = [field.strip() for field in args_entry.get().split(",")] + ["", "", ""]
+            try:
+                new_start = int(fields[0]) if fields[0] else start_line
+                old_start = int(fields[1]) if fields[1] else None
+                step = int(fields[2]) if fields[2] else increment
+                old_end = int(end_entry.get()) if end_entry.get().strip() else None
+            except ValueError:
+                messagebox.showerror("RENUM", "Use números: RENUM nova,antiga,passo", parent=dialog)
+                return
+            if step < 1:
+                messagebox.showerror("RENUM", "O passo deve ser maior que zero.", parent=dialog)
+                return
+            dialog.destroy()
+            self._start_renum(new_start, old_start, step, old_end)
+
+        ctk.CTkButton(dialog, text="Renumerar", command=do_renum).pack(pady=10)
+
+    def _start_renum(
+        self, new_start: int, old_start: int | None = None, increment: int = 10, old_end: int | None = None
+    ) -> None:
+        # Cópia da lista de linhas do modelo: a thread de trabalho não vê as edições seguintes
+        lines = list(self.document.lines)
+        if not any(line.strip() for line in lines):
             return
-        lines = content.split("\n")
-        new_lines = []
-        for line in lines:
-            import re
-            new_lines.append(re.sub(r"^\s*\d+\s*", "", line))
-        self.textbox.delete("1.0", tk.END)
-        self.textbox.insert("1.0", "\n".join(new_lines))
+        self.jobs.submit(
+            self._renumber_lines,
+            lines,
+            new_start,
+            old_start,
+            increment,
+            old_end,
+            key="renum",
+            on_done=lambda result: self._on_renum_ready(lines, result),
+        )
+
+    def _renumber_lines(
+        self, job, lines: list[str], new_start: int, old_start: int | None, increment: int, old_end: int | None
+    ) -> RenumResult:
+        """Renumera numa thread de trabalho; o mapa antiga -> nova vai para o banco num único executemany."""
+        result = renumber(
+            lines, new_start, old_start, increment, old_end, dialect=self.settings.get("dialect"), check=job.check
+        )
+        if self.db and result.applied and any(old != new for old, new in result.mapping.items()):
+            self.db.save_renum_map(result.mapping)
+        return result
+
+    def _on_renum_ready(self, lines: list[str], result: RenumResult) -> None:
+        if not result.applied:
+            messagebox.showerror("RENUM", "\n".join(self._renum_conflict_text(c) for c in result.conflicts))
+            return
+        changes = [
+            (line_num, old, new)
+            for line_num, (old, new) in enumerate(zip(lines, result.lines), 1)
+            if old != new
+        ]
+        self._apply_line_changes(changes)
+        warnings = [self._renum_conflict_text(c) for c in result.conflicts]
+        if warnings:
+            extra = f"\n... e mais {len(warnings) - 20}" if len(warnings) > 20 else ""
+            messagebox.showwarning("RENUM", "\n".join(warnings[:20]) + extra)
+        self._show_job_status(f"RENUM: {len(result.mapping)} linhas renumeradas")
+
+    @staticmethod
+    def _renum_conflict_text(conflict: RenumConflict) -> str:
+        if conflict.kind == "overflow":
+            return f"A numeração passaria do limite de {MAX_LINE_NUMBER} (chegaria a {conflict.target})."
+        if conflict.kind == "order":
+            return f"A nova numeração ({conflict.target}) passaria da linha {conflict.line_num}, fora do intervalo."
+        if conflict.kind == "duplicate":
+            return f"Linha {conflict.target} repetida (agora {conflict.line_num})."
+        return f"Linha {conflict.target} indefinida na linha {conflict.line_num}."
+
+    def _remove_line_numbers(self) -> None:
+        document = self.document
+        changes = []
+        for line in range(1, len(document) + 1):
+            if document.line_number(line) is not None:
+                text = document.line(line)
+                _line_num, code_start = split_line_number(text)
+                changes.append((line, text, text[code_start:].lstrip()))
+        self._apply_line_changes(changes)
 
     def _add_line_numbers(self) -> None:
-        self._on_renum()
+        start_line, increment = self._renum_defaults()
+        self._start_renum(start_line, None, increment)
 
     def _open_file(self) -> None:
         file_path = filedialog.askopenfilename(
@@ -784,206 +1089,186 @@ class MSXBasicEditor(ctk.CTk):
             data = path.read_bytes()
             
             # If it's tokenized MSX BASIC (starts with 0xFF)
-            if data.startswith(b"\xFF"):
-                segments = decode_msx_basic_segments(data)
-                text = "".join(seg[1] for seg in segments)
-            else:
+            tokenized = data.startswith(b"\xFF")
+            if not tokenized:
                 # Try common encodings
                 try:
                     text = data.decode("utf-8")
                 except UnicodeDecodeError:
                     text = data.decode("latin-1")
             
+            self._cancel_load_stream()
             self.textbox.delete("1.0", tk.END)
-            self.textbox.insert("1.0", text)
-            self._apply_syntax_highlighting()
+            self._current_path = str(path.resolve())
+            if tokenized:
+                # Decodificado numa thread; cada lote entra no editor assim que chega
+                self._load_decoding = True
+                self.jobs.submit(
+                    stream_items,
+                    iter_msx_basic_lines(memoryview(data)),
+                    LOAD_STREAM_BATCH_LINES,
+                    key="open",
+                    on_items=self._queue_load_lines,
+                    on_done=self._finish_load_decode,
+                    on_error=lambda exc: messagebox.showerror("Erro", f"Nao foi possivel abrir o arquivo:\n{exc}"),
+                    on_progress=lambda done, _total: self._show_job_status(f"Decodificando... {done} linhas"),
+                )
+            else:
+                self.textbox.insert("1.0", text)
+                self._apply_syntax_highlighting()
+                self._update_cross_reference()
         except Exception as e:
             messagebox.showerror("Erro", f"Nao foi possivel abrir o arquivo:\n{e}")
 
-    def _save_file(self) -> None:
-        content = self.textbox.get("1.0", tk.END).strip()
-        
-        # Dialect restrictions
-        if self.settings.get("dialect") == "MSX-BASIC":
-            lines = content.split("\n")
-            for i, line in enumerate(lines):
-                if line.strip() and not re.match(r"^\d+", line.strip()):
-                    messagebox.showerror("Erro de Dialeto", f"No MSX-BASIC clássico, todas as linhas devem ser numeradas.\nErro na linha {i+1}: {line[:30]}...")
-                    return
+    def _queue_load_lines(self, lines: list[tuple[int, list[tuple[str, str]]]]) -> None:
+        self._load_pending.extend(lines)
+        if self._load_stream_job is None:
+            self._continue_load_stream()
 
+    def _finish_load_decode(self, _count: int) -> None:
+        self._load_decoding = False
+        self._update_status_bar()
+        if self._load_stream_job is None:
+            self._continue_load_stream()
+
+    def _show_job_status(self, text: str) -> None:
+        self.status_bar.configure(text=text)
+
+    def _continue_load_stream(self) -> None:
+        """Insere o próximo lote de linhas decodificadas e agenda o restante."""
+        self._load_stream_job = None
+        batch = SegmentSpans()
+        for _ in range(min(LOAD_STREAM_BATCH_LINES, len(self._load_pending))):
+            batch.extend(self._load_pending.popleft()[1])
+        if batch:
+            line, col = (int(part) for part in self.textbox.index("end-1c").split("."))
+            self.textbox.insert("end-1c", batch.text)
+            # O decodificador já separou os tipos: aplica as tags em bloco, sem passar pelas regex
+            for kind, indexes in batch.text_indexes(line, col).items():
+                tag = DECODED_KIND_TAGS.get(kind)
+                if not tag:
+                    continue
+                for pos in range(0, len(indexes), TAG_RANGES_PER_CALL * 2):
+                    self.textbox.tag_add(tag, *indexes[pos:pos + TAG_RANGES_PER_CALL * 2])
+            # Linhas já marcadas pelo decodificador: o realce incremental não precisa refazê-las
+            self.highlighter.mark_clean(line, int(self.textbox.index("end-1c").split(".")[0]))
+            self.textbox.edit_modified(False)
+            if hasattr(self, "line_numbers"):
+                self.line_numbers.redraw()
+        if self._load_pending:
+            self._load_stream_job = self.after(1, self._continue_load_stream)
+        elif not self._load_decoding:
+            self._update_cross_reference()
+
+    def _update_cross_reference(self) -> None:
+        """Atualiza no banco a referência cruzada do arquivo atual (só as linhas alteradas)."""
+        if not self.db or not self._current_path:
+            return
+        try:
+            self.db.update_cross_reference(self._current_path, self.document.text(), self.settings.get("dialect"))
+        except sqlite3.Error:
+            pass  # o índice é só um atalho: sem ele o editor continua funcionando
+
+    def _cancel_load_stream(self) -> None:
+        self.jobs.cancel("open")
+        if self._load_stream_job is not None:
+            self.after_cancel(self._load_stream_job)
+            self._load_stream_job = None
+        self._load_pending.clear()
+        self._load_decoding = False
+
+    def _save_file(self, tokenized: bool = False) -> None:
+        document = self.document
+
+        # Dialect restrictions
+        if tokenized or self.settings.get("dialect") == "MSX-BASIC":
+            unnumbered = document.unnumbered_lines()
+            if unnumbered:
+                line = document.line(unnumbered[0]).strip()
+                messagebox.showerror("Erro de Dialeto", f"No MSX-BASIC clássico, todas as linhas devem ser numeradas.\nErro na linha {unnumbered[0]}: {line[:30]}...")
+                return
+
+        if tokenized:
+            filetypes = [("MSX BASIC tokenizado", "*.bas"), ("Todos os arquivos", "*.*")]
+        else:
+            filetypes = [("MSX BASIC", "*.bas"), ("Texto", "*.txt"), ("Todos os arquivos", "*.*")]
         file_path = filedialog.asksaveasfilename(
             title="Salvar como",
             defaultextension=".bas",
-            filetypes=[("MSX BASIC", "*.bas"), ("Texto", "*.txt"), ("Todos os arquivos", "*.*")]
+            filetypes=filetypes
         )
         if not file_path:
             return
 
         try:
-            content = self.textbox.get("1.0", tk.END)
-            # Saving as plain text (ASCII) which MSX can LOAD "filename.bas",A
-            Path(file_path).write_text(content, encoding="latin-1", errors="replace")
-            messagebox.showinfo("Sucesso", "Arquivo salvo com sucesso (formato ASCII).")
+            content = document.text() + "\n"
+            if tokenized:
+                # Formato binário do SAVE "arquivo": carrega direto com LOAD, sem re-tokenizar no MSX
+                Path(file_path).write_bytes(encode_msx_basic(content))
+                messagebox.showinfo("Sucesso", "Arquivo salvo com sucesso (formato tokenizado).")
+            else:
+                # Saving as plain text (ASCII) which MSX can LOAD "filename.bas",A
+                Path(file_path).write_text(content, encoding="latin-1", errors="replace")
+                messagebox.showinfo("Sucesso", "Arquivo salvo com sucesso (formato ASCII).")
+            self._current_path = str(Path(file_path).resolve())
+            self._update_cross_reference()
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao salvar:\n{e}")
 
     def _clear_editor(self) -> None:
         if messagebox.askyesno("Limpar", "Deseja limpar todo o conteudo?"):
+            self._cancel_load_stream()
             self.textbox.delete("1.0", tk.END)
 
     def _beautify_line(self, line: str) -> str:
-        from msx_basic_decoder import TOKEN_MAP, TOKEN_MAP_FF
-
         if not line.strip():
             return line
 
-        # 1. Separar número da linha
-        match_ln = re.match(r"^(\s*\d+)\s*(.*)", line)
-        if match_ln:
-            ln_part = match_ln.group(1).strip()
-            code_part = match_ln.group(2)
-        else:
-            ln_part = ""
-            code_part = line
-
-        # 2. Tokenizar mantendo strings e comentários intactos
-        # Ordem de importância: strings, comentários, palavras-chave, outros
-        keywords = sorted(list(set(TOKEN_MAP) | set(TOKEN_MAP_FF)), key=len, reverse=True)
-        # Escapar keywords que são operadores
-        escaped_keywords = [re.escape(k) for k in keywords]
-        
-        # Regex para strings: "[^"]*"
-        # Regex para comentários: (REM|').*
-        # Regex para keywords
-        combined_pattern = f"(\"[^\"]*\")|(REM.*|'.*)|({'|'.join(escaped_keywords)})|([^\"R'\\s]+)"
-        
-        tokens = []
-        # re.finditer para pegar tudo inclusive espaços se necessário, mas vamos processar code_part
-        # Melhor: iterar pelo texto e identificar componentes
-        
-        pos = 0
-        result_parts = []
-        if ln_part:
-            result_parts.append(ln_part)
-            result_parts.append(" ")
-
-        while pos < len(code_part):
-            char = code_part[pos]
-            
-            # Pular espaços já existentes (serão recalculados)
-            if char.isspace():
-                pos += 1
-                continue
-
-            # String
-            if char == '"':
-                end = code_part.find('"', pos + 1)
-                if end == -1:
-                    result_parts.append(code_part[pos:])
-                    pos = len(code_part)
-                else:
-                    result_parts.append(code_part[pos:end+1])
-                    pos = end + 1
-                continue
-
-            # Comentário
-            if code_part[pos:].upper().startswith("REM"):
-                rem_text = code_part[pos:pos+3]
-                if self.settings.get("keep_case") == "False":
-                    rem_text = rem_text.upper()
-                result_parts.append(rem_text + code_part[pos+3:])
-                pos = len(code_part)
-                continue
-            if char == "'":
-                result_parts.append(code_part[pos:])
-                pos = len(code_part)
-                continue
-
-            # Keyword?
-            found_kw = False
-            for kw in keywords:
-                if code_part[pos:].upper().startswith(kw):
-                    # Se for uma keyword que termina com (, não adicionar espaço depois (ex: TAB()
-                    # Mas o MSX BASIC as vezes tem "TAB (10)" ? Geralmente é colado.
-                    kw_text = code_part[pos:pos+len(kw)]
-                    if self.settings.get("keep_case") == "False":
-                        kw_text = kw_text.upper()
-                    result_parts.append(kw_text)
-                    pos += len(kw)
-                    found_kw = True
-                    break
-            
-            if found_kw:
-                continue
-
-            # Outros caracteres (variáveis, operadores não-keyword, etc)
-            # Pegar até o próximo delimitador ou espaço ou keyword
-            start_other = pos
-            while pos < len(code_part):
-                curr = code_part[pos]
-                if curr.isspace() or curr == '"' or curr == "'":
-                    break
-                if code_part[pos:].upper().startswith("REM"):
+        upper_keywords = self.settings.get("keep_case") == "False"
+        line_num, code_start = split_line_number(line)
+        tokens = tokenize(line[code_start:], dialect=self.settings.get("dialect"))
+
+        # Partes separadas por espaço na linha final: (texto, tipo); variáveis, números e
+        # pontuação colados no original (A$(1,2), 100,200) continuam juntos numa parte só
+        parts: list[tuple[str, str]] = []
+        prev_end = -1
+        for index, (kind, text, start) in enumerate(tokens):
+            end = start + len(text)
+            if kind in ("command", "function"):
+                keyword = text.upper() if upper_keywords else text
+                if text == "'" or text.upper() == "REM":
+                    # Comentário: o texto segue exatamente como foi escrito
+                    rest = tokens[index + 1].text if index + 1 < len(tokens) else ""
+                    parts.append((keyword + rest, "comment"))
                     break
-                
-                # Tratar operadores comuns como tokens separados para forçar espaços
-                if curr in "=+-*/^\\<>:":
-                    if pos == start_other:
-                        pos += 1
-                    break
-
-                any_kw = False
-                for kw in keywords:
-                    if code_part[pos:].upper().startswith(kw):
-                        any_kw = True
-                        break
-                if any_kw:
-                    break
-                pos += 1
-            
-            other_text = code_part[start_other:pos]
-            if other_text:
-                result_parts.append(other_text)
-
-        # Montar a linha final com espaços
-        # Regra: espaço entre quase tudo, exceto:
-        # - Após número da linha (já adicionado)
-        # - Antes de ":" se for separador de comandos? MSX permite "PRINT:PRINT". QB usa "PRINT : PRINT"
-        # O usuário pediu: 10 PRINT "TESTE" : IF A$="S" THEN 10 ELSE 40
-        
-        final_line = ""
-        for i, part in enumerate(result_parts):
-            if i == 0:
-                final_line += part
-                continue
-            
-            prev_part = result_parts[i-1]
-            
-            # Não adicionar espaço se:
-            # - part for ":" e prev_part for algo que não precisa de espaço?
-            # Na verdade, o usuário quer " : ", então adicionamos espaço.
-            
-            # Exceções onde NÃO colocar espaço:
-            # - Antes de "(" (ex: TAB()
-            # - Entre nome de variável e "$" ou "%" ou "!" ou "#" (já virão juntos no 'other')
-            # - Dentro de expressões compactas? O usuário quer DESCOLAR.
-            
-            # Se a parte atual é uma string ou comentário, e a anterior não é espaço, bota espaço.
-            # Se a parte anterior é uma keyword, bota espaço.
-            
-            # Vamos ser agressivos na inserção de espaços como solicitado.
-            if not final_line.endswith(" ") and not part.startswith(" "):
-                # Não colocar espaço antes de ( se prev for function?
-                # TOKEN_MAP_FF são funções.
-                is_prev_func = prev_part.upper() in TOKEN_MAP_FF or prev_part.upper().endswith("(")
-                if is_prev_func and part.startswith("("):
-                    pass # Sem espaço
+                if parts and parts[-1][1] == "operator" and text in "<>=" and start == prev_end:
+                    # Operadores relacionais de dois caracteres: <>, <=, >=
+                    parts[-1] = (parts[-1][0] + text, "operator")
                 else:
-                    final_line += " "
-            
-            final_line += part
-
-        return final_line.rstrip()
+                    parts.append((keyword, "operator" if text in "<>=" else kind))
+            elif kind == "data":
+                parts.append((text.strip(), "data"))
+            elif kind == "string" or text == ":":
+                parts.append((text, kind))
+            elif parts and parts[-1][1] == "other" and start == prev_end:
+                parts[-1] = (parts[-1][0] + text, "other")
+            else:
+                parts.append((text, "other"))
+            prev_end = end
+
+        # Espaço entre as partes, exceto entre uma função e o "(" dos argumentos (LEFT$(A$,1))
+        # e depois de palavras que já incluem o "(" (TAB(, SPC()
+        result = [str(line_num)] if line_num is not None else []
+        prev_text, prev_kind = "", ""
+        for text, kind in parts:
+            if prev_text.endswith("("):
+                result[-1] += text
+            elif prev_kind == "function" and text.startswith("("):
+                result[-1] += text
+            else:
+                result.append(text)
+            prev_text, prev_kind = text, kind
+        return " ".join(result).rstrip()
 
     def _on_key_beautify(self, event) -> None:
         # Pega a linha atual
@@ -991,7 +1276,7 @@ class MSXBasicEditor(ctk.CTk):
         line_num = cursor_pos.split(".")[0]
         col_idx = int(cursor_pos.split(".")[1])
         
-        line_content = self.textbox.get(f"{line_num}.0", f"{line_num}.end")
+        line_content = self.document.line(int(line_num))
 
         # Verificar se o cursor está dentro de uma string
         # Contamos as aspas antes do cursor na linha atual
@@ -1004,7 +1289,7 @@ class MSXBasicEditor(ctk.CTk):
         if event.keysym == "Return":
             prev_line = str(int(line_num) - 1)
             if int(prev_line) >= 1:
-                prev_content = self.textbox.get(f"{prev_line}.0", f"{prev_line}.end")
+                prev_content = self.document.line(int(prev_line))
                 beautified_prev = self._beautify_line(prev_content)
                 if beautified_prev != prev_content:
                     self.textbox.delete(f"{prev_line}.0", f"{prev_line}.end")
@@ -1033,91 +1318,247 @@ class MSXBasicEditor(ctk.CTk):
             self.textbox.mark_set(tk.INSERT, f"{line_num}.{new_col}")
 
     def _on_beautify_all(self) -> None:
-        content = self.textbox.get("1.0", tk.END).strip()
-        if not content:
+        lines = list(self.document.lines)
+        if not any(line.strip() for line in lines):
             return
-        
-        lines = content.split("\n")
-        new_lines = [self._beautify_line(line) for line in lines]
-        
-        self.textbox.delete("1.0", tk.END)
-        self.textbox.insert("1.0", "\n".join(new_lines))
-        self._apply_syntax_highlighting()
-        messagebox.showinfo("Beautify", "Código formatado com sucesso!")
+
+        self.jobs.submit(
+            self._beautify_lines,
+            lines,
+            key="beautify",
+            on_done=self._on_beautify_ready,
+            on_progress=lambda done, total: self._show_job_status(f"Formatando... {done}/{total} linhas"),
+        )
+
+    def _beautify_lines(self, job, lines: list[str]) -> list[tuple[int, str, str]]:
+        """Formata numa thread de trabalho; devolve só as linhas alteradas: (número, antes, depois)."""
+        changes = []
+        for index, line in enumerate(lines, 1):
+            beautified = self._beautify_line(line)
+            if beautified != line:
+                changes.append((index, line, beautified))
+            if index % JOB_CHECK_LINES == 0:
+                job.check()
+                job.report_progress(index, len(lines))
+        return changes
+
+    def _on_beautify_ready(self, changes: list[tuple[int, str, str]]) -> None:
+        self._update_status_bar()
+        applied = self._apply_line_changes(changes)
+        messagebox.showinfo("Beautify", f"Código formatado com sucesso! ({applied} linhas alteradas)")
+
+    def _apply_line_changes(self, changes: list[tuple[int, str, str]]) -> int:
+        """Troca só as linhas alteradas, num único passo de desfazer, sem mexer na rolagem nem no cursor.
+
+        Cada alteração é (número da linha, texto esperado, texto novo); linhas
+        editadas desde que a alteração foi calculada são deixadas como estão.
+        Devolve quantas linhas foram trocadas.
+        """
+        text = self.textbox._textbox
+        cursor = text.index(tk.INSERT)
+        cursor_line, cursor_col = (int(part) for part in cursor.split("."))
+        top = text.yview()[0]
+        autoseparators = text.cget("autoseparators")
+        text.configure(autoseparators=False)
+        text.edit_separator()
+        applied = 0
+        try:
+            for line_num, old, new in changes:
+                start, end = f"{line_num}.0", f"{line_num}.end"
+                if text.get(start, end) != old:
+                    continue
+                # Prefixo e sufixo comuns ficam no lugar: a pilha de desfazer guarda só o trecho trocado
+                prefix = 0
+                limit = min(len(old), len(new))
+                while prefix < limit and old[prefix] == new[prefix]:
+                    prefix += 1
+                suffix = 0
+                while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+                    suffix += 1
+                text.delete(f"{line_num}.{prefix}", f"{line_num}.{len(old) - suffix}")
+                text.insert(f"{line_num}.{prefix}", new[prefix:len(new) - suffix])
+                applied += 1
+                if line_num == cursor_line:
+                    # O cursor acompanha o texto: à direita da parte trocada, anda o quanto a linha mudou
+                    if cursor_col >= len(old) - suffix:
+                        cursor_col += len(new) - len(old)
+                    cursor_col = min(cursor_col, len(new))
+        finally:
+            text.edit_separator()
+            text.configure(autoseparators=autoseparators)
+        text.mark_set(tk.INSERT, f"{cursor_line}.{cursor_col}")
+        text.yview_moveto(top)
+        return applied
 
     def _on_program_map(self) -> None:
         from msx_basic_analyzer import MSXBasicAnalyzer
         
-        # O usuário sugeriu que o mapa seja feito após a formatação para evitar erros.
-        # Vamos obter o conteúdo formatado sem necessariamente alterar o texto no editor,
-        # ou apenas formatar as linhas internamente para a análise.
-        content = self.textbox.get("1.0", tk.END).strip()
-        if not content:
+        # O analisador usa o lexer (palavras-chave reconhecidas mesmo em código
+        # compactado, como FORI=1TO9), então não é preciso formatar antes.
+        lines = list(self.document.lines)
+        if not any(line.strip() for line in lines):
             return
-            
-        lines = content.split("\n")
-        beautified_lines = [self._beautify_line(line) for line in lines]
-        beautified_content = "\n".join(beautified_lines)
-        
-        analyzer = MSXBasicAnalyzer(beautified_content)
-        analyzer.analyze()
-        summary = analyzer.get_summary()
-        
-        self._show_program_map_window(summary)
+
+        if self._map_analyzer is None:
+            self._map_analyzer = MSXBasicAnalyzer("", self.settings.get("dialect"))
+        self.jobs.submit(
+            self._analyze_program,
+            lines,
+            self.settings.get("dialect"),
+            key="program_map",
+            on_done=self._on_program_map_ready,
+        )
+
+    def _analyze_program(self, job, lines: list[str], dialect: str | None) -> dict:
+        # Roda numa thread de trabalho; o lock impede duas análises ao mesmo tempo no mesmo cache
+        with self._map_lock:
+            job.check()
+            # Mesmo lexer do realce: um comentário ## do Dignified não vira variável no mapa
+            self._map_analyzer.set_dialect(dialect)
+            # Só as linhas alteradas desde a última análise passam pelo lexer de novo
+            self._map_analyzer.set_lines(lines)
+            self._map_analyzer.analyze()
+            return self._map_analyzer.get_summary()
+
+    def _on_program_map_ready(self, summary: dict) -> None:
+        if self._program_map_window is not None and self._program_map_window.winfo_exists():
+            self._render_program_map(summary)
+        else:
+            self._show_program_map_window(summary)
+
+    def _schedule_program_map_refresh(self) -> None:
+        if self._program_map_window is None:
+            return
+        if self._program_map_job is not None:
+            self.after_cancel(self._program_map_job)
+        self._program_map_job = self.after(PROGRAM_MAP_REFRESH_MS, self._refresh_program_map)
+
+    def _refresh_program_map(self) -> None:
+        self._program_map_job = None
+        if self._program_map_window is None or not self._program_map_window.winfo_exists():
+            self._program_map_window = None
+            return
+        self._on_program_map()
+
+    def _close_program_map(self) -> None:
+        self.jobs.cancel("program_map")
+        if self._program_map_job is not None:
+            self.after_cancel(self._program_map_job)
+            self._program_map_job = None
+        if self._program_map_window is not None:
+            self._program_map_window.destroy()
+            self._program_map_window = None
 
     def _show_program_map_window(self, summary: dict) -> None:
+        # Janela não modal: continua aberta e se atualiza enquanto o programa é editado
         window = ctk.CTkToplevel(self)
         window.title("Mapa do Programa")
         window.geometry("800x600")
-        window.grab_set()
+        window.protocol("WM_DELETE_WINDOW", self._close_program_map)
+        self._program_map_window = window
         
         tabview = ctk.CTkTabview(window)
         tabview.pack(fill="both", expand=True, padx=10, pady=10)
         
         tab_vars = tabview.add("Variáveis")
         tab_flow = tabview.add("Fluxo e Subrotinas")
+        tab_memory = tabview.add("Memória")
         
         # --- Aba Variáveis ---
         # Usar um CTkTextbox para mostrar como tabela ou lista formatada
-        vars_text = ctk.CTkTextbox(tab_vars, font=("Consolas", 12))
-        vars_text.pack(fill="both", expand=True, padx=5, pady=5)
-        
-        header = f"{'Nome':<10} | {'Tipo':<6} | {'Usos':<6} | {'Mem(est)':<8} | {'Linhas'}\n"
-        header += "-" * 75 + "\n"
-        vars_text.insert(tk.END, header)
-        
+        self._map_vars_text = ctk.CTkTextbox(tab_vars, font=("Consolas", 12))
+        self._map_vars_text.pack(fill="both", expand=True, padx=5, pady=5)
+
+        # --- Aba Fluxo ---
+        self._map_flow_text = ctk.CTkTextbox(tab_flow, font=("Consolas", 12))
+        self._map_flow_text.pack(fill="both", expand=True, padx=5, pady=5)
+
+        # --- Aba Memória ---
+        self._map_memory_text = ctk.CTkTextbox(tab_memory, font=("Consolas", 12))
+        self._map_memory_text.pack(fill="both", expand=True, padx=5, pady=5)
+
+        self._render_program_map(summary)
+
+    def _render_program_map(self, summary: dict) -> None:
+        vars_text = self._map_vars_text
+        flow_text = self._map_flow_text
+        # Mantém a posição de rolagem entre atualizações
+        vars_view = vars_text.yview()[0]
+        flow_view = flow_text.yview()[0]
+        vars_text.configure(state="normal")
+        vars_text.delete("1.0", tk.END)
+        flow_text.configure(state="normal")
+        flow_text.delete("1.0", tk.END)
+
+        rows = [f"{'Nome':<10} | {'Tipo':<6} | {'Usos':<6} | {'Mem(est)':<8} | {'Linhas'}\n", "-" * 75 + "\n"]
         for name, info in summary["variables"].items():
             lines_str = ", ".join(map(str, info["lines"]))
-            row = f"{name:<10} | {info['type']:<6} | {info['count']:<6} | {info['size']:<8} | {lines_str}\n"
-            vars_text.insert(tk.END, row)
-        
-        vars_text.insert(tk.END, "\n" + "-" * 75 + "\n")
-        vars_text.insert(tk.END, f"Memória total estimada para variáveis simples: {summary['total_memory_est']} bytes\n")
-        vars_text.insert(tk.END, "(Nota: Strings usam 3 bytes para descritor + conteúdo; Arrays não contabilizados)\n")
-        
+            rows.append(f"{name:<10} | {info['type']:<6} | {info['count']:<6} | {info['size']:<8} | {lines_str}\n")
+        rows.append("\n" + "-" * 75 + "\n")
+        rows.append(f"Memória das variáveis e arrays: {summary['total_memory_est']} bytes (detalhes na aba Memória)\n")
+        vars_text.insert(tk.END, "".join(rows))
         vars_text.configure(state="disabled")
-        
-        # --- Aba Fluxo ---
-        flow_text = ctk.CTkTextbox(tab_flow, font=("Consolas", 12))
-        flow_text.pack(fill="both", expand=True, padx=5, pady=5)
-        
-        flow_text.insert(tk.END, "--- Subrotinas Identificadas (GOSUB targets) ---\n")
+        vars_text.yview_moveto(vars_view)
+
+        rows = ["--- Subrotinas Identificadas (GOSUB targets) ---\n"]
         if summary["subroutines"]:
-            for sub in summary["subroutines"]:
-                flow_text.insert(tk.END, f"Linha {sub}\n")
+            rows.extend(f"Linha {sub}\n" for sub in summary["subroutines"])
         else:
-            flow_text.insert(tk.END, "Nenhuma subrotina identificada.\n")
-            
-        flow_text.insert(tk.END, "\n--- Fluxo de Execução (GOTO/GOSUB) ---\n")
-        header_flow = f"{'Origem':<10} | {'Destino':<10} | {'Tipo'}\n"
-        header_flow += "-" * 40 + "\n"
-        flow_text.insert(tk.END, header_flow)
-        
-        for f in summary["flow"]:
-            row = f"{f['from']:<10} | {f['to']:<10} | {f['type']}\n"
-            flow_text.insert(tk.END, row)
-        
+            rows.append("Nenhuma subrotina identificada.\n")
+        rows.append("\n--- Fluxo de Execução (GOTO/GOSUB) ---\n")
+        rows.append(f"{'Origem':<10} | {'Destino':<10} | {'Tipo'}\n")
+        rows.append("-" * 40 + "\n")
+        rows.extend(f"{f['from']:<10} | {f['to']:<10} | {f['type']}\n" for f in summary["flow"])
+        rows.append("\n--- Código Inalcançável ---\n")
+        if summary["unreachable"]:
+            rows.append(", ".join(map(str, summary["unreachable"])) + "\n")
+        else:
+            rows.append("Nenhuma linha inalcançável.\n")
+        if summary["missing_targets"]:
+            rows.append("\n--- Destinos Inexistentes ---\n")
+            rows.extend(f"Linha {m.source}: {m.kind} {m.target}\n" for m in summary["missing_targets"])
+        if summary["subroutine_extents"]:
+            rows.append("\n--- Extensão das Subrotinas ---\n")
+            for entry, runs in summary["subroutine_extents"].items():
+                # Trechos contínuos do programa: "100-250" vai da linha 100 à 250
+                extent = ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in runs)
+                rows.append(f"Linha {entry}: {extent}\n")
+        if summary["loops"]:
+            rows.append("\n--- Laços ---\n")
+            rows.extend(", ".join(map(str, loop)) + "\n" for loop in summary["loops"])
+        flow_text.insert(tk.END, "".join(rows))
         flow_text.configure(state="disabled")
+        flow_text.yview_moveto(flow_view)
+
+        self._render_memory_map(summary["memory"])
+
+    def _render_memory_map(self, memory) -> None:
+        memory_text = self._map_memory_text
+        memory_view = memory_text.yview()[0]
+        memory_text.configure(state="normal")
+        memory_text.delete("1.0", tk.END)
+
+        rows = ["--- Resumo (MSX de 32 KB, sem drive) ---\n"]
+        rows.append(f"Programa tokenizado:  {memory.program_bytes:>6} bytes\n")
+        rows.append(f"Variáveis simples:    {memory.variable_bytes:>6} bytes\n")
+        rows.append(f"Arrays:               {memory.array_bytes:>6} bytes\n")
+        rows.append(f"Área de strings:      {memory.string_space:>6} bytes (CLEAR)\n")
+        rows.append(f"Livre após RUN:       {memory.free_bytes:>6} bytes (FRE(0))\n")
+
+        rows.append("\n--- Variáveis (2 caracteres significativos + tipo) ---\n")
+        rows.append(f"{'Nome':<10} | {'Tipo':<6} | {'Bytes':<6} | {'Dimensões'}\n")
+        rows.append("-" * 50 + "\n")
+        for var in memory.variables:
+            dims = ", ".join(map(str, var.dims))
+            rows.append(f"{var.name:<10} | {var.type:<6} | {var.bytes:<6} | {dims}\n")
+
+        rows.append("\n--- Programa por linha ---\n")
+        rows.append(f"{'Linha':<10} | {'Bytes'}\n")
+        rows.append("-" * 25 + "\n")
+        rows.extend(f"{line_num:<10} | {size}\n" for line_num, size in memory.lines)
+        memory_text.insert(tk.END, "".join(rows))
+        memory_text.configure(state="disabled")
+        memory_text.yview_moveto(memory_view)
 
     def _open_viewer(self) -> None:
         from main import MSXViewer
@@ -1281,6 +1722,10 @@ class MSXBasicEditor(ctk.CTk):
 
         def save():
             self.settings["dialect"] = dialect_var.get()
+            self.highlighter.set_dialect(self.settings["dialect"])
+            self.document.set_dialect(self.settings["dialect"])
+            self._update_cross_reference()
+            self._schedule_program_map_refresh()
             self.settings["start_line"] = start_line_entry.get()
             self.settings["increment"] = increment_entry.get()
             
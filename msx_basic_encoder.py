@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+
+from msx_basic_decoder import TOKEN_MAP, TOKEN_MAP_FF
+from msx_basic_numbers import encode_double, encode_single
+
+
+# Memory address of the first program line; next-line links are absolute addresses.
+BASIC_START_ADDRESS = 0x8001
+MAX_LINE_NUMBER = 65529
+
+# Keywords after which a number is a line reference (0x0E) instead of a constant.
+LINE_REF_KEYWORDS = frozenset({
+    "GOTO", "GOSUB", "THEN", "ELSE", "RESTORE", "RUN", "RETURN", "RESUME",
+    "LIST", "LLIST", "DELETE",
+})
+# Of those, the ones that take a range: both ends of "LIST 10-20" are line references.
+LINE_RANGE_KEYWORDS = frozenset({"LIST", "LLIST", "DELETE"})
+
+_LINE_NUMBER = re.compile(r"\s*(\d+) ?")
+_NUMBER = re.compile(r"(?:\d+\.?\d*|\.\d+)(?:[ED][+-]?\d+)?[!#%]?", re.IGNORECASE)
+_HEX = re.compile(r"&H[0-9A-F]+", re.IGNORECASE)
+_OCTAL = re.compile(r"&O[0-7]+", re.IGNORECASE)
+_BINARY = re.compile(r"&B[01]+", re.IGNORECASE)
+
+
+def _build_keyword_index() -> dict[str, list[tuple[str, bytes]]]:
+    """First character -> [(keyword, token bytes)], longest keywords first."""
+    entries: list[tuple[str, bytes]] = []
+    for index, keyword in enumerate(TOKEN_MAP):
+        if keyword == "'":
+            entries.append((keyword, b"\x3A\x8F\xE6"))
+        elif keyword == "ELSE":
+            entries.append((keyword, b"\x3A\xA1"))
+        else:
+            entries.append((keyword, bytes([0x81 + index])))
+    for index, keyword in enumerate(TOKEN_MAP_FF):
+        entries.append((keyword, bytes([0xFF, 0x81 + index])))
+
+    keyword_index: dict[str, list[tuple[str, bytes]]] = {}
+    for keyword, token in entries:
+        keyword_index.setdefault(keyword[0], []).append((keyword, token))
+    for candidates in keyword_index.values():
+        candidates.sort(key=lambda item: len(item[0]), reverse=True)
+    return keyword_index
+
+
+_KEYWORDS = _build_keyword_index()
+# Bytes each keyword takes in the tokenized program.
+_KEYWORD_SIZES = {keyword: len(token) for candidates in _KEYWORDS.values() for keyword, token in candidates}
+
+
+def _match_keyword(upper_text: str, pos: int) -> tuple[str, bytes] | None:
+    for keyword, token in _KEYWORDS.get(upper_text[pos], ()):
+        if upper_text.startswith(keyword, pos):
+            return keyword, token
+    return None
+
+
+def _encode_integer(value: int) -> bytes:
+    if value < 10:
+        return bytes([0x11 + value])
+    if value < 256:
+        return bytes([0x0F, value])
+    return bytes([0x1C, value & 0xFF, value >> 8])
+
+
+def _encode_number(text: str, line_ref: bool) -> bytes:
+    if text.isdigit() and str(int(text)) == text:
+        value = int(text)
+        if line_ref and value <= MAX_LINE_NUMBER:
+            return bytes([0x0E, value & 0xFF, value >> 8])
+        if value <= 32767:
+            return _encode_integer(value)
+    bcd = encode_single(text)
+    if bcd is not None:
+        return b"\x1D" + bcd
+    bcd = encode_double(text)
+    if bcd is not None:
+        return b"\x1F" + bcd
+    # Literals with no exact tokenized form stay as ASCII; the interpreter parses them at run time.
+    return text.encode("latin-1")
+
+
+def _encode_prefixed(text: str, prefix: int, formatted: str) -> bytes:
+    value = int(text[2:], 16 if prefix == 0x0C else 8)
+    if value > 0xFFFF or formatted.format(value) != text:
+        return text.encode("latin-1")
+    return bytes([prefix, value & 0xFF, value >> 8])
+
+
+def encode_msx_basic_line(code: str) -> bytes:
+    """Tokenize the statements of one line (without its line number or terminator)."""
+    out = bytearray()
+    upper_code = code.upper()
+    size = len(code)
+    pos = 0
+    line_ref = False
+    line_range = False
+    in_identifier = False
+
+    while pos < size:
+        char = code[pos]
+
+        if char == '"':
+            end = code.find('"', pos + 1)
+            end = size if end == -1 else end + 1
+            out += code[pos:end].encode("latin-1", errors="replace")
+            pos = end
+            line_ref = in_identifier = False
+            continue
+
+        keyword = _match_keyword(upper_code, pos)
+        if keyword is not None:
+            name, token = keyword
+            out += token
+            pos += len(name)
+            in_identifier = False
+            if not (name == "-" and line_ref and line_range):
+                line_ref = name in LINE_REF_KEYWORDS
+                line_range = name in LINE_RANGE_KEYWORDS
+            if name == "REM" or name == "'":
+                out += code[pos:].encode("latin-1", errors="replace")
+                break
+            if name == "DATA":
+                end = pos
+                quoted = False
+                while end < size and (quoted or code[end] != ":"):
+                    if code[end] == '"':
+                        quoted = not quoted
+                    end += 1
+                out += code[pos:end].encode("latin-1", errors="replace")
+                pos = end
+            continue
+
+        if char == "&":
+            match = _HEX.match(code, pos) or _OCTAL.match(code, pos)
+            if match:
+                text = match.group().upper()
+                if text[1] == "H":
+                    out += _encode_prefixed(text, 0x0C, "&H{:X}")
+                else:
+                    out += _encode_prefixed(text, 0x0B, "&O{:o}")
+                pos = match.end()
+                line_ref = in_identifier = False
+                continue
+            match = _BINARY.match(code, pos)
+            if match:
+                # &B has no token and stays ASCII, but its digits do not start a name
+                out += match.group().upper().encode("latin-1")
+                pos = match.end()
+                line_ref = in_identifier = False
+                continue
+
+        # Names have no '.', so ".5" is a number even right after one (A3.5 is A3 .5)
+        if (char.isdigit() and not in_identifier) or (char == "." and code[pos + 1:pos + 2].isdigit()):
+            match = _NUMBER.match(code, pos)
+            out += _encode_number(match.group().upper(), line_ref)
+            pos = match.end()
+            in_identifier = False
+            continue
+
+        if char == "\t":
+            char = " "
+        if ord(char) >= 32:
+            if char.isalpha():
+                char = char.upper()
+                in_identifier = True
+            elif not char.isdigit():
+                in_identifier = False
+                if char not in " ,":
+                    line_ref = False
+            out += char.encode("latin-1", errors="replace")
+        else:
+            in_identifier = False  # control characters are dropped, but still end a name
+        pos += 1
+
+    return bytes(out)
+
+
+@lru_cache(maxsize=4096)
+def _number_size(text: str, line_ref: bool) -> int:
+    if text.startswith("&H"):
+        return len(_encode_prefixed(text, 0x0C, "&H{:X}"))
+    if text.startswith("&O"):
+        return len(_encode_prefixed(text, 0x0B, "&O{:o}"))
+    if text.startswith("&"):
+        return len(text)  # &B has no token: stays ASCII
+    return len(_encode_number(text, line_ref))
+
+
+def encoded_size(code: str, words) -> int:
+    """Length of encode_msx_basic_line(code), worked out from the scanned words of code.
+
+    For callers that have scanned the line already with
+    msx_basic_lexer.scan: only the numbers are sized by the encoder,
+    everything else by its length. Dialect keywords the MSX has
+    no token for count as text.
+    """
+    size = len(code)
+    line_ref = line_range = False
+    for kind, text in words:
+        if kind == "command" or kind == "function":
+            keyword_size = _KEYWORD_SIZES.get(text)
+            if keyword_size is None:
+                continue
+            size += keyword_size - len(text)
+            if not (text == "-" and line_ref and line_range):
+                line_ref = text in LINE_REF_KEYWORDS
+                line_range = text in LINE_RANGE_KEYWORDS
+        elif kind == "number":
+            size += _number_size(text, line_ref) - len(text)
+            if text[0] == "&":
+                line_ref = False
+        elif kind == "identifier":
+            if text[-1] in "$%!#":
+                line_ref = False
+        elif kind == "plain":
+            if text < " ":
+                size -= 1  # control characters are dropped and change nothing else
+            elif text != ",":
+                line_ref = False
+        else:  # string, label
+            line_ref = False
+    return size
+
+
+def encode_msx_basic(text: str) -> bytes:
+    """Tokenize an ASCII listing into the binary format used by SAVE "FILE".
+
+    Lines are ordered by number and a repeated number replaces the earlier
+    line, as LOAD "FILE",A does on the MSX.
+    """
+    lines: dict[int, bytes] = {}
+    for index, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        match = _LINE_NUMBER.match(line)
+        if not match:
+            raise ValueError(f"line {index} has no line number: {line[:30]}")
+        line_number = int(match.group(1))
+        if line_number > MAX_LINE_NUMBER:
+            raise ValueError(f"line {index}: line number {line_number} is above {MAX_LINE_NUMBER}")
+        lines[line_number] = encode_msx_basic_line(line[match.end():])
+
+    out = bytearray(b"\xFF")
+    for line_number in sorted(lines):
+        body = lines[line_number]
+        # Link = address of the next line: this line's address + link/number (4) + body + 0x00
+        link = BASIC_START_ADDRESS + len(out) - 1 + 4 + len(body) + 1
+        if link > 0xFFFF:
+            raise ValueError(f"line {line_number}: program does not fit in the MSX address space")
+        out += bytes([link & 0xFF, link >> 8, line_number & 0xFF, line_number >> 8])
+        out += body
+        out += b"\x00"
+    out += b"\x00\x00"
+    return bytes(out)
@@ -0,0 +1,302 @@
+"""Syntax highlighting for the editor that only re-tags the lines that changed."""
+from __future__ import annotations
+
+import time
+import tkinter as tk
+
+from msx_basic_lexer import get_lexer, split_line_number
+
+HIGHLIGHT_TAGS = ("keyword", "comment", "string", "number", "linenumber", "function")
+# Background pass: lines taken from the queue at a time, time budget per slice, pause between slices.
+BACKGROUND_CHUNK_LINES = 50
+BACKGROUND_SLICE_SECONDS = 0.008
+BACKGROUND_DELAY_MS = 1
+
+# Lexer token kind -> tag; commands are handled apart (operators stay plain, REM/' are comments)
+_KIND_TAGS = {
+    "function": "function",
+    "number": "number",
+    "string": "string",
+    "comment": "comment",
+    "label": "linenumber",
+}
+
+
+def highlight_line(line: str, dialect: str | None = None) -> list[tuple[str, int, int]]:
+    """(tag, start column, end column) of every highlighted span of one line."""
+    spans: list[tuple[str, int, int]] = []
+    line_num, code_start = split_line_number(line)
+    if line_num is not None:
+        spans.append(("linenumber", len(line) - len(line.lstrip()), code_start))
+
+    for kind, text, start in get_lexer(dialect).tokenize(line[code_start:], code_start):
+        if kind == "command":
+            if text == "'" or text.upper() == "REM":
+                spans.append(("comment", start, start + len(text)))
+            elif text[0].isalpha():
+                spans.append(("keyword", start, start + len(text)))
+            continue
+        tag = _KIND_TAGS.get(kind)
+        if tag:
+            spans.append((tag, start, start + len(text)))
+    return spans
+
+
+class IncrementalHighlighter:
+    """Keeps the highlight tags of a tk.Text up to date, one changed line at a time.
+
+    The widget's Tcl command is wrapped (the same trick as idlelib's
+    WidgetRedirector) so every insert, delete and replace reports the lines
+    it touched, whoever made it: typing, paste or code. Undo/redo and
+    multi-range deletes fall back to a whole-buffer pass, where a hash of
+    each line as last tagged skips the lines no edit touched.
+
+    Changed lines in view are re-tagged at once; the others wait in a queue
+    that is worked off in short time slices between Tk events, so loading
+    a huge listing shows coloured code right away and never blocks.
+    """
+
+    def __init__(self, text: tk.Text, dialect: str | None = None) -> None:
+        self.text = text
+        self.dialect = dialect
+        self.dirty: set[int] = set()  # 1-based line numbers waiting to be re-tagged
+        self._cursor = 1  # where the background pass goes on; it works through the buffer in order
+        self._hashes: list[int | None] = []  # hash of line n as last tagged, at [n - 1]
+        self._all_dirty = True
+        self._background_job: str | None = None
+        self._listeners: list = []
+        self._orig = text._w + "_orig"
+        text.tk.call("rename", text._w, self._orig)
+        text.tk.createcommand(text._w, self._dispatch)
+
+    def close(self) -> None:
+        """Give the widget its own command back."""
+        self._cancel_background()
+        text = self.text
+        text.tk.deletecommand(text._w)
+        text.tk.call("rename", self._orig, text._w)
+
+    def _call(self, *args):
+        return self.text.tk.call((self._orig,) + args)
+
+    def _line_of(self, index: str) -> int:
+        return int(str(self._call("index", index)).split(".")[0])
+
+    def add_listener(self, listener) -> None:
+        """Call listener(first, removed, added) after every edit.
+
+        Text lines first..first+removed became lines first..first+added;
+        removed and added are None when anything may have changed (undo, redo).
+        """
+        self._listeners.append(listener)
+
+    def _dispatch(self, command, *args):
+        change = None
+        if command == "insert" and args:
+            line = self._line_of(args[0])
+            change = (line, 0, self._note_insert(line, args[1::2]))
+        elif command == "delete" and args:
+            if len(args) > 2:
+                self._all_dirty = True
+                change = (1, None, None)
+            else:
+                first = self._line_of(args[0])
+                # One index deletes one character, which may be the newline that joins two lines.
+                last = self._line_of(args[1] if len(args) > 1 else f"{args[0]} + 1c")
+                self._note_delete(first, last)
+                change = (first, last - first, 0)
+        elif command == "replace" and len(args) >= 3:
+            first, last = self._line_of(args[0]), self._line_of(args[1])
+            self._note_delete(first, last)
+            change = (first, last - first, self._note_insert(first, args[2::2]))
+        elif command == "edit" and args and args[0] in ("undo", "redo"):
+            # Undo/redo change the text inside Tk without insert/delete commands.
+            self._all_dirty = True
+            change = (1, None, None)
+        elif command in ("yview", "see") and args and self.dirty:
+            # Scrolling: the lines coming into view go to the front of the queue.
+            result = self._call(command, *args)
+            self._cancel_background()
+            self._schedule(0)
+            return result
+        result = self._call(command, *args)
+        if change is not None:
+            for listener in self._listeners:
+                listener(*change)
+        return result
+
+    def _forget(self, line: int) -> None:
+        # Text edited in place may have lost its tags even if it reads the same again.
+        if line <= len(self._hashes):
+            self._hashes[line - 1] = None
+
+    def _note_insert(self, line: int, chunks) -> int:
+        self._forget(line)
+        added = sum(str(chunk).count("\n") for chunk in chunks)
+        if added:
+            self._hashes[line:line] = [None] * added
+            self.dirty = {number + added if number > line else number for number in self.dirty}
+            if self._cursor > line:
+                self._cursor += added
+        self.dirty.update(range(line, line + added + 1))
+        return added
+
+    def _note_delete(self, first: int, last: int) -> None:
+        self._forget(first)
+        removed = last - first
+        if removed > 0:
+            del self._hashes[first:last]
+            self.dirty = {
+                number - removed if number > last else min(number, first)
+                for number in self.dirty
+            }
+            self._cursor = self._cursor - removed if self._cursor > last else min(self._cursor, first)
+        self.dirty.add(first)
+
+    def line_count(self) -> int:
+        return self._line_of("end - 1c")
+
+    def visible_lines(self) -> tuple[int, int]:
+        """First and last line shown in the widget."""
+        first = self._line_of("@0,0")
+        last = self._line_of(f"@0,{self.text.winfo_height()}")
+        return first, last
+
+    def mark_all_dirty(self) -> None:
+        self._all_dirty = True
+
+    def set_dialect(self, dialect: str | None) -> None:
+        """Keywords differ between dialects: re-tag everything with the new one."""
+        if dialect != self.dialect:
+            self.dialect = dialect
+            self.invalidate()
+            self.highlight_dirty()
+
+    def invalidate(self, first_line: int = 1, last_line: int | None = None) -> None:
+        """Queue lines first..last (default: to the end) to be re-tagged even if their text is unchanged."""
+        total = self.line_count()
+        last_line = total if last_line is None else min(last_line, total)
+        self._ensure_hashes(total)
+        for number in range(first_line, last_line + 1):
+            self._hashes[number - 1] = None
+        self.dirty.update(range(first_line, last_line + 1))
+
+    def mark_clean(self, first_line: int, last_line: int) -> None:
+        """Lines first..last are tagged already (the decoder did it): remember them as they are."""
+        self._ensure_hashes(last_line)
+        lines = str(self._call("get", f"{first_line}.0", f"{last_line}.end")).split("\n")
+        for offset, line in enumerate(lines):
+            self._hashes[first_line - 1 + offset] = hash(line)
+            self.dirty.discard(first_line + offset)
+
+    def _ensure_hashes(self, count: int) -> None:
+        if len(self._hashes) < count:
+            self._hashes.extend([None] * (count - len(self._hashes)))
+
+    def _sync(self) -> int:
+        """Drop dirty lines past the end; expand a pending whole-buffer pass into dirty lines.
+
+        Returns the line count.
+        """
+        total = self.line_count()
+        if len(self._hashes) > total:
+            self.dirty.difference_update(range(total + 1, len(self._hashes) + 1))
+            del self._hashes[total:]
+        self._ensure_hashes(total)
+        if self._all_dirty:
+            self._all_dirty = False
+            self.dirty = set(range(1, total + 1))
+            self._cursor = 1
+        return total
+
+    def highlight_dirty(self) -> int:
+        """Re-tag the changed lines in view now; the rest is done in idle-time chunks.
+
+        Returns how many lines were re-tagged right away.
+        """
+        self._sync()
+        retagged = self._highlight_visible()
+        self._schedule(BACKGROUND_DELAY_MS)
+        return retagged
+
+    def highlight_all(self) -> int:
+        """Re-tag every changed line now, without waiting for the background chunks."""
+        total = self._sync()
+        retagged = self._retag_lines([number for number in sorted(self.dirty) if number <= total])
+        self.dirty.clear()
+        return retagged
+
+    def _highlight_visible(self) -> int:
+        if not self.dirty:
+            return 0
+        first, last = self.visible_lines()
+        visible = [number for number in range(first, last + 1) if number in self.dirty]
+        self.dirty.difference_update(visible)
+        return self._retag_lines(visible)
+
+    def _schedule(self, delay_ms: int) -> None:
+        if self._background_job is not None or not self.dirty:
+            return
+        self._background_job = self.text.after(delay_ms, self._background)
+
+    def _cancel_background(self) -> None:
+        if self._background_job is not None:
+            self.text.after_cancel(self._background_job)
+            self._background_job = None
+
+    def _background(self) -> None:
+        """One time-sliced chunk: the lines in view first, then the rest in order."""
+        self._background_job = None
+        total = self._sync()
+        self._highlight_visible()
+        deadline = time.perf_counter() + BACKGROUND_SLICE_SECONDS
+        while self.dirty and time.perf_counter() < deadline:
+            chunk = self._next_chunk(total)
+            if not chunk:
+                self.dirty.clear()  # only lines past the end were left
+                break
+            self.dirty.difference_update(chunk)
+            self._retag_lines(chunk)
+        self._schedule(BACKGROUND_DELAY_MS)
+
+    def _next_chunk(self, total: int) -> list[int]:
+        """The next dirty lines from the cursor on, going back to line 1 once at the end.
+
+        Each line is looked at once per round, so working off the whole
+        queue is linear in the buffer size.
+        """
+        dirty = self.dirty
+        if len(dirty) <= BACKGROUND_CHUNK_LINES:
+            return [number for number in sorted(dirty) if number <= total]
+        chunk: list[int] = []
+        number = self._cursor
+        wrapped = False
+        while len(chunk) < BACKGROUND_CHUNK_LINES:
+            if number > total:
+                if wrapped:
+                    break
+                wrapped = True
+                number = 1
+            if number in dirty:
+                chunk.append(number)
+            number += 1
+        self._cursor = number
+        return chunk
+
+    def _retag_lines(self, numbers) -> int:
+        retagged = 0
+        for number in numbers:
+            retagged += self._retag(number, str(self._call("get", f"{number}.0", f"{number}.end")))
+        return retagged
+
+    def _retag(self, number: int, line: str) -> int:
+        digest = hash(line)
+        if self._hashes[number - 1] == digest:
+            return 0
+        self._hashes[number - 1] = digest
+        start, end = f"{number}.0", f"{number}.end"
+        for tag in HIGHLIGHT_TAGS:
+            self._call("tag", "remove", tag, start, end)
+        for tag, span_start, span_end in highlight_line(line, self.dialect):
+            self._call("tag", "add", tag, f"{number}.{span_start}", f"{number}.{span_end}")
+        return 1
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import re
+import string
+from typing import NamedTuple
+
+from msx_basic_decoder import TOKEN_MAP, TOKEN_MAP_FF
+
+
+class Token(NamedTuple):
+    kind: str  # command, function, identifier, number, string, comment, data, label, plain
+    text: str  # as written in the line
+    start: int  # column of the first character
+
+
+DEFAULT_DIALECT = "MSX-BASIC"
+# Keywords each dialect adds to the MSX-BASIC token table, as (commands, functions).
+DIALECT_KEYWORDS: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {
+    "MSX-BASIC": ((), ()),
+    # Basic Dignified: preprocessor directives and block keywords; also {labels} and ## comments.
+    "MSX Basic Dignified": (("DEFINE", "DECLARE", "INCLUDE", "KEEP", "ENDIF", "FUNC", "RET", "EXIT"), ("TRUE", "FALSE")),
+    # MSXBas2Rom: compiler extensions for resources and tiles.
+    "MSX-Bas2Rom": (("FILE", "TEXT"), ("RESOURCE", "RESOURCESIZE", "COLLISION", "TILE")),
+}
+DIALECTS = tuple(DIALECT_KEYWORDS)
+
+
+def _build_keyword_trie(keywords: list[tuple[str, str]]) -> dict:
+    """Nested dicts keyed by character; node[None] holds (keyword, kind) where a keyword ends."""
+    trie: dict = {}
+    for keyword, kind in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node.setdefault(None, (keyword, kind))
+    return trie
+
+
+def _trie_pattern(node: dict) -> str:
+    """Regex equivalent of a trie node; optional branches are greedy, so the longest keyword wins."""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in node.items() if char is not None]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if None in node:
+        return ("(?:" + body + ")?") if len(branches) == 1 else body + "?"
+    return body
+
+
+_ASCII_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+
+def _upper(code: str) -> str:
+    """code with its ASCII letters upper-cased; str.upper() alone turns "ß" into "SS" and shifts the columns."""
+    return code.upper() if code.isascii() else code.translate(_ASCII_UPPER)
+
+
+class Lexer:
+    """Tokenizer for one dialect, compiled once.
+
+    The keyword alternative of the token regex is the keyword trie itself,
+    so the regex engine walks it in C and the longest keyword wins.
+    """
+
+    def __init__(self, dialect: str = DEFAULT_DIALECT) -> None:
+        commands, functions = DIALECT_KEYWORDS[dialect]
+        keywords = [(keyword, "command") for keyword in (*TOKEN_MAP, *commands)]
+        keywords += [(keyword, "function") for keyword in (*TOKEN_MAP_FF, *functions)]
+        self.dialect = dialect
+        self.trie = _build_keyword_trie(keywords)
+        # The first kind wins for a keyword listed twice, as in the trie.
+        self.kinds = {keyword: kind for keyword, kind in keywords[::-1]}
+        self.commands = frozenset(keyword for keyword, kind in self.kinds.items() if kind == "command")
+        self.functions = frozenset(keyword for keyword, kind in self.kinds.items() if kind == "function")
+
+        extra = ""
+        if dialect == "MSX Basic Dignified":
+            extra = r"|(?P<label>\{[^}]*\}?)|(?P<comment>##.*)"
+        keyword_pattern = _trie_pattern(self.trie)
+        # One match per token (leading whitespace included), against the upper-cased line.
+        # A name ends where a keyword starts, as in the MSX tokenizer: "YTHEN10" is Y THEN 10.
+        self._token = re.compile(
+            r"[ \t]*(?:"
+            r'(?P<string>"[^"]*"?)'
+            + extra
+            # REM, ' and DATA take the rest of the line or statement with them.
+            + r"""|(?P<remark>REM|')(?P<comment_text>.*)|(?P<data_keyword>DATA)(?P<data>(?:"[^"]*"?|[^":])*)"""
+            r"|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[ED][+-]?\d+)?[!#%]?|&(?:H[0-9A-F]+|O[0-7]+|B[01]+))"
+            r"|(?P<keyword>" + keyword_pattern + ")"
+            r"|(?P<identifier>[A-Z](?:(?!" + keyword_pattern + r")[A-Z0-9])*[$%!#]?)"
+            r"|(?P<plain>[^ \t]))",
+            re.DOTALL,
+        )
+        self._keyword = re.compile(keyword_pattern)
+        # The same tokens for scan(), as one findall without whitespace or columns:
+        # REM, ' and DATA (group 1) take their text with them outside any group, and a
+        # Dignified ## comment matches no group, so neither text comes out.
+        self._word = re.compile(
+            r"""(REM|'|DATA)(?:(?<=DATA)(?:"[^"]*"?|[^":])*|.*)"""
+            + (r"|##.*" if dialect == "MSX Basic Dignified" else "")
+            + r'|("[^"]*"?'
+            + (r"|\{[^}]*\}?" if dialect == "MSX Basic Dignified" else "")
+            + r"|(?:\d+\.?\d*|\.\d+)(?:[ED][+-]?\d+)?[!#%]?|&(?:H[0-9A-F]+|O[0-7]+|B[01]+)"
+            r"|" + keyword_pattern
+            + r"|[A-Z](?:(?!" + keyword_pattern + r")[A-Z0-9])*[$%!#]?"
+            r"|[^ \t])",
+            re.DOTALL,
+        )
+        # Kind of a scanned word: keywords by name, everything else by its first character.
+        self._word_kinds = {**self.kinds, ".": "plain", "&": "plain"}
+        self._first_char_kinds = {'"': "string", **dict.fromkeys("0123456789.&", "number")}
+        self._first_char_kinds.update(dict.fromkeys("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "identifier"))
+        if dialect == "MSX Basic Dignified":
+            self._first_char_kinds["{"] = "label"
+
+    def match_keyword(self, upper_text: str, pos: int) -> tuple[str, str] | None:
+        """Longest keyword starting at pos, as (keyword, kind), or None."""
+        match = self._keyword.match(upper_text, pos)
+        if not match:
+            return None
+        return match.group(), self.kinds[match.group()]
+
+    def tokenize(self, code: str, offset: int = 0) -> list[Token]:
+        """Split program text (no line number) into tokens in one left-to-right pass.
+
+        Keywords are recognised at every character outside strings, comments
+        and DATA, even in the middle of a name, the way the MSX tokenizer does
+        it ("FORI=ATOB" is FOR I = A TO B). Whitespace is skipped; offset is
+        added to every start column.
+        """
+        tokens: list[Token] = []
+        append = tokens.append
+        kinds = self.kinds
+        new_token = tuple.__new__  # Token(...) without the keyword-argument layer
+
+        for match in self._token.finditer(_upper(code)):
+            kind = match.lastgroup
+            start, end = match.span(kind)
+            if kind == "keyword":
+                append(new_token(Token, (kinds[match[kind]], code[start:end], start + offset)))
+            elif kind == "comment_text" or kind == "data":
+                keyword = "remark" if kind == "comment_text" else "data_keyword"
+                keyword_start, keyword_end = match.span(keyword)
+                append(new_token(Token, ("command", code[keyword_start:keyword_end], keyword_start + offset)))
+                text = code[start:end]
+                if text.strip() if kind == "data" else text:
+                    append(new_token(Token, ("comment" if kind == "comment_text" else "data", text, start + offset)))
+            else:
+                append(new_token(Token, (kind, code[start:end], start + offset)))
+
+        return tokens
+
+    def scan(self, code: str) -> list[tuple[str, str]]:
+        """(kind, upper-cased text) of the tokens of program text, for the analyzer.
+
+        Same tokens as tokenize() without building Token objects: no
+        columns, and the text of comments and DATA lists is left out (their
+        REM, ' or DATA keyword is kept).
+        """
+        word_kinds = self._word_kinds
+        first_char_kinds = self._first_char_kinds
+        return [
+            (word_kinds.get(word) or first_char_kinds.get(word[0], "plain"), word)
+            for words in self._word.findall(_upper(code))
+            for word in words
+            if word
+        ]
+
+
+LEXERS = {dialect: Lexer(dialect) for dialect in DIALECTS}
+DEFAULT_LEXER = LEXERS[DEFAULT_DIALECT]
+KEYWORD_TRIE = DEFAULT_LEXER.trie
+KEYWORD_KINDS = DEFAULT_LEXER.kinds
+
+
+def get_lexer(dialect: str | None = None) -> Lexer:
+    """Lexer of a dialect (the names used in the editor settings); unknown names get MSX-BASIC."""
+    return LEXERS.get(dialect or DEFAULT_DIALECT, DEFAULT_LEXER)
+
+
+def match_keyword(upper_text: str, pos: int, dialect: str | None = None) -> tuple[str, str] | None:
+    """Longest keyword starting at pos, as (keyword, kind), or None."""
+    return get_lexer(dialect).match_keyword(upper_text, pos)
+
+
+def tokenize(code: str, offset: int = 0, dialect: str | None = None) -> list[Token]:
+    """Tokens of program text (no line number); see Lexer.tokenize."""
+    return get_lexer(dialect).tokenize(code, offset)
+
+
+def scan(code: str, dialect: str | None = None) -> list[tuple[str, str]]:
+    """(kind, upper-cased text) of the tokens of program text; see Lexer.scan."""
+    return get_lexer(dialect).scan(code)
+
+
+_LINE_NUMBER = re.compile(r"\s*(\d+)")
+
+
+def split_line_number(line: str) -> tuple[int | None, int]:
+    """(line number, column where the statements start); (None, 0) for unnumbered lines."""
+    match = _LINE_NUMBER.match(line)
+    if not match:
+        return None, 0
+    return int(match.group(1)), match.end()
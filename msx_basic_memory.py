@@ -0,0 +1,262 @@
+"""Memory use of an MSX-BASIC program as the interpreter lays it out in RAM."""
+from __future__ import annotations
+
+from math import prod
+from typing import Iterable, NamedTuple
+
+from msx_basic_encoder import encoded_size
+from msx_basic_lexer import scan, split_line_number
+
+# FRE(0) right after boot on a 32 KB MSX1 without disk drives (CLEAR 200, HIMEM &HF380).
+FREE_BYTES_32K = 28815
+DEFAULT_STRING_SPACE = 200
+DEFAULT_HIMEM = 0xF380
+
+# Bytes of a value of each type; strings store a 3-byte descriptor (length + address).
+VALUE_SIZES = {"INT": 2, "STR": 3, "SNG": 4, "DBL": 8}
+SUFFIX_TYPES = {"%": "INT", "$": "STR", "!": "SNG", "#": "DBL"}
+DEF_STATEMENTS = {"DEFINT": "INT", "DEFSTR": "STR", "DEFSNG": "SNG", "DEFDBL": "DBL"}
+# Variable table entry: type byte + 2 name bytes, then the value.
+SIMPLE_HEADER = 3
+# Array entry: type byte + 2 name bytes + 2 length bytes + dimension count, then 2 bytes per dimension.
+ARRAY_HEADER = 6
+# An array used without DIM gets bounds of 10 in every dimension.
+DEFAULT_BOUND = 10
+# Link (2) + line number (2) before the tokens, 0x00 after them.
+LINE_OVERHEAD = 5
+# The 0x0000 link that ends the program.
+PROGRAM_END_BYTES = 2
+
+
+class LineMemory(NamedTuple):
+    """What one numbered line contributes to the memory model."""
+
+    line_num: int
+    program_bytes: int  # size of the line in the tokenized program
+    variables: tuple[str, ...]  # simple variables as written (suffix kept)
+    arrays: tuple[tuple[str, int], ...]  # (name, dimensions) of array uses
+    dims: tuple[tuple[str, tuple[int | None, ...]], ...]  # DIM name(bounds); None = not a constant
+    deftypes: tuple[tuple[str, str, str], ...]  # (type, first letter, last letter)
+    clear: tuple[int | None, int | None] | None  # CLEAR string space, HIMEM
+
+
+class VariableMemory(NamedTuple):
+    name: str  # as the interpreter keys it: 2 significant characters + type
+    type: str
+    bytes: int
+    dims: tuple[int, ...] = ()  # bounds of an array; () for a simple variable
+
+
+class MemoryReport(NamedTuple):
+    program_bytes: int
+    lines: list[tuple[int, int]]  # (line number, bytes in the program)
+    variables: list[VariableMemory]
+    variable_bytes: int  # simple variables
+    array_bytes: int
+    string_space: int  # from CLEAR, reserved for string contents
+    free_bytes: int  # FRE(0) left after RUN on a 32 KB MSX
+
+
+def _constant(words, i: int) -> int | None:
+    """Integer value of words[i] if it is a plain decimal or &H constant."""
+    if i >= len(words) or words[i][0] != "number":
+        return None
+    text = words[i][1].rstrip("%!#")
+    if text.isdigit():
+        return int(text)
+    if text.startswith("&H"):
+        return int(text[2:], 16)
+    return None
+
+
+def _closing_paren(words, i: int) -> tuple[int, list[int]]:
+    """Index of the ')' matching the '(' at words[i] and the indexes of its top-level commas."""
+    depth = 0
+    commas: list[int] = []
+    for j in range(i, len(words)):
+        text = words[j][1]
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+            if depth == 0:
+                return j, commas
+        elif text == "," and depth == 1:
+            commas.append(j)
+    return len(words), commas
+
+
+def analyze_memory_line(line: str, dialect: str | None = None) -> LineMemory | None:
+    """Memory facts of one program line; None for unnumbered lines."""
+    line_num, code_start = split_line_number(line)
+    if line_num is None:
+        return None
+    code = line[code_start:]
+    return memory_facts(line_num, code, scan(code, dialect))
+
+
+def memory_facts(line_num: int, code: str, words) -> LineMemory:
+    """Memory facts of a line whose statements (code) the lexer has already scanned into words."""
+    # The encoder drops the single space after the line number, as the MSX does.
+    program_bytes = LINE_OVERHEAD + encoded_size(code, words) - (code[:1] == " ")
+
+    count = len(words)
+    variables: list[str] = []
+    arrays: list[tuple[str, int]] = []
+    dims: list[tuple[str, tuple[int | None, ...]]] = []
+    deftypes: list[tuple[str, str, str]] = []
+    clear: tuple[int | None, int | None] | None = None
+    statement: str | None = None
+    at_start = True
+    for i, (kind, text) in enumerate(words):
+        if kind == "command" or kind == "function":
+            if at_start:
+                statement = text
+            if text in ("THEN", "ELSE"):
+                statement, at_start = None, True
+                continue
+            if text == "CLEAR":
+                size = _constant(words, i + 1)
+                himem = _constant(words, i + 3) if i + 2 < count and words[i + 2][1] == "," else None
+                clear = (size, himem)
+            elif text in DEF_STATEMENTS:
+                j = i + 1
+                while j < count and words[j][0] == "identifier":
+                    first = last = words[j][1][0]
+                    if j + 2 < count and words[j + 1][1] == "-" and words[j + 2][0] == "identifier":
+                        last = words[j + 2][1][0]
+                        j += 2
+                    deftypes.append((DEF_STATEMENTS[text], first, last))
+                    if j + 1 < count and words[j + 1][1] == ",":
+                        j += 2
+                    else:
+                        break
+        elif kind == "identifier":
+            if statement in DEF_STATEMENTS:
+                continue
+            if i > 0 and words[i - 1] == ("command", "FN"):
+                continue
+            if i + 1 < count and words[i + 1][1] == "(":
+                close, commas = _closing_paren(words, i + 1)
+                if statement == "DIM":
+                    starts = [i + 2] + [comma + 1 for comma in commas]
+                    ends = commas + [close]
+                    bounds = tuple(
+                        _constant(words, start) if end == start + 1 else None
+                        for start, end in zip(starts, ends)
+                    )
+                    dims.append((text, bounds))
+                else:
+                    arrays.append((text, len(commas) + 1))
+            else:
+                variables.append(text)
+        elif kind == "plain" and text == ":":
+            statement, at_start = None, True
+            continue
+        elif kind == "label":  # a Dignified {label} does not start the statement
+            continue
+        at_start = False
+
+    return LineMemory(
+        line_num, program_bytes, tuple(variables), tuple(arrays), tuple(dims), tuple(deftypes), clear
+    )
+
+
+class MemoryModel:
+    """Program size, variable table and free RAM of a listing, kept per line between updates."""
+
+    def __init__(self, dialect: str | None = None) -> None:
+        self.dialect = dialect
+        # Line text -> its facts; only edited lines are lexed again
+        self._line_cache: dict[str, LineMemory | None] = {}
+
+    def update(self, lines: Iterable[str]) -> MemoryReport:
+        cache = self._line_cache
+        current: dict[str, LineMemory | None] = {}
+        results: list[LineMemory] = []
+        for line in lines:
+            if line in current:
+                result = current[line]
+            else:
+                result = current[line] = cache[line] if line in cache else analyze_memory_line(line, self.dialect)
+            if result is not None:
+                results.append(result)
+        self._line_cache = current
+        return program_report(results)
+
+
+def program_report(lines: Iterable[LineMemory]) -> MemoryReport:
+    """Report for the facts of a program's lines, in listing order."""
+    by_number: dict[int, LineMemory] = {}
+    for line in lines:
+        # A repeated line number replaces the earlier line, as when typing it again.
+        by_number[line.line_num] = line
+    return build_report([by_number[number] for number in sorted(by_number)])
+
+
+def build_report(lines: list[LineMemory]) -> MemoryReport:
+    # DEFxxx statements are applied in program order; the last one for a letter wins.
+    letter_types = {chr(code): "SNG" for code in range(ord("A"), ord("Z") + 1)}
+    string_space = DEFAULT_STRING_SPACE
+    himem = DEFAULT_HIMEM
+    for line in lines:
+        for vtype, first, last in line.deftypes:
+            for code in range(ord(first), ord(last) + 1):
+                letter_types[chr(code)] = vtype
+        if line.clear is not None:
+            size, top = line.clear
+            if size is not None:
+                string_space = size
+            if top is not None:
+                himem = top
+
+    def key(name: str) -> tuple[str, str]:
+        # Only the first two characters of a name are significant: SCORE and SC are one variable.
+        if name[-1] in SUFFIX_TYPES:
+            return name[:-1][:2], SUFFIX_TYPES[name[-1]]
+        return name[:2], letter_types.get(name[0], "SNG")
+
+    simple: dict[tuple[str, str], None] = {}
+    arrays: dict[tuple[str, str], tuple[int, ...]] = {}
+    for line in lines:
+        for name, bounds in line.dims:
+            # DIM with a bound that is not a constant is counted with the default bound.
+            arrays.setdefault(key(name), tuple(DEFAULT_BOUND if bound is None else bound for bound in bounds))
+        for name in line.variables:
+            simple.setdefault(key(name), None)
+    for line in lines:
+        for name, dimensions in line.arrays:
+            arrays.setdefault(key(name), (DEFAULT_BOUND,) * dimensions)
+
+    suffixes = {vtype: suffix for suffix, vtype in SUFFIX_TYPES.items()}
+    variables: list[VariableMemory] = []
+    variable_bytes = 0
+    for name, vtype in simple:
+        size = SIMPLE_HEADER + VALUE_SIZES[vtype]
+        variable_bytes += size
+        variables.append(VariableMemory(name + suffixes[vtype], vtype, size))
+    array_bytes = 0
+    for (name, vtype), bounds in arrays.items():
+        size = ARRAY_HEADER + 2 * len(bounds) + prod(bound + 1 for bound in bounds) * VALUE_SIZES[vtype]
+        array_bytes += size
+        variables.append(VariableMemory(f"{name}{suffixes[vtype]}()", vtype, size, bounds))
+    variables.sort()
+
+    program_bytes = sum(line.program_bytes for line in lines) + PROGRAM_END_BYTES
+    free_bytes = (
+        FREE_BYTES_32K
+        - (DEFAULT_HIMEM - himem)
+        - (string_space - DEFAULT_STRING_SPACE)
+        - (program_bytes - PROGRAM_END_BYTES)  # the empty program's end link is already in the boot figure
+        - variable_bytes
+        - array_bytes
+    )
+    return MemoryReport(
+        program_bytes,
+        [(line.line_num, line.program_bytes) for line in lines],
+        variables,
+        variable_bytes,
+        array_bytes,
+        string_space,
+        free_bytes,
+    )
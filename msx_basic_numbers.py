@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+
+
+# BCD byte -> its two digits; avoids a format call per byte.
+_BCD_DIGITS = tuple(f"{byte:02X}" for byte in range(256))
+
+_SINGLE_LITERAL = re.compile(r"(\d*)(?:\.(\d*))?(?:E([+-]?\d+))?!?", re.IGNORECASE)
+_DOUBLE_LITERAL = re.compile(r"(\d*)(?:\.(\d*))?(?:D([+-]?\d+))?#?", re.IGNORECASE)
+
+
+def _strip_zeros(text: str) -> str:
+    return text.rstrip("0").rstrip(".")
+
+
+def _format_bcd(b: bytes, suffix: str, exponent_mark: str) -> str:
+    """Shared layout of single (0x1D) and double (0x1F) constants.
+
+    The first byte holds the sign (bit 7) and the exponent excess 64; the
+    others hold the mantissa as packed BCD, 0.d1d2d3... x 10^exponent.
+    """
+    first = b[0]
+    exponent = (first & 0x7F) - 64
+    if exponent == -64:
+        return "0" + suffix
+    sign = "-" if first & 0x80 else ""
+    mantissa = "".join([_BCD_DIGITS[byte] for byte in b[1:]])
+
+    # Fast path: the usual literals (1, 2.5, 100.25, 3.14159...) only move the decimal point.
+    if 0 <= exponent < len(mantissa):
+        return sign + _strip_zeros(mantissa[:exponent] + "." + mantissa[exponent:])
+    if exponent == -1:
+        return sign + _strip_zeros(".0" + mantissa)
+    if -63 <= exponent < -1:
+        return f"{sign}{_strip_zeros(mantissa[0] + '.' + mantissa[1:])}{exponent_mark}{exponent - 1:03d}"
+    if exponent < 15:
+        return sign + mantissa + "0" * (exponent - len(mantissa)) + suffix
+    return f"{sign}{_strip_zeros(mantissa[0] + '.' + mantissa[1:])}{exponent_mark}+{exponent - 1:02d}"
+
+
+@lru_cache(maxsize=4096)
+def single_to_string(b: bytes) -> str:
+    """Text of a 4-byte single-precision constant (token 0x1D)."""
+    if len(b) != 4:
+        return ""
+    return _format_bcd(b, "!", "E")
+
+
+@lru_cache(maxsize=4096)
+def double_to_string(b: bytes) -> str:
+    """Text of an 8-byte double-precision constant (token 0x1F).
+
+    Values that would read back as single precision (6 significant digits
+    or fewer) get a "#" suffix, as LIST shows them on the MSX.
+    """
+    if len(b) != 8:
+        return ""
+    text = _format_bcd(b, "#", "D")
+    exponent = (b[0] & 0x7F) - 64
+    if 0 <= exponent < 14 or exponent == -1:
+        significant = "".join([_BCD_DIGITS[byte] for byte in b[1:]]).rstrip("0")
+        if len(significant) <= 6:
+            text += "#"
+    return text
+
+
+def _encode_bcd(text: str, pattern: re.Pattern[str], digit_count: int) -> bytes | None:
+    match = pattern.fullmatch(text)
+    if not match or not any(char.isdigit() for char in text):
+        return None
+    int_part, frac_part, exp_part = match.group(1), match.group(2) or "", match.group(3)
+    digits = int_part + frac_part
+    exponent = len(int_part) + (int(exp_part) if exp_part else 0)
+
+    stripped = digits.lstrip("0")
+    exponent -= len(digits) - len(stripped)
+    digits = stripped.rstrip("0")
+    if not digits:
+        return bytes(1 + digit_count // 2)
+    if len(digits) > digit_count or not -63 <= exponent <= 63:
+        return None
+    return bytes([exponent + 64]) + bytes.fromhex(digits.ljust(digit_count, "0"))
+
+
+def encode_single(text: str) -> bytes | None:
+    """4-byte BCD for a literal, or None if single_to_string would not give the same text back."""
+    bcd = _encode_bcd(text, _SINGLE_LITERAL, 6)
+    if bcd is None or single_to_string(bcd) != text:
+        return None
+    return bcd
+
+
+def encode_double(text: str) -> bytes | None:
+    """8-byte BCD for a literal, or None if double_to_string would not give the same text back."""
+    bcd = _encode_bcd(text, _DOUBLE_LITERAL, 14)
+    if bcd is None or double_to_string(bcd) != text:
+        return None
+    return bcd
@@ -0,0 +1,110 @@
+"""RENUM for program text, with the rules of the MSX-BASIC RENUM new,old,step command."""
+from __future__ import annotations
+
+from typing import Callable, NamedTuple
+
+from msx_basic_analyzer import line_references
+from msx_basic_lexer import split_line_number
+
+# Highest line number the interpreter accepts.
+MAX_LINE_NUMBER = 65529
+# Lines between two calls of the check callback (cancellation of a background job).
+CHECK_EVERY = 500
+
+
+class RenumConflict(NamedTuple):
+    kind: str  # 'order', 'overflow' (nothing renumbered), 'undefined', 'duplicate' (renumbered anyway)
+    line_num: int | None  # line where it happens, as numbered after RENUM
+    target: int | None = None  # 'undefined': the missing line; 'order'/'overflow': the offending number
+
+
+class RenumResult(NamedTuple):
+    lines: list[str]  # same length as the input; blank lines stay where they were
+    mapping: dict[int, int]  # old -> new number of every renumbered line
+    conflicts: list[RenumConflict]
+    applied: bool  # False when an 'order' or 'overflow' conflict left the program untouched
+
+
+def renumber(
+    lines: list[str],
+    new_start: int = 10,
+    old_start: int | None = None,
+    increment: int = 10,
+    old_end: int | None = None,
+    dialect: str | None = None,
+    check: Callable[[], None] | None = None,
+) -> RenumResult:
+    """Renumber the lines from old_start (default: the first) to old_end (default: the last).
+
+    The renumbered lines start at new_start and go up by increment.
+    Unnumbered lines inside the range get a number too. Every GOTO, GOSUB,
+    THEN, ON ... GOTO, RESTORE, etc. in the whole program is updated in
+    one lexer pass per line. Like the MSX, RENUM refuses to move lines past
+    their neighbours outside the range, and leaves references to missing
+    lines alone ("Undefined line n in m").
+    """
+    if increment < 1:
+        raise ValueError("increment must be positive")
+    numbers = [split_line_number(line) if line.strip() else (None, 0) for line in lines]
+    code_lines = [i for i, line in enumerate(lines) if line.strip()]
+
+    # Range by position: from the first line >= old_start to the last line <= old_end.
+    first = next(
+        (i for i in code_lines if old_start is None or (numbers[i][0] is not None and numbers[i][0] >= old_start)),
+        len(lines),
+    )
+    last = next(
+        (i for i in reversed(code_lines) if old_end is None or (numbers[i][0] is not None and numbers[i][0] <= old_end)),
+        -1,
+    )
+    in_range = [i for i in code_lines if first <= i <= last]
+    new_numbers = {i: new_start + n * increment for n, i in enumerate(in_range)}
+
+    conflicts: list[RenumConflict] = []
+    if new_numbers:
+        highest = new_numbers[in_range[-1]]
+        if highest > MAX_LINE_NUMBER:
+            conflicts.append(RenumConflict("overflow", None, highest))
+        before = [numbers[i][0] for i in code_lines if i < first and numbers[i][0] is not None]
+        after = [numbers[i][0] for i in code_lines if i > last and numbers[i][0] is not None]
+        if before and max(before) >= new_start:
+            conflicts.append(RenumConflict("order", max(before), new_start))
+        if after and min(after) <= highest:
+            conflicts.append(RenumConflict("order", min(after), highest))
+    if conflicts:
+        return RenumResult(list(lines), {}, conflicts, False)
+
+    mapping: dict[int, int] = {}
+    existing: set[int] = set()
+    for i in code_lines:
+        old = numbers[i][0]
+        if old is None:
+            continue
+        if old in existing:
+            conflicts.append(RenumConflict("duplicate", new_numbers.get(i, old), old))
+        existing.add(old)
+        if i in new_numbers:
+            # A repeated number refers to its last line, the one the interpreter keeps.
+            mapping[old] = new_numbers[i]
+
+    result: list[str] = []
+    for count, (line, (old, code_start)) in enumerate(zip(lines, numbers), 1):
+        if check is not None and count % CHECK_EVERY == 0:
+            check()
+        if not line.strip():
+            result.append(line)
+            continue
+        line_num = new_numbers.get(count - 1, old)
+        code = line[code_start:]
+        for target, start, end in reversed(line_references(code, dialect=dialect)):
+            if target in mapping:
+                code = code[:start] + str(mapping[target]) + code[end:]
+            elif target not in existing:
+                conflicts.append(RenumConflict("undefined", line_num, target))
+        if count - 1 in new_numbers:
+            result.append(f"{line_num} {code.strip()}")
+        else:
+            result.append(line[:code_start] + code)
+
+    conflicts.sort(key=lambda conflict: (conflict.line_num or 0, conflict.target or 0))
+    return RenumResult(result, mapping, conflicts, True)
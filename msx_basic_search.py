@@ -0,0 +1,161 @@
+"""Find over a snapshot of the editor text: every match offset, kept sorted, tagged lazily by the editor."""
+from __future__ import annotations
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SearchIndex:
+    """Sorted start/end offsets of every match of the current query in one text snapshot.
+
+    Searching runs on the Python string (str.find or a compiled regex), so
+    the count is known at once and the editor only tags the matches near
+    the viewport. When a plain query is extended while typing ("PRI" ->
+    "PRIN"), the previous matches are narrowed instead of searched again.
+    """
+
+    def __init__(self, text: str = "") -> None:
+        self.query = ""
+        self.regex = False
+        self.case_sensitive = False
+        self.error: str | None = None  # message of an invalid regular expression
+        self._pattern: re.Pattern | None = None
+        self.starts = array("I")
+        self.ends = array("I")
+        self.set_text(text)
+
+    def set_text(self, text: str) -> None:
+        """New snapshot; the matches are cleared until the next search."""
+        self.text = text
+        self._folded: str | None = None
+        self._line_starts = array("I", [0])
+        self._line_starts.extend(match.end() for match in re.finditer("\n", text))
+        self.query = ""
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _haystack(self) -> str | None:
+        """Text a plain query is found in; None when lower() would not keep the offsets."""
+        if self.case_sensitive:
+            return self.text
+        if self._folded is None:
+            # lower() turns "İ" into two characters, moving every offset after it;
+            # "" marks such a text, which is searched with an IGNORECASE regex instead.
+            folded = self.text.lower()
+            self._folded = folded if len(folded) == len(self.text) else ""
+        return self._folded or None
+
+    def search(self, query: str, regex: bool = False, case_sensitive: bool = False) -> int:
+        """Find every match of query; returns the match count (0 for an invalid regex, see error)."""
+        narrow = (
+            not regex
+            and not self.regex
+            and case_sensitive == self.case_sensitive
+            and self.query
+            and query.startswith(self.query)
+        )
+        self.regex = regex
+        self.case_sensitive = case_sensitive
+        self.error = None
+        self._pattern = None
+        previous, self.query = self.starts, query
+        self.starts, self.ends = array("I"), array("I")
+        if not query:
+            return 0
+
+        if regex:
+            try:
+                pattern = re.compile(query, 0 if case_sensitive else re.IGNORECASE)
+            except re.error as exc:
+                self.error = str(exc)
+                return 0
+            self._pattern = pattern
+            for match in pattern.finditer(self.text):
+                if match.end() > match.start():  # empty matches cannot be shown
+                    self.starts.append(match.start())
+                    self.ends.append(match.end())
+            return len(self.starts)
+
+        haystack = self._haystack()
+        if haystack is None:
+            self._search_ignoring_case(query, previous if narrow else None)
+            return len(self.starts)
+        needle = query if case_sensitive else query.lower()
+        size = len(needle)
+        if narrow:
+            # Every match of the longer query starts where a match of the shorter one did.
+            starts = array("I", (start for start in previous if haystack.startswith(needle, start)))
+        else:
+            starts = array("I")
+            find = haystack.find
+            start = find(needle)
+            while start != -1:
+                starts.append(start)
+                start = find(needle, start + 1)
+        self.starts = starts
+        self.ends = array("I", (start + size for start in starts))
+        return len(starts)
+
+    def _search_ignoring_case(self, query: str, previous: array | None) -> None:
+        """Plain case-insensitive search on the text itself, overlapping like str.find."""
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        if previous is not None:
+            matches = (pattern.match(self.text, start) for start in previous)
+        else:
+            matches = []
+            match = pattern.search(self.text)
+            while match:
+                matches.append(match)
+                match = pattern.search(self.text, match.start() + 1)
+        for match in matches:
+            if match:
+                self.starts.append(match.start())
+                self.ends.append(match.end())
+
+    def replacements(self, template: str) -> list[str]:
+        """Replacement text of every match, in order; regex templates may use \\1 or \\g<name>.
+
+        Raises re.error for a template that refers to a missing group.
+        """
+        if self._pattern is None:
+            return [template] * len(self.starts)
+        return [match.expand(template) for match in self._pattern.finditer(self.text) if match.end() > match.start()]
+
+    def offset(self, line: int, column: int) -> int:
+        """Text offset of a 1-based line and 0-based column, as in a Tk index."""
+        line = min(max(line, 1), len(self._line_starts))
+        return self._line_starts[line - 1] + column
+
+    def position(self, offset: int) -> tuple[int, int]:
+        """1-based line and 0-based column of a text offset."""
+        line = bisect_right(self._line_starts, offset)
+        return line, offset - self._line_starts[line - 1]
+
+    def line_text(self, line: int) -> str:
+        """Text of a 1-based line, without its newline."""
+        start = self._line_starts[line - 1]
+        end = self._line_starts[line] - 1 if line < len(self._line_starts) else len(self.text)
+        return self.text[start:end]
+
+    def matches_between(self, first_line: int, last_line: int) -> list[tuple[int, int]]:
+        """(start, end) offsets of the matches that start on lines first_line..last_line."""
+        low = bisect_left(self.starts, self.offset(first_line, 0))
+        if last_line < len(self._line_starts):
+            high = bisect_left(self.starts, self._line_starts[last_line])
+        else:
+            high = len(self.starts)
+        return list(zip(self.starts[low:high], self.ends[low:high]))
+
+    def next_match(self, offset: int, backwards: bool = False) -> int | None:
+        """Number of the first match at or after offset (before it, backwards), wrapping around."""
+        if not self.starts:
+            return None
+        if backwards:
+            number = bisect_left(self.starts, offset) - 1
+            return number % len(self.starts)
+        number = bisect_left(self.starts, offset)
+        return number if number < len(self.starts) else 0
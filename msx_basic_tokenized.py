@@ -0,0 +1,174 @@
+"""RENUM, MERGE and DELETE on tokenized programs, without going through text.
+
+The operations take and return the bytes of a SAVE "FILE" program. Line
+bodies are copied as they are; only the 0x0E line-reference operands and
+the next-line links are rewritten, so numbers never pass through
+custom_bcd_to_string and back.
+"""
+from __future__ import annotations
+
+from typing import Iterable
+
+from msx_basic_decoder import TOKEN_MAP, MSXBasicLineIndex
+from msx_basic_encoder import BASIC_START_ADDRESS, MAX_LINE_NUMBER
+from msx_basic_renum import RenumConflict
+
+LINE_REF = 0x0E
+_QUOTE = 0x22
+_COLON = 0x3A
+_REM = 0x81 + TOKEN_MAP.index("REM")
+_DATA = 0x81 + TOKEN_MAP.index("DATA")
+
+
+def _build_operand_sizes() -> bytes:
+    """Bytes that follow each token byte as its operand (numbers, extended tokens)."""
+    sizes = bytearray(256)
+    for byte in (0x0B, 0x0C, 0x0D, 0x0E, 0x1C):  # octal, hex, line pointer, line number, integer
+        sizes[byte] = 2
+    sizes[0x0F] = 1  # integer 10..255
+    sizes[0x1D] = 4  # single
+    sizes[0x1F] = 8  # double
+    sizes[0xFF] = 1  # function token
+    return bytes(sizes)
+
+
+_OPERAND_SIZES = _build_operand_sizes()
+
+
+def split_program(data: bytes | bytearray | memoryview) -> list[tuple[int, bytes]]:
+    """(line number, tokens without the 0x00 terminator) of every line, in file order."""
+    index = MSXBasicLineIndex(data)
+    view = index.data
+    return [
+        (line_number, bytes(view[offset + 4:offset + length - 1]))
+        for line_number, offset, length in zip(index.line_numbers, index.offsets, index.lengths)
+    ]
+
+
+def link_program(lines: Iterable[tuple[int, bytes]]) -> bytes:
+    """Tokenized program of the lines as given, with the next-line links recomputed."""
+    out = bytearray(b"\xFF")
+    for line_number, body in lines:
+        link = BASIC_START_ADDRESS + len(out) - 1 + 4 + len(body) + 1
+        if link > 0xFFFF:
+            raise ValueError(f"line {line_number}: program does not fit in the MSX address space")
+        out += bytes([link & 0xFF, link >> 8, line_number & 0xFF, line_number >> 8])
+        out += body
+        out += b"\x00"
+    out += b"\x00\x00"
+    return bytes(out)
+
+
+def line_reference_offsets(body: bytes) -> list[int]:
+    """Offsets of the 0x0E tokens in a line body, skipping strings, comments, DATA and number operands."""
+    offsets: list[int] = []
+    if LINE_REF not in body:
+        return offsets
+    size = len(body)
+    operand_sizes = _OPERAND_SIZES
+    pos = 0
+    while pos < size:
+        byte = body[pos]
+        if byte == LINE_REF:
+            offsets.append(pos)
+        elif byte == _QUOTE:
+            end = body.find(b'"', pos + 1)
+            if end == -1:
+                break
+            pos = end + 1
+            continue
+        elif byte == _REM:  # REM, and ' which is stored as :REM'
+            break
+        elif byte == _DATA:
+            quoted = False
+            pos += 1
+            while pos < size and (quoted or body[pos] != _COLON):
+                if body[pos] == _QUOTE:
+                    quoted = not quoted
+                pos += 1
+            continue
+        pos += 1 + operand_sizes[byte]
+    return offsets
+
+
+def renumber_tokenized(
+    data: bytes | bytearray | memoryview,
+    new_start: int = 10,
+    old_start: int | None = None,
+    increment: int = 10,
+    old_end: int | None = None,
+) -> tuple[bytes, list[RenumConflict]]:
+    """RENUM new,old,step on a tokenized program; lines past old_end keep their numbers.
+
+    Returns the new program and the references to missing lines, which are
+    left as they are ('undefined' conflicts, numbered as after RENUM).
+    Raises ValueError when the new numbers would pass a line outside the
+    range or go above 65529, like the MSX's "Illegal function call".
+    Target 0 is never touched: ON ERROR GOTO 0 is not a jump.
+    """
+    if increment < 1:
+        raise ValueError("increment must be positive")
+    lines = split_program(data)
+    in_range = [
+        (old_start is None or number >= old_start) and (old_end is None or number <= old_end)
+        for number, _body in lines
+    ]
+    count = sum(in_range)
+    if count:
+        highest = new_start + (count - 1) * increment
+        if highest > MAX_LINE_NUMBER:
+            raise ValueError(f"renumbered lines would reach {highest}, above {MAX_LINE_NUMBER}")
+        for (number, _body), renumbered in zip(lines, in_range):
+            if renumbered:
+                continue
+            # Lines left out keep their side of the range: below it stay below, above stay above.
+            below = old_start is not None and number < old_start
+            if (below and number >= new_start) or (not below and number <= highest):
+                raise ValueError(f"renumbered lines {new_start}-{highest} would pass line {number}")
+
+    mapping: dict[int, int] = {}
+    numbers: list[int] = []
+    new_number = new_start
+    for (number, _body), renumbered in zip(lines, in_range):
+        if renumbered:
+            mapping[number] = new_number
+            numbers.append(new_number)
+            new_number += increment
+        else:
+            numbers.append(number)
+    existing = {number for number, _body in lines}
+
+    conflicts: list[RenumConflict] = []
+    result: list[tuple[int, bytes]] = []
+    for line_number, (_old, body) in zip(numbers, lines):
+        offsets = line_reference_offsets(body)
+        if offsets:
+            patched = bytearray(body)
+            for offset in offsets:
+                target = patched[offset + 1] | (patched[offset + 2] << 8)
+                if target in mapping and target != 0:
+                    new_target = mapping[target]
+                    patched[offset + 1] = new_target & 0xFF
+                    patched[offset + 2] = new_target >> 8
+                elif target not in existing and target != 0:
+                    conflicts.append(RenumConflict("undefined", line_number, target))
+            body = bytes(patched)
+        result.append((line_number, body))
+    result.sort(key=lambda line: line[0])
+    return link_program(result), conflicts
+
+
+def merge_tokenized(base: bytes | bytearray | memoryview, *others: bytes | bytearray | memoryview) -> bytes:
+    """MERGE: the lines of each other program replace base lines with the same number."""
+    lines = dict(split_program(base))
+    for other in others:
+        lines.update(split_program(other))
+    return link_program(sorted(lines.items()))
+
+
+def delete_tokenized(data: bytes | bytearray | memoryview, first: int, last: int | None = None) -> bytes:
+    """DELETE first-last (last defaults to first; use 65529 for "to the end")."""
+    last = first if last is None else last
+    return link_program(
+        (line_number, body) for line_number, body in split_program(data) if not first <= line_number <= last
+    )
@@ -6,6 +6,8 @@ from tkinter import messagebox
 import customtkinter as ctk
 from PIL import Image, ImageTk
 
+from job_executor import JobExecutor
+
 MSX_PALETTE = [
     (0, 0, 0),  # 0: transparent (black)
     (0, 0, 0),  # 1: black
@@ -26,6 +28,58 @@ MSX_PALETTE = [
 ]
 
 
+def process_msx_screen2(data: bytes, mode: str) -> Image.Image:
+    width, height = 256, 192
+    img = Image.new("RGB", (width, height), "black")
+    pixels = img.load()
+
+    base_pattern = 0
+    base_color = 0x1800
+
+    for t in range(3):
+        for a in range(256):
+            col_char = a % 32
+            row_char = a // 32
+
+            block_offset = (a * 8) + (t * 0x800)
+            screen_x_base = col_char * 8
+            screen_y_base = (t * 64) + (row_char * 8)
+
+            for d in range(8):
+                pattern_byte = data[base_pattern + block_offset + d]
+                color_byte = data[base_color + block_offset + d]
+
+                fg_idx = (color_byte >> 4) & 0x0F
+                bg_idx = color_byte & 0x0F
+
+                if mode == "bw":
+                    fg_rgb = MSX_PALETTE[15]
+                    bg_rgb = MSX_PALETTE[1]
+                elif mode == "color":
+                    pattern_byte = 0xF0
+                    fg_rgb = MSX_PALETTE[fg_idx]
+                    bg_rgb = MSX_PALETTE[bg_idx]
+                else:
+                    fg_rgb = MSX_PALETTE[fg_idx]
+                    bg_rgb = MSX_PALETTE[bg_idx]
+
+                for e in range(8):
+                    bit = (pattern_byte >> (7 - e)) & 1
+                    if bit == 1:
+                        pixels[screen_x_base + e, screen_y_base + d] = fg_rgb
+                    else:
+                        pixels[screen_x_base + e, screen_y_base + d] = bg_rgb
+
+    return img
+
+
+def render_screen2(data: bytes, mode: str, zoom: int) -> tuple[Image.Image, Image.Image]:
+    """Worker-process job: the SCREEN 2 image and its zoomed copy."""
+    image = process_msx_screen2(data, mode)
+    w, h = image.size
+    return image, image.resize((w * zoom, h * zoom), Image.NEAREST)
+
+
 class ScreenViewerFrame(ctk.CTkFrame):
     def __init__(self, parent: ctk.CTk, file_path: str | None = None) -> None:
         super().__init__(parent)
@@ -106,62 +160,25 @@ class ScreenViewerFrame(ctk.CTkFrame):
         except Exception as exc:
             messagebox.showerror("Erro", f"Falha ao ler arquivo: {exc}")
 
-    def _process_msx_screen2(self, data: bytes, mode: str) -> Image.Image:
-        width, height = 256, 192
-        img = Image.new("RGB", (width, height), "black")
-        pixels = img.load()
-
-        base_pattern = 0
-        base_color = 0x1800
-
-        for t in range(3):
-            for a in range(256):
-                col_char = a % 32
-                row_char = a // 32
-
-                block_offset = (a * 8) + (t * 0x800)
-                screen_x_base = col_char * 8
-                screen_y_base = (t * 64) + (row_char * 8)
-
-                for d in range(8):
-                    pattern_byte = data[base_pattern + block_offset + d]
-                    color_byte = data[base_color + block_offset + d]
-
-                    fg_idx = (color_byte >> 4) & 0x0F
-                    bg_idx = color_byte & 0x0F
-
-                    if mode == "bw":
-                        fg_rgb = MSX_PALETTE[15]
-                        bg_rgb = MSX_PALETTE[1]
-                    elif mode == "color":
-                        pattern_byte = 0xF0
-                        fg_rgb = MSX_PALETTE[fg_idx]
-                        bg_rgb = MSX_PALETTE[bg_idx]
-                    else:
-                        fg_rgb = MSX_PALETTE[fg_idx]
-                        bg_rgb = MSX_PALETTE[bg_idx]
-
-                    for e in range(8):
-                        bit = (pattern_byte >> (7 - e)) & 1
-                        if bit == 1:
-                            pixels[screen_x_base + e, screen_y_base + d] = fg_rgb
-                        else:
-                            pixels[screen_x_base + e, screen_y_base + d] = bg_rgb
-
-        return img
-
     def _update_display(self) -> None:
         if self.raw_data is None:
             return
 
-        mode = self.mode_var.get()
-        self.original_image = self._process_msx_screen2(self.raw_data, mode)
-
-        w, h = self.original_image.size
-        new_w = w * self.current_zoom
-        new_h = h * self.current_zoom
+        # The pixel loop is pure Python and holds the GIL, so it runs in a worker process;
+        # only the PhotoImage is made on the Tk thread.
+        JobExecutor.for_widget(self).submit(
+            render_screen2,
+            self.raw_data,
+            self.mode_var.get(),
+            self.current_zoom,
+            key=f"screen-viewer-{id(self)}",
+            on_done=self._show_image,
+            on_error=lambda exc: messagebox.showerror("Erro", f"Falha ao decodificar imagem: {exc}"),
+            process=True,
+        )
 
-        zoomed_img = self.original_image.resize((new_w, new_h), Image.NEAREST)
+    def _show_image(self, images: tuple[Image.Image, Image.Image]) -> None:
+        self.original_image, zoomed_img = images
         self.tk_image = ImageTk.PhotoImage(zoomed_img)
         self.image_label.configure(image=self.tk_image, text="")
 
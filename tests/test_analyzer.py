@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from msx_basic_analyzer import MSXBasicAnalyzer, analyze_line, cross_references
+from msx_basic_memory import MemoryModel
+
+DIGNIFIED = "MSX Basic Dignified"
+PROGRAM = "10 ## this is a note\n20 DEFINE X\n30 {start} B=1 ## B is set here\n40 GOTO 30\n"
+
+
+def test_dignified_comment_is_not_code() -> None:
+    assert analyze_line("10 ## this is a note", DIGNIFIED).variables == ()
+    # Without the dialect the same line is MSX-BASIC: '#' is plain and the words are names.
+    assert analyze_line("10 ## this is a note").variables
+
+
+def test_dignified_label_and_comment_in_program() -> None:
+    analyzer = MSXBasicAnalyzer(PROGRAM, DIGNIFIED)
+    analyzer.analyze()
+    summary = analyzer.get_summary()
+    assert sorted(summary["variables"]) == ["B", "X"]
+    assert [variable.name for variable in summary["memory"].variables] == ["B!", "X!"]
+
+
+def test_set_dialect_lexes_again() -> None:
+    analyzer = MSXBasicAnalyzer(PROGRAM)
+    analyzer.analyze()
+    assert "THIS" in analyzer.variables
+    analyzer.set_dialect(DIGNIFIED)
+    analyzer.analyze()
+    assert "THIS" not in analyzer.variables
+
+
+def test_cross_references_skip_label() -> None:
+    _line_num, refs = cross_references("30 {start} B=1 ## B is set here", DIGNIFIED)
+    assert [(ref.kind, ref.name, ref.access) for ref in refs] == [("variable", "B", "write")]
+
+
+def test_memory_model_dialect() -> None:
+    report = MemoryModel(DIGNIFIED).update(PROGRAM.splitlines())
+    assert [variable.name for variable in report.variables] == ["B!", "X!"]
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from msx_basic_batch import convert_tree
+from msx_basic_encoder import encode_msx_basic
+
+
+def test_tokenized_asc_file_is_not_overwritten(tmp_path: Path) -> None:
+    data = encode_msx_basic("10 PRINT 1\n")
+    (tmp_path / "game.asc").write_bytes(data)
+    (tmp_path / "DEMO.BAS").write_bytes(data)
+
+    results = {Path(result.source).name: result for result in convert_tree(tmp_path, jobs=1)}
+
+    assert results["game.asc"].error is not None
+    assert (tmp_path / "game.asc").read_bytes() == data
+    assert results["DEMO.BAS"].error is None
+    assert (tmp_path / "DEMO.asc").read_text(encoding="latin-1") == "10 PRINT 1\n"
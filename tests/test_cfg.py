@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+from benchmarks.corpus import CorpusSpec, generate_corpus
+from msx_basic_analyzer import MSXBasicAnalyzer
+
+
+def _cfg(text: str):
+    analyzer = MSXBasicAnalyzer(text)
+    analyzer.analyze()
+    return analyzer.control_flow_graph()
+
+
+def _expand(cfg, runs: list[tuple[int, int]]) -> list[int]:
+    lines = list(cfg.lines)
+    return [line for first, last in runs for line in lines[lines.index(first):lines.index(last) + 1]]
+
+
+def test_subroutine_extents_match_single_walks() -> None:
+    cfg = _cfg(generate_corpus(CorpusSpec(lines=400)).text)
+    extents = cfg.subroutine_extents()
+    assert list(extents) == cfg.subroutine_entries()
+    for entry, runs in extents.items():
+        assert _expand(cfg, runs) == cfg.subroutine_extent(entry)
+
+
+def test_subroutine_extent_stops_at_return_and_calls() -> None:
+    cfg = _cfg(
+        "10 GOSUB 100\n20 END\n"
+        "100 PRINT:GOSUB 200\n110 RETURN\n"
+        "200 PRINT\n210 RETURN\n"
+    )
+    assert cfg.subroutine_extents() == {100: [(100, 110)], 200: [(200, 210)]}
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import random
+
+from msx_basic_document import ProgramDocument
+
+
+def _fresh_index(document: ProgramDocument) -> tuple[list[int], list[int]]:
+    return ProgramDocument(document.text())._number_index()
+
+
+def test_edits_keep_the_number_index_sorted() -> None:
+    rnd = random.Random(4)
+    document = ProgramDocument("\n".join(f"{10 * n} PRINT {n}" for n in range(1, 40)))
+    document.find_line(10)  # build the index, so the edits below update it in place
+    for _ in range(500):
+        first = rnd.randint(1, len(document) + 1)
+        last = rnd.randint(first - 1, min(first + 3, len(document)))
+        choices = ["", "REM x", f"{rnd.randint(0, 60) * 10} A=1", " 5 B=2"]
+        new_lines = [rnd.choice(choices) for _ in range(rnd.randint(0, 3))]
+        document.replace_lines(first, last, new_lines)
+        assert document._number_index() == _fresh_index(document)
+
+
+def test_find_line_after_inserting_above() -> None:
+    document = ProgramDocument("10 A=1\n20 B=2\n30 C=3")
+    assert document.find_line(30) == 3
+    document.replace_lines(1, 0, ["5 REM", "7 REM"])
+    assert document.find_line(30) == 5
+    assert document.lines_between(6, 20) == [2, 3, 4]
+    document.replace_lines(2, 4, ["20 B=4"])
+    assert [document.find_line(number) for number in (5, 7, 10, 20, 30)] == [1, None, None, 2, 3]
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.corpus import CorpusSpec, generate_corpus
+from msx_basic_decoder import decode_msx_basic
+from msx_basic_encoder import encode_msx_basic, encode_msx_basic_line, encoded_size
+from msx_basic_lexer import scan, split_line_number
+
+
+# Larger programs no longer fit the MSX address space (see generate_corpus).
+CORPUS_LINES = 600
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_round_trip_of_decoded_listing(seed: int) -> None:
+    corpus = generate_corpus(CorpusSpec(lines=CORPUS_LINES, seed=seed))
+    assert decode_msx_basic(encode_msx_basic(corpus.text)) == corpus.text
+
+
+def test_encoding_matches_corpus_bytes() -> None:
+    corpus = generate_corpus(CorpusSpec(lines=CORPUS_LINES))
+    assert encode_msx_basic(corpus.text) == corpus.data
+
+
+def test_keywords_inside_names() -> None:
+    # IF X > Y THEN 10: the THEN is a keyword and 10 a line reference, as on the MSX.
+    data = encode_msx_basic("20 IFX>YTHEN10\n")
+    assert data[5:-3] == bytes([0x8B, 0x58, 0xEE, 0x59, 0xDA, 0x0E, 0x0A, 0x00])
+
+
+def test_both_ends_of_a_range_are_line_references() -> None:
+    data = encode_msx_basic("10 DELETE 10-20\n")
+    assert data[5:-3] == bytes([0xA8, 0x20, 0x0E, 0x0A, 0x00, 0xF2, 0x0E, 0x14, 0x00])
+    assert decode_msx_basic(data) == "10 DELETE 10-20\n"
+
+
+@pytest.mark.parametrize(
+    "code",
+    ["A3.51", "X%&B1013.5", "A1&H1FELSE", "LIST 10-20,A", "PRINT \"A\";B$:REM X", "DATA 1,2:GOTO 10"],
+)
+def test_encoded_size_of_tricky_lines(code: str) -> None:
+    assert encoded_size(code, scan(code)) == len(encode_msx_basic_line(code))
+
+
+def test_encoded_size_matches_encoder_on_corpus() -> None:
+    corpus = generate_corpus(CorpusSpec(lines=CORPUS_LINES))
+    for line in corpus.text.splitlines():
+        code = line[split_line_number(line)[1]:]
+        assert encoded_size(code, scan(code)) == len(encode_msx_basic_line(code)), line
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.corpus import CorpusSpec, generate_corpus
+from msx_basic_lexer import DIALECTS, scan, split_line_number, tokenize
+
+
+def _scanned(code: str, dialect: str | None = None) -> list[tuple[str, str]]:
+    """What scan() should return: the tokens without comment and DATA text, upper-cased."""
+    return [
+        (token.kind, token.text.upper())
+        for token in tokenize(code, dialect=dialect)
+        if token.kind not in ("comment", "data")
+    ]
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "DATA DON'T:GOTO 10",  # the ' is DATA text, not a comment
+        "IF AOREM THEN 20",  # OR EM, no REM
+        "X=&H1FDATA:PRINT",  # &H1FDA TA, no DATA
+        "REM:GOTO 10",
+        "A$=\"REM\"'note",
+        "FORI=1TO9:NEXT",
+    ],
+)
+def test_scan_matches_tokenize(code: str) -> None:
+    assert scan(code) == _scanned(code)
+
+
+@pytest.mark.parametrize("dialect", DIALECTS)
+def test_scan_matches_tokenize_on_corpus(dialect: str) -> None:
+    corpus = generate_corpus(CorpusSpec(lines=600))
+    for line in corpus.text.splitlines():
+        code = line[split_line_number(line)[1]:]
+        assert scan(code, dialect) == _scanned(code, dialect), line
+
+
+def test_dignified_labels_and_comments() -> None:
+    code = "{start} A=1 ## note"
+    expected = [("label", "{START}"), ("identifier", "A"), ("command", "="), ("number", "1")]
+    assert scan(code, "MSX Basic Dignified") == expected
+
+
+def test_columns_survive_non_ascii_letters() -> None:
+    # "ß".upper() is "SS"; upper-casing it would move GOTO one column to the right.
+    tokens = tokenize('PRINT"ß":GOTO 10')
+    assert [(token.text, token.start) for token in tokens][-2:] == [("GOTO", 9), ("10", 14)]
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from msx_basic_search import SearchIndex
+
+
+def _found(index: SearchIndex) -> list[str]:
+    return [index.text[start:end] for start, end in zip(index.starts, index.ends)]
+
+
+def test_offsets_after_a_character_that_lower_expands() -> None:
+    # "İ".lower() is two characters; offsets must still point into the text itself.
+    index = SearchIndex('10 PRINT "İSTANBUL"\n20 print "istanbul"')
+    assert index.search("print") == 2
+    assert _found(index) == ["PRINT", "print"]
+    assert index.search("printx") == 0
+
+
+def test_narrowing_while_typing_without_lower() -> None:
+    index = SearchIndex("İ aaaa")
+    assert index.search("aa") == 3
+    assert index.search("aaa") == 2
+    assert list(index.starts) == [2, 3]